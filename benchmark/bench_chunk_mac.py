@@ -0,0 +1,37 @@
+"""分塊 MAC 計算 效能比較
+
+比較 general/crypto.py 的 aes_cbc_mac 與 upload_c 原本逐 16 bytes 加密的迴圈
+並以每 GB 的 CPU 秒數表示, 正確性檢查 (含已知答案向量) 見 checks/check_chunk_mac.py
+
+用法:
+python -m benchmark.bench_chunk_mac [-s SIZE_MB]
+"""
+from checks.check_chunk_mac import legacy_chunk_mac
+from general.crypto import aes_cbc_mac, get_chunks
+from time import process_time
+import argparse
+import os
+
+
+def cpu_per_gb(mac, data: bytes, key: bytes, iv: bytes) -> float:
+    """依照 get_chunks 分塊計算 MAC, 回傳每 GB 的 CPU 秒數"""
+    start = process_time()
+    for chunk_start, chunk_size in get_chunks(len(data)):
+        mac(data[chunk_start:chunk_start + chunk_size], key, iv)
+    return (process_time() - start) * (1024 ** 3) / len(data)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--size', type=int, default=64, help='測試資料大小 MB')
+    argv = parser.parse_args()
+
+    key = os.urandom(16)
+    iv = os.urandom(8) * 2
+    data = os.urandom(argv.size * 1024 * 1024)
+
+    legacy = cpu_per_gb(lambda chunk, k, i: legacy_chunk_mac(chunk, k, i, len(data))[0], data, key, iv)
+    current = cpu_per_gb(aes_cbc_mac, data, key, iv)
+    print(f'原本 CPU秒/GB: {legacy:.2f}')
+    print(f'目前 CPU秒/GB: {current:.2f}')
+    print(f'倍數: {legacy / current:.1f}')
@@ -0,0 +1,77 @@
+"""登入金鑰計算 效能比較
+
+比較 general/crypto.py 的 prepare_key, stringhash 與原本逐次建立 cipher 的實作
+並確認輸出完全相同
+
+用法:
+python -m benchmark.bench_crypto [-r ROUNDS]
+"""
+from general.crypto import aes_cbc_encrypt_a32, a32_to_base64, str_to_a32, prepare_key, stringhash
+from time import process_time
+import argparse
+import random
+import string
+
+
+def legacy_stringhash(str, aeskey):
+    """原本的 stringhash"""
+    s32 = str_to_a32(str)
+    h32 = [0, 0, 0, 0]
+    for i in range(len(s32)):
+        h32[i % 4] ^= s32[i]
+    for r in range(0x4000):
+        h32 = aes_cbc_encrypt_a32(h32, aeskey)
+    return a32_to_base64((h32[0], h32[2]))
+
+
+def legacy_prepare_key(arr):
+    """原本的 prepare_key"""
+    pkey = [0x93C467E3, 0x7DB0C7A4, 0xD1BE3F81, 0x0152CB56]
+    for r in range(0x10000):
+        for j in range(0, len(arr), 4):
+            key = [0, 0, 0, 0]
+            for i in range(4):
+                if i + j < len(arr):
+                    key[i] = arr[i + j]
+            pkey = aes_cbc_encrypt_a32(pkey, key)
+    return pkey
+
+
+def login_cpu(prepare, hashing, email: str, password: str) -> float:
+    """計算一次 v1 帳號登入金鑰的 CPU 秒數"""
+    start = process_time()
+    password_aes = prepare(str_to_a32(password))
+    hashing(email, password_aes)
+    return process_time() - start
+
+
+def random_password(length: int) -> str:
+    return ''.join(random.choice(string.ascii_letters + string.digits) for _ in range(length))
+
+
+def check_identical():
+    """確認新舊實作輸出相同 包含空密碼 與 超過16字元(多把金鑰)的密碼"""
+    for length in (0, 1, 15, 16, 17, 31, 40):
+        password = random_password(length)
+        arr = str_to_a32(password)
+        new_key = prepare_key(arr)
+        assert tuple(new_key) == tuple(legacy_prepare_key(arr)), f'prepare_key 不一致, 長度 {length}'
+        email = f'{random_password(8)}@example.com'
+        assert stringhash(email, new_key) == legacy_stringhash(email, new_key), f'stringhash 不一致, 長度 {length}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--rounds', type=int, default=3, help='每種密碼長度的執行次數')
+    argv = parser.parse_args()
+
+    check_identical()
+    print('輸出一致')
+
+    print(f'{"密碼長度":<8}{"原本 CPU秒":>12}{"目前 CPU秒":>12}{"倍數":>8}')
+    for length in (12, 24):
+        password = random_password(length)
+        email = 'bench@example.com'
+        legacy = min(login_cpu(legacy_prepare_key, legacy_stringhash, email, password) for _ in range(argv.rounds))
+        current = min(login_cpu(prepare_key, stringhash, email, password) for _ in range(argv.rounds))
+        print(f'{length:<12}{legacy:>12.3f}{current:>12.3f}{legacy / current:>10.1f}')
@@ -0,0 +1,94 @@
+"""去重複備份 連續兩日備份的上傳量與時間 使用本地 mega 模擬伺服器
+
+第一日為類似 SQL dump 的資料, 第二日在隨機位置 插入/修改 少量資料並在結尾附加新資料,
+比較 每日完整上傳 (分割) 與 去重複備份 只上傳新分塊 的上傳量, 最後以第二日的說明檔還原並比對內容
+
+用法:
+python -m benchmark.bench_dedup [-s SIZE_MB] [-e EDITS] [-a APPEND_MB] [-c CONNECTIONS] [--chunk KB] [--compression CODEC] [-d DIR]
+"""
+from benchmark.mega_stub_server import start_server
+from benchmark.bench_e2e import ACCOUNT, PASSWORD, login, sql_block
+from general.mega_dedup import ChunkStore
+from general.mega_restore import MegaRestore
+from time import perf_counter
+import argparse
+import tempfile
+import hashlib
+import random
+import shutil
+import os
+
+
+def file_digest(path: str) -> bytes:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(data)
+    return digest.digest()
+
+
+def write_day(path: str, size: int, edits: int, append: int, seed: int):
+    """寫入測試檔 edits 為 0 時為第一日"""
+    data = bytearray(b''.join(sql_block(seed) for seed in range(size)))
+    rng = random.Random(seed)
+    for i in range(edits):
+        position = rng.randrange(len(data))
+        if i % 2:
+            data[position:position + 64] = os.urandom(64)
+        else:
+            data[position:position] = sql_block(1000 + i, 200)
+    if append:
+        data += b''.join(sql_block(2000 + i) for i in range(append))
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--size', type=int, default=256, help='第一日檔案大小 MB')
+    parser.add_argument('-e', '--edits', type=int, default=20, help='第二日 插入與修改的位置數')
+    parser.add_argument('-a', '--append', type=int, default=2, help='第二日 結尾附加的資料 MB')
+    parser.add_argument('-c', '--connections', type=int, default=4, help='單一檔案同時上傳的分塊數')
+    parser.add_argument('--chunk', type=int, default=1024, help='平均分塊大小 KB')
+    parser.add_argument('--compression', type=str, default=None, help='分塊壓縮 gzip, bz2, xz')
+    parser.add_argument('-d', '--dir', type=str, default=None, help='測試資料夾 預設系統暫存資料夾')
+    argv = parser.parse_args()
+
+    server = start_server(ACCOUNT, PASSWORD, keep_data=True)
+    client = login(server.api_url)
+    client.set_upload_connections(argv.connections)
+    nodes, _ = client.get_nodes()
+    root_id = [node['h'] for node in nodes if node['t'] == 2][0]
+    folder_id = client.create_folder_from_id('bench', root_id)['bench']
+
+    dir_path = tempfile.mkdtemp(dir=argv.dir)
+    path = os.path.join(dir_path, 'bench.tar')
+    try:
+        store = ChunkStore(client, folder_id, os.path.join(dir_path, 'chunks.json'), ACCOUNT)
+        store.set_chunk_size(argv.chunk * 1024)
+        store.set_compression(argv.compression)
+
+        print(f'檔案 {argv.size} MB, 第二日 {argv.edits} 處變動 附加 {argv.append} MB, 平均分塊 {argv.chunk} KB{f" 壓縮 {argv.compression}" if argv.compression else ""}')
+        for day, (edits, append) in enumerate([(0, 0), (argv.edits, argv.append)], 1):
+            write_day(path, argv.size, edits, append, seed=0)
+            size = os.path.getsize(path)
+            digest = file_digest(path)
+            before = server.state.stats['upload_bytes']
+            start = perf_counter()
+            recipe_path = store.backup(path)
+            wall = perf_counter() - start
+            uploaded = server.state.stats['upload_bytes'] - before
+            date_id = client.create_folder_from_id(f'2026010{day}', folder_id)[f'2026010{day}']
+            client.upload_c(recipe_path, dest=date_id)
+            print(f'第{day}日 {size / 1024 / 1024:>8.1f} MB 上傳 {uploaded / 1024 / 1024:>8.1f} MB ({uploaded / size:>6.1%}) 說明檔 {os.path.getsize(recipe_path) / 1024:>6.1f} KB {wall:>7.2f} s')
+            os.remove(recipe_path)
+
+        output_dir = os.path.join(dir_path, 'restore')
+        os.makedirs(output_dir)
+        start = perf_counter()
+        restored = MegaRestore(client, folder_id, argv.connections).restore('bench.tar', output_dir, '20260102')
+        wall = perf_counter() - start
+        print(f'還原第2日 {wall:.2f} s, 內容 {"相同" if file_digest(restored) == digest else "不同"}, pack 檔 {len(store.index.packs)} 個, 伺服器統計 {server.state.stats}')
+    finally:
+        server.shutdown()
+        shutil.rmtree(dir_path)
@@ -0,0 +1,234 @@
+"""分割 → 上傳 → (還原) → 過期刪除 端對端效能測試 使用本地 mega 模擬伺服器
+
+各階段在獨立子程序執行, 回報 吞吐量 MB/s, 每GB CPU秒數, 記憶體峰值 (RSS)
+
+用法:
+python -m benchmark.bench_e2e [-s SIZE_MB] [-p PART_MB] [-c CONNECTIONS] [-q QUEUE_DEPTH]
+                              [--latency MS] [--bandwidth MBPS] [--virtual] [--restore] [-d DIR]
+                              [--data {random,sql}] [--compression CODEC] [--level LEVEL] [-w SPLIT_WORKERS]
+"""
+from benchmark.mega_stub_server import start_server
+from general.mega_client import Mega_Custom
+from general.mega_index import NodeIndex
+from time import perf_counter
+import subprocess
+import hashlib
+import random
+import re
+import resource
+import argparse
+import tempfile
+import shutil
+import json
+import sys
+import os
+
+
+ACCOUNT = 'bench@example.com'
+PASSWORD = 'bench'
+
+
+def sql_block(seed: int, size: int = 1024 * 1024) -> bytes:
+    """產生類似 SQL dump 的資料 (可壓縮)"""
+    rng = random.Random(seed)
+    names = ['alice', 'bob', 'carol', 'dave', 'erin', 'frank', 'grace', 'heidi']
+    lines = []
+    length = 0
+    row = seed * 100000
+    while length < size:
+        line = f"INSERT INTO `orders` VALUES ({row},'{rng.choice(names)}',{rng.randint(1, 99999)},'2026-10-{rng.randint(1, 28):02d} {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00','{rng.getrandbits(32):08x}');\n"
+        lines.append(line)
+        length += len(line)
+        row += 1
+    return ''.join(lines).encode()[:size]
+
+
+def login(api_url: str) -> Mega_Custom:
+    client = Mega_Custom()
+    client.set_api_url(api_url)
+    return client.login_user(ACCOUNT, PASSWORD)
+
+
+def stage_split(argv) -> int:
+    """分割 回傳處理的 bytes"""
+    from general.mega_backup import MegaBackupFile
+    size = os.path.getsize(argv.path)
+    mbf = MegaBackupFile(argv.path, mega_folder_id=argv.folder_id)
+    mbf.set_chunk_size(argv.part * 1024 * 1024)
+    mbf.set_split_workers(argv.split_workers)
+    if argv.compression:
+        mbf.set_compression(argv.compression, argv.level)
+    if argv.virtual:
+        mbf.set_virtual_parts_on()
+    mbf.run_split()
+    return size
+
+
+def stage_upload(argv) -> int:
+    """上傳資料夾內所有分割檔 回傳上傳的 bytes"""
+    from general.mega_backup import MegaBackupFile
+    from general.mega_split import read_virtual_part, VIRTUAL_PART_EXTENSION, MANIFEST_EXTENSION
+    client = login(argv.api_url)
+    client.set_upload_connections(argv.connections)
+    client.set_upload_queue_depth(argv.queue_depth)
+
+    dir_path = os.path.dirname(argv.path)
+    parts = sorted(name for name in os.listdir(dir_path) if re.search(r'\.tar\._\d+(\.vpart|\.gz|\.bz2|\.xz)?$', name) or name.endswith(f'.tar{MANIFEST_EXTENSION}'))
+    size = 0
+    for name in parts:
+        path = os.path.join(dir_path, name)
+        size += read_virtual_part(path)['length'] if name.endswith(VIRTUAL_PART_EXTENSION) else os.path.getsize(path)
+        mbf = MegaBackupFile(path, mega_folder_id=argv.folder_id)
+        mbf.set_mega_client(client)
+        mbf.run()
+    return size
+
+
+def stage_restore(argv) -> int:
+    """下載並組合備份 回傳還原的 bytes"""
+    from general.mega_restore import MegaRestore
+    client = login(argv.api_url)
+    output_dir = os.path.join(os.path.dirname(argv.path), 'restore')
+    os.makedirs(output_dir, exist_ok=True)
+    path = MegaRestore(client, argv.folder_id, argv.connections).restore(os.path.basename(argv.path), output_dir)
+    return os.path.getsize(path)
+
+
+def stage_expire(argv) -> int:
+    """刪除過期節點 節點索引以 action packets 更新 回傳 0 (不以 bytes 計算)"""
+    from general.mega_expiry import ExpiryScheduler
+    client = login(argv.api_url)
+    node_index = NodeIndex(client, os.path.join(os.path.dirname(argv.path), 'nodes.json'), ACCOUNT)
+    ExpiryScheduler(client, argv.folder_id, expired_days=7, node_index=node_index).run_once()
+    return 0
+
+
+def max_rss() -> int:
+    """記憶體峰值 bytes
+
+    Linux 的 ru_maxrss 在 exec 後保留父程序的峰值, 優先使用 /proc 中本程序的 VmHWM
+    """
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_stage(argv):
+    """子程序 執行單一階段 將結果寫入 argv.result"""
+    stages = {'split': stage_split, 'upload': stage_upload, 'restore': stage_restore, 'expire': stage_expire}
+    # 扣除直譯器啟動與載入模組的 CPU
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    start = perf_counter()
+    size = stages[argv.stage](argv)
+    wall = perf_counter() - start
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    with open(argv.result, 'w') as f:
+        f.write(json.dumps({
+            'bytes': size,
+            'wall': wall,
+            'cpu': usage.ru_utime + usage.ru_stime - before.ru_utime - before.ru_stime,
+            'max_rss': max_rss()
+        }))
+
+
+def spawn(stage: str, argv, api_url: str, folder_id: str, path: str) -> dict:
+    """以子程序執行階段 回傳結果"""
+    result = os.path.join(os.path.dirname(path), f'{stage}.json')
+    cmd = [
+        sys.executable, '-m', 'benchmark.bench_e2e', '--stage', stage,
+        '--api-url', api_url, '--folder-id', folder_id, '--path', path, '--result', result,
+        '-p', str(argv.part), '-c', str(argv.connections), '-q', str(argv.queue_depth), '-w', str(argv.split_workers)
+    ]
+    if argv.compression:
+        cmd.extend(['--compression', argv.compression])
+    if argv.level is not None:
+        cmd.extend(['--level', str(argv.level)])
+    if argv.virtual:
+        cmd.append('--virtual')
+    env = dict(os.environ, LOG_FILE_DISABLE='1')
+    subprocess.run(cmd, check=True, env=env)
+    with open(result, 'r') as f:
+        return json.loads(f.read())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--size', type=int, default=512, help='測試檔案大小 MB')
+    parser.add_argument('-p', '--part', type=int, default=64, help='分割大小 MB')
+    parser.add_argument('-c', '--connections', type=int, default=4, help='單一檔案同時上傳的分塊數')
+    parser.add_argument('-q', '--queue-depth', type=int, default=4, help='預先加密的分塊數')
+    parser.add_argument('--latency', type=float, default=0, help='模擬伺服器 每次請求延遲 ms')
+    parser.add_argument('--bandwidth', type=float, default=0, help='模擬伺服器 每條上傳連線頻寬 MB/s, 0 為不限制')
+    parser.add_argument('--virtual', action='store_true', help='使用虛擬分割')
+    parser.add_argument('-w', '--split-workers', type=int, default=1, help='同時寫入(壓縮)的分割檔數')
+    parser.add_argument('--data', choices=['random', 'sql'], default='random', help='測試資料 random: 無法壓縮, sql: 類似 SQL dump')
+    parser.add_argument('--compression', type=str, default=None, help='分割時壓縮 gzip, bz2, xz')
+    parser.add_argument('--level', type=int, default=None, help='壓縮等級')
+    parser.add_argument('--restore', action='store_true', help='上傳後下載還原並比對內容 (模擬伺服器保存上傳內容 佔用記憶體)')
+    parser.add_argument('-d', '--dir', type=str, default=None, help='測試資料夾 預設系統暫存資料夾')
+    # 子程序參數
+    parser.add_argument('--stage', type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--api-url', type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--folder-id', type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--path', type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--result', type=str, default=None, help=argparse.SUPPRESS)
+    argv = parser.parse_args()
+
+    if argv.stage:
+        run_stage(argv)
+        sys.exit(0)
+
+    server = start_server(ACCOUNT, PASSWORD, latency=argv.latency / 1000, bandwidth=argv.bandwidth * 1000 * 1000, keep_data=argv.restore)
+    client = login(server.api_url)
+    nodes, _ = client.get_nodes()
+    root_id = [node['h'] for node in nodes if node['t'] == 2][0]
+    folder_id = client.create_folder_from_id('bench', root_id)['bench']
+
+    dir_path = tempfile.mkdtemp(dir=argv.dir)
+    path = os.path.join(dir_path, 'bench.tar')
+    try:
+        digest = hashlib.sha256()
+        # 類似 SQL dump 的資料 以 16 個不同的 1MB 區塊循環 (遠大於 gzip 的 32KB 視窗)
+        blocks = [sql_block(seed) for seed in range(16)] if argv.data == 'sql' else None
+        with open(path, 'wb') as f:
+            for i in range(argv.size):
+                data = blocks[i % len(blocks)] if blocks else os.urandom(1024 * 1024)
+                digest.update(data)
+                f.write(data)
+
+        # 上傳前建立節點索引 過期階段只需套用 action packets
+        NodeIndex(client, os.path.join(dir_path, 'nodes.json'), ACCOUNT).refresh()
+
+        results = []
+        results.append(('split', spawn('split', argv, server.api_url, folder_id, path)))
+        results.append(('upload', spawn('upload', argv, server.api_url, folder_id, path)))
+        uploaded = server.state.count_children(folder_id)
+        restored = None
+        if argv.restore:
+            results.append(('restore', spawn('restore', argv, server.api_url, folder_id, path)))
+            restored = hashlib.sha256()
+            with open(os.path.join(dir_path, 'restore', os.path.basename(path)), 'rb') as f:
+                for data in iter(lambda: f.read(1024 * 1024), b''):
+                    restored.update(data)
+        # 將節點時間戳往前 8 天 使全部節點到期
+        server.state.age_nodes(8 * 24 * 60 * 60)
+        results.append(('expire', spawn('expire', argv, server.api_url, folder_id, path)))
+        remaining = server.state.count_children(folder_id)
+
+        print(f'檔案 {argv.size} MB ({argv.data}) 分割 {argv.part} MB 連線 {argv.connections} 延遲 {argv.latency} ms 頻寬 {argv.bandwidth or "不限"} MB/s{" 虛擬分割" if argv.virtual else ""}{f" 壓縮 {argv.compression}" if argv.compression else ""}')
+        for name, result in results:
+            gb = result['bytes'] / 1000 / 1000 / 1000
+            speed = f'{result["bytes"] / result["wall"] / 1024 / 1024:>8.1f} MB/s' if result['bytes'] else f'{"-":>8} MB/s'
+            cpu = f'{result["cpu"] / gb:>8.2f} CPU s/GB' if result['bytes'] else f'{result["cpu"]:>8.2f} CPU s   '
+            print(f'{name:<8}{result["wall"]:>8.2f} s{speed}{cpu}{result["max_rss"] / 1024 / 1024:>8.1f} MB RSS')
+        if restored is not None:
+            print(f'還原內容 {"相同" if restored.digest() == digest.digest() else "不同"}')
+        print(f'上傳節點 {uploaded} 個, 過期刪除後剩餘 {remaining} 個, 伺服器統計 {server.state.stats}')
+    finally:
+        server.shutdown()
+        shutil.rmtree(dir_path)
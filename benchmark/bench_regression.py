@@ -0,0 +1,143 @@
+"""加密與分塊函式 效能回歸測試
+
+量測 general/crypto.py 與上傳 MAC/CTR 路徑的每次執行時間, 與 baseline.json 中
+相同主機環境 (CPU, Python 版本) 的基準比較, 任一項目變慢超過門檻時 結束碼為 1
+
+用法:
+# 比較基準
+python -m benchmark.bench_regression [-t THRESHOLD] [-k KEYWORD]
+# 更新目前主機環境的基準
+python -m benchmark.bench_regression --save
+"""
+from general.crypto import (a32_to_str, str_to_a32, base64_url_encode, base64_url_decode, encrypt_key, decrypt_key,
+                            prepare_key, stringhash, get_chunks, aes_cbc_mac, encrypt_attr, decrypt_attr)
+from general.mega_upload import ChunkEncryptor, file_mac
+import platform
+import time
+import argparse
+import timeit
+import json
+import sys
+import os
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+def host_key() -> str:
+    """基準依 CPU 型號與 Python 版本區分"""
+    cpu = platform.processor() or platform.machine()
+    try:
+        with open('/proc/cpuinfo', 'r') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    cpu = line.split(':', 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    return f'{cpu} / Python {platform.python_version()}'
+
+
+def get_cases() -> dict:
+    """{名稱: (函式, 正確性檢查)}"""
+    key = [0x01234567, 0x89abcdef, 0xfedcba98, 0x76543210]
+    ul_key = key + [0x0badf00d, 0xdeadbeef]
+    words = list(range(8))
+    data = a32_to_str(words)
+    attr = base64_url_encode(encrypt_attr({'n': 'backup.tar._1'}, key))
+    chunk = os.urandom(1024 * 1024)
+    k_str = a32_to_str(key)
+    iv_str = a32_to_str([ul_key[4], ul_key[5], ul_key[4], ul_key[5]])
+    encryptor = ChunkEncryptor(None, len(chunk), ul_key)
+    chunk_macs = {chunk_start: os.urandom(16) for chunk_start, _ in get_chunks(64 * 1024 * 1024)}
+
+    return {
+        'prepare_key 16': (lambda: prepare_key(str_to_a32('p' * 16)), None),
+        'prepare_key 40': (lambda: prepare_key(str_to_a32('p' * 40)), None),
+        'stringhash': (lambda: stringhash('bench@example.com', key), None),
+        'encrypt_key': (lambda: encrypt_key(words, key), lambda: tuple(decrypt_key(encrypt_key(words, key), key)) == tuple(words)),
+        'decrypt_key': (lambda: decrypt_key(words, key), None),
+        'a32_to_str': (lambda: a32_to_str(words), lambda: tuple(str_to_a32(a32_to_str(words))) == tuple(words)),
+        'str_to_a32': (lambda: str_to_a32(data), None),
+        'base64_url_encode': (lambda: base64_url_encode(data), lambda: base64_url_decode(base64_url_encode(data)) == data),
+        'base64_url_decode': (lambda: base64_url_decode(attr), None),
+        'decrypt_attr': (lambda: decrypt_attr(base64_url_decode(attr), key), lambda: decrypt_attr(base64_url_decode(attr), key) == {'n': 'backup.tar._1'}),
+        'get_chunks 1GB': (lambda: sum(1 for _ in get_chunks(1024 * 1024 * 1024)), None),
+        'chunk MAC 1MB': (lambda: aes_cbc_mac(chunk, k_str, iv_str), None),
+        'chunk CTR 1MB': (lambda: encryptor.encrypt(0, chunk), lambda: encryptor.encrypt(0, encryptor.encrypt(0, chunk)) == chunk),
+        'file_mac 64MB': (lambda: file_mac(ul_key, chunk_macs), None),
+    }
+
+
+def measure(func, repeat: int) -> float:
+    """每次執行的 CPU 秒數 取多次量測的最小值 降低其他程序的干擾"""
+    timer = timeit.Timer(func, timer=time.process_time)
+    number, _ = timer.autorange()
+    # 每次量測至少 0.2 秒 降低計時精度的影響
+    number = max(number, int(number * 0.2 / max(timer.timeit(number), 1e-9)))
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def format_time(seconds: float) -> str:
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return f'{seconds / scale:.2f} {unit}'
+    return f'{seconds / 1e-9:.0f} ns'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-t', '--threshold', type=float, default=0.3, help='允許變慢的比例 預設 0.3 (30%%)')
+    parser.add_argument('-r', '--repeat', type=int, default=7, help='每項量測次數')
+    parser.add_argument('--retries', type=int, default=2, help='超過門檻時 重新量測的次數, --save 時的額外量測次數')
+    parser.add_argument('-k', '--keyword', type=str, default=None, help='只執行名稱包含關鍵字的項目')
+    parser.add_argument('--save', action='store_true', help='將結果存為目前主機環境的基準')
+    parser.add_argument('--baseline', type=str, default=BASELINE_PATH, help='基準檔路徑')
+    argv = parser.parse_args()
+
+    baselines = {}
+    if os.path.exists(argv.baseline):
+        with open(argv.baseline, 'r') as f:
+            baselines = json.loads(f.read())
+    key = host_key()
+    baseline = baselines.get(key, {})
+    if not baseline and not argv.save:
+        print(f'沒有 {key} 的基準 僅顯示結果 (以 --save 建立)')
+
+    cases = get_cases()
+    results = {}
+    failed = []
+    print(f'{"項目":<20}{"目前":>12}{"基準":>12}{"變化":>10}')
+    for name, (func, check) in cases.items():
+        if argv.keyword and argv.keyword not in name:
+            continue
+        if check is not None and not check():
+            failed.append(name)
+            print(f'{name:<22}輸出錯誤')
+            continue
+        results[name] = measure(func, argv.repeat)
+        for _ in range(argv.retries):
+            # 建立基準時取多次量測的最小值, 比較時只在變慢時重新量測 排除其他程序造成的暫時干擾
+            if not argv.save and (name not in baseline or results[name] / baseline[name] - 1 <= argv.threshold):
+                break
+            results[name] = min(results[name], measure(func, argv.repeat))
+        line = f'{name:<22}{format_time(results[name]):>12}'
+        if name in baseline:
+            change = results[name] / baseline[name] - 1
+            line += f'{format_time(baseline[name]):>12}{change * 100:>+9.1f}%'
+            if change > argv.threshold:
+                failed.append(name)
+                line += '  變慢'
+        print(line)
+
+    if argv.save:
+        baselines[key] = dict(baseline, **results)
+        with open(argv.baseline, 'w') as f:
+            f.write(json.dumps(baselines, indent=2, ensure_ascii=False, sort_keys=True))
+        print(f'已更新基準 {key}')
+        sys.exit(0)
+
+    if failed:
+        print(f'未通過: {", ".join(failed)} (門檻 {argv.threshold * 100:.0f}%)')
+        sys.exit(1)
+    print('通過')
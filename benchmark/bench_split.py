@@ -0,0 +1,100 @@
+"""分割檔案 吞吐量與記憶體比較
+
+比較 原本 f.read(chunk_size) 整塊讀入的分割方式
+與 general/mega_split.py 的 copy_range (核心複製 或 固定緩衝)
+
+用法:
+python -m benchmark.bench_split [-s SIZE_MB] [-p PART_MB] [-w WORKERS] [-d DIR]
+"""
+from general.mega_split import copy_range, get_parts
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+import tracemalloc
+import argparse
+import tempfile
+import shutil
+import os
+
+
+def legacy_split(path: str, chunk_size: int):
+    """原本的分割方式"""
+    file_number = 1
+    filename = os.path.basename(path)
+    file_dir = os.path.dirname(path)
+    with open(path, 'rb') as f:
+        chunk = f.read(chunk_size)
+        while chunk:
+            split_file = f'{file_dir}/{filename}._{str(file_number)}'
+            with open(split_file, 'wb') as chunk_file:
+                chunk_file.write(chunk)
+            file_number += 1
+            chunk = f.read(chunk_size)
+
+
+def current_split(path: str, chunk_size: int, workers: int = 1):
+    """copy_range 分割"""
+    filename = os.path.basename(path)
+    file_dir = os.path.dirname(path)
+    src_fd = os.open(path, os.O_RDONLY)
+
+    def write_part(number, offset, length):
+        dst_fd = os.open(f'{file_dir}/{filename}._{number}', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            copy_range(src_fd, dst_fd, offset, length)
+        finally:
+            os.close(dst_fd)
+
+    try:
+        parts = get_parts(os.fstat(src_fd).st_size, chunk_size)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for future in [executor.submit(write_part, *part) for part in parts]:
+                future.result()
+    finally:
+        os.close(src_fd)
+
+
+def measure(split, path: str, *args) -> tuple:
+    """回傳 (MB/s, Python 記憶體峰值 MB)"""
+    size = os.path.getsize(path)
+    tracemalloc.start()
+    start = perf_counter()
+    split(path, *args)
+    take = perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    clean_parts(path)
+    return size / take / 1024 / 1024, peak / 1024 / 1024
+
+
+def clean_parts(path: str):
+    dir_path = os.path.dirname(path)
+    for name in os.listdir(dir_path):
+        if name.startswith(os.path.basename(path) + '._'):
+            os.remove(os.path.join(dir_path, name))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--size', type=int, default=1024, help='測試檔案大小 MB')
+    parser.add_argument('-p', '--part', type=int, default=256, help='分割大小 MB')
+    parser.add_argument('-w', '--workers', type=int, default=2, help='同時寫入的分割檔數')
+    parser.add_argument('-d', '--dir', type=str, default=None, help='測試資料夾 預設系統暫存資料夾')
+    argv = parser.parse_args()
+
+    dir_path = tempfile.mkdtemp(dir=argv.dir)
+    path = os.path.join(dir_path, 'bench.tar')
+    try:
+        with open(path, 'wb') as f:
+            for _ in range(argv.size):
+                f.write(os.urandom(1024 * 1024))
+
+        part_size = argv.part * 1024 * 1024
+        results = [
+            ('原本 f.read', measure(legacy_split, path, part_size)),
+            ('copy_range', measure(current_split, path, part_size, 1)),
+            (f'copy_range x{argv.workers}', measure(current_split, path, part_size, argv.workers)),
+        ]
+        for name, (speed, peak) in results:
+            print(f'{name:<20}{speed:>10.1f} MB/s{peak:>10.1f} MB')
+    finally:
+        shutil.rmtree(dir_path)
@@ -0,0 +1,103 @@
+"""監聽資料夾 新檔案偵測延遲 與 閒置 CPU 比較
+
+比較 原本每秒 os.listdir 並逐一檢查檔名的方式
+與 general/mega_watcher.py 的 DirectoryWatcher (inotify 與 scandir)
+
+用法:
+python -m benchmark.bench_watcher [-n FILES] [-t SECONDS]
+"""
+from general.mega_watcher import DirectoryWatcher
+from time import perf_counter, process_time, sleep
+import threading
+import argparse
+import tempfile
+import shutil
+import re
+import os
+
+
+PATTERN = r'\.tar\._[\d]{1,10}$'
+
+
+def legacy_loop(dir_path: str, found: dict, stop: threading.Event):
+    """原本的監聽迴圈 (檢查部分)"""
+    while not stop.is_set():
+        for file in os.listdir(dir_path):
+            _, file_extension = os.path.splitext(file)
+            if file_extension not in ['.temp']:
+                msg = {
+                    'file': file,
+                    'check_filename': bool(re.search(PATTERN, file)),
+                    'check_extension': True
+                }
+                if msg['check_filename'] and file not in found:
+                    found[file] = perf_counter()
+        sleep(1)
+
+
+def watcher_loop(watcher: DirectoryWatcher, found: dict, stop: threading.Event):
+    """DirectoryWatcher 監聽迴圈"""
+    while not stop.is_set():
+        for file in watcher.get_files(timeout=1):
+            if re.search(PATTERN, file) and file not in found:
+                found[file] = perf_counter()
+
+
+def measure(label: str, dir_path: str, loop, args, seconds: float, samples: int = 3) -> tuple:
+    """回傳 (平均偵測延遲 秒, 閒置 CPU 百分比)"""
+    found = {}
+    stop = threading.Event()
+    thread = threading.Thread(target=loop, args=args + (found, stop), daemon=True)
+    thread.start()
+    sleep(1.5)
+
+    # 閒置 CPU
+    start_cpu = process_time()
+    sleep(seconds)
+    idle_cpu = (process_time() - start_cpu) / seconds * 100
+
+    # 新檔案偵測延遲
+    latencies = []
+    for i in range(samples):
+        name = f'bench_{label}_{i}.tar._1'
+        with open(os.path.join(dir_path, f'{name}.temp'), 'wb') as f:
+            f.write(b'x')
+        created = perf_counter()
+        os.rename(os.path.join(dir_path, f'{name}.temp'), os.path.join(dir_path, name))
+        while name not in found:
+            sleep(0.001)
+        latencies.append(found[name] - created)
+        sleep(0.3)
+
+    stop.set()
+    thread.join()
+    return sum(latencies) / len(latencies), idle_cpu
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--files', type=int, default=10000, help='資料夾內既有的檔案數')
+    parser.add_argument('-t', '--seconds', type=float, default=5, help='閒置 CPU 量測秒數')
+    argv = parser.parse_args()
+
+    dir_path = tempfile.mkdtemp()
+    try:
+        for i in range(argv.files):
+            open(os.path.join(dir_path, f'pending_{i}.tar._{i}.done'), 'wb').close()
+
+        inotify_watcher = DirectoryWatcher(dir_path, rescan_interval=3600)
+        scandir_watcher = DirectoryWatcher(dir_path, rescan_interval=3600)
+        scandir_watcher.close()
+
+        results = [
+            ('原本 listdir', measure('listdir', dir_path, legacy_loop, (dir_path,), argv.seconds)),
+            ('inotify' if inotify_watcher.inotify_fd is not None else 'scandir', measure('inotify', dir_path, watcher_loop, (inotify_watcher,), argv.seconds)),
+            ('scandir', measure('scandir', dir_path, watcher_loop, (scandir_watcher,), argv.seconds)),
+        ]
+        inotify_watcher.close()
+
+        print(f'資料夾檔案數 {argv.files}')
+        for name, (latency, idle_cpu) in results:
+            print(f'{name:<16}偵測延遲 {latency * 1000:>8.1f} ms  閒置CPU {idle_cpu:>6.2f} %')
+    finally:
+        shutil.rmtree(dir_path)
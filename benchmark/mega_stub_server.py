@@ -0,0 +1,384 @@
+"""本地 mega API 模擬伺服器 供效能測試使用 不需連線至 mega
+
+支援:
+- API (/cs): us0, us (v1 帳號 tsid 登入), u, p, f, d, a, g
+- action packets (/sc?sn=): 't', 'd', 'u'
+- 分塊上傳 (/ul/<token>/<offset>): 可設定每次請求延遲與每條連線頻寬
+- 下載 (/dl/<handle>): 需以 keep_data 保存上傳內容 (佔用記憶體)
+
+節點屬性與金鑰由 client 加密 伺服器只保存 不解密
+
+用法:
+python -m benchmark.mega_stub_server [--port PORT] [--latency MS] [--bandwidth MBPS]
+"""
+from general.crypto import a32_to_base64, a32_to_str, base64_url_encode, encrypt_key, prepare_key, str_to_a32, stringhash
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+from time import time, sleep
+import threading
+import argparse
+import random
+import string
+import sys
+import json
+import os
+
+
+# mega API 錯誤碼
+EARGS = -2
+ENOENT = -9
+ESID = -15
+
+USER_HANDLE = 'stubuser000'
+
+
+def random_handle(length: int = 8) -> str:
+    return ''.join(random.choice(string.ascii_letters) for _ in range(length))
+
+
+class StubState:
+    """模擬伺服器的帳號 節點 action packets 與上傳狀態
+    """
+
+    def __init__(self, account: str, password: str, latency: float = 0, bandwidth: float = 0, keep_data: bool = False) -> None:
+        """_summary_
+
+        Args:
+            account (str): 帳號
+            password (str): 密碼
+            latency (float, optional): 每次請求延遲秒數. Defaults to 0.
+            bandwidth (float, optional): 每條連線頻寬 bytes/s, 0 為不限制. Defaults to 0.
+            keep_data (bool, optional): 保存上傳內容 供下載. Defaults to False.
+        """
+        self.account = account.lower()
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.keep_data = keep_data
+
+        self.master_key = [random.randint(0, 0xFFFFFFFF) for _ in range(4)]
+        self.password_aes = prepare_key(str_to_a32(password))
+        self.user_hash = stringhash(self.account, self.password_aes)
+
+        self.lock = threading.Lock()
+        self.sids = set()
+        self.nodes = {}
+        # [(序號, action packet)]
+        self.packets = []
+        self.sn = 0
+        # {token: {'size', 'received'}}
+        self.uploads = {}
+        # {completion handle: (檔案大小, 內容)}
+        self.completions = {}
+        # {節點 id: 已加密的檔案內容} 只在 keep_data 時保存
+        self.data = {}
+        self.stats = {'api': 0, 'sc': 0, 'upload': 0, 'upload_bytes': 0, 'download': 0, 'download_bytes': 0, 'actions': {}}
+
+        for t, name in ((2, 'Cloud Drive'), (3, 'Inbox'), (4, 'Rubbish Bin')):
+            handle = random_handle()
+            self.nodes[handle] = {'h': handle, 'p': '', 'u': USER_HANDLE, 't': t, 'a': '', 'k': '', 'ts': int(time())}
+        self.base_url = None
+
+    def expire_sessions(self):
+        """使所有 session 失效 (測試重新登入)
+        """
+        with self.lock:
+            self.sids.clear()
+
+    def age_nodes(self, seconds: int):
+        """將所有節點的時間戳往前移 並送出 'u' action packets
+
+        Args:
+            seconds (int): 秒數
+        """
+        with self.lock:
+            for handle, node in self.nodes.items():
+                if node['t'] in (0, 1):
+                    node['ts'] -= seconds
+                    self.__push({'a': 'u', 'n': handle, 'ts': node['ts']})
+
+    def count_children(self, parent: str) -> int:
+        """計算資料夾內 (含子資料夾) 的節點數
+
+        Args:
+            parent (str): 資料夾 id
+
+        Returns:
+            int: 節點數
+        """
+        with self.lock:
+            return len(self.__descendants(parent)) - 1
+
+    def api(self, data: list, sid: str) -> list:
+        """處理 API 請求
+
+        Args:
+            data (list): 請求內容
+            sid (str): session id
+
+        Returns:
+            list: 各請求的回應
+        """
+        self.stats['api'] += 1
+        return [self.__command(req, sid) for req in data]
+
+    def sc(self, sn: str, sid: str):
+        """取得序號 sn 之後的 action packets
+
+        Args:
+            sn (str): 序號
+            sid (str): session id
+        """
+        self.stats['sc'] += 1
+        with self.lock:
+            if sid not in self.sids:
+                return ESID
+            try:
+                sn = int(sn)
+            except ValueError:
+                return EARGS
+            packets = [packet for packet_sn, packet in self.packets if packet_sn > sn]
+            if not packets:
+                return {'w': f'{self.base_url}/wsc', 'sn': str(self.sn)}
+            return {'a': packets, 'sn': str(self.sn)}
+
+    def upload(self, token: str, offset: int, body: bytes) -> str:
+        """記錄分塊上傳 全部收到時回傳 completion handle
+
+        Args:
+            token (str): 上傳網址 token
+            offset (int): 分塊位置
+            body (bytes): 分塊內容
+
+        Returns:
+            str: completion handle 或 空字串, 錯誤時為負數錯誤碼
+        """
+        length = len(body)
+        with self.lock:
+            upload = self.uploads.get(token)
+            if upload is None or offset + length > upload['size']:
+                return str(ENOENT)
+            if upload['data'] is not None:
+                upload['data'][offset:offset + length] = body
+            upload['received'] += length
+            self.stats['upload'] += 1
+            self.stats['upload_bytes'] += length
+            if upload['received'] < upload['size']:
+                return ''
+            handle = f'CH{random_handle(25)}'
+            self.completions[handle] = (upload['size'], upload['data'])
+            del self.uploads[token]
+            return handle
+
+    def download(self, handle: str):
+        """取得已保存的檔案內容
+
+        Args:
+            handle (str): 節點 id
+
+        Returns:
+            bytearray: 已加密的內容, 不存在時為 None
+        """
+        with self.lock:
+            data = self.data.get(handle)
+            if data is not None:
+                self.stats['download'] += 1
+                self.stats['download_bytes'] += len(data)
+            return data
+
+    def __command(self, req: dict, sid: str):
+        action = req.get('a')
+        with self.lock:
+            self.stats['actions'][action] = self.stats['actions'].get(action, 0) + 1
+            if action == 'us0':
+                # v1 帳號 沒有 salt
+                return {}
+            if action == 'us':
+                if req.get('user', '').lower() != self.account or req.get('uh') != self.user_hash:
+                    return ENOENT
+                random_part = os.urandom(16)
+                tsid = base64_url_encode(random_part + a32_to_str(encrypt_key(str_to_a32(random_part), self.master_key)))
+                self.sids.add(tsid)
+                return {'k': a32_to_base64(encrypt_key(self.master_key, self.password_aes)), 'tsid': tsid}
+
+            if sid not in self.sids:
+                return ESID
+
+            if action == 'u':
+                token = random_handle(16)
+                self.uploads[token] = {'size': int(req['s']), 'received': 0, 'data': bytearray(int(req['s'])) if self.keep_data else None}
+                return {'p': f'{self.base_url}/ul/{token}'}
+            if action == 'p':
+                return self.__put_nodes(req)
+            if action == 'f':
+                return {'f': [dict(node) for node in self.nodes.values()], 'ok': [], 's': [], 'sn': str(self.sn)}
+            if action == 'd':
+                if req.get('n') not in self.nodes:
+                    return ENOENT
+                for handle in self.__descendants(req['n']):
+                    del self.nodes[handle]
+                    self.data.pop(handle, None)
+                self.__push({'a': 'd', 'n': req['n']})
+                return 0
+            if action == 'a':
+                # 更新屬性 (改名) 送出含加密屬性的 'u' action packet
+                node = self.nodes.get(req.get('n'))
+                if node is None:
+                    return ENOENT
+                node['a'] = req['attr']
+                self.__push({'a': 'u', 'n': node['h'], 'at': node['a'], 'ts': node['ts']})
+                return 0
+            if action == 'g':
+                if req.get('n') not in self.data:
+                    return ENOENT
+                return {'g': f'{self.base_url}/dl/{req["n"]}', 's': len(self.data[req['n']])}
+        return EARGS
+
+    def __put_nodes(self, req: dict):
+        if req.get('t') not in self.nodes:
+            return ENOENT
+        created = []
+        for n in req.get('n', []):
+            node = {'h': random_handle(), 'p': req['t'], 'u': USER_HANDLE, 't': n['t'], 'a': n['a'], 'k': f'{USER_HANDLE}:{n["k"]}', 'ts': int(time())}
+            if n['t'] == 0:
+                completion = self.completions.pop(n.get('h'), None)
+                if completion is None:
+                    return ENOENT
+                node['s'], data = completion
+                if data is not None:
+                    self.data[node['h']] = data
+            self.nodes[node['h']] = node
+            created.append(dict(node))
+        self.__push({'a': 't', 't': {'f': [dict(node) for node in created]}})
+        return {'f': created}
+
+    def __descendants(self, handle: str) -> list:
+        handles = [handle]
+        for current in handles:
+            handles.extend(h for h, node in self.nodes.items() if node['p'] == current)
+        return handles
+
+    def __push(self, packet: dict):
+        self.sn += 1
+        self.packets.append((self.sn, packet))
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """模擬伺服器的 HTTP 處理 使用 keep-alive
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        state = self.server.state
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        if state.latency:
+            sleep(state.latency)
+
+        if url.path == '/cs':
+            try:
+                data = json.loads(body)
+            except ValueError:
+                return self.__reply(json.dumps(EARGS))
+            return self.__reply(json.dumps(state.api(data, params.get('sid', [None])[0])))
+
+        if url.path == '/sc':
+            return self.__reply(json.dumps(state.sc(params.get('sn', [''])[0], params.get('sid', [None])[0])))
+
+        parts = url.path.split('/')
+        if len(parts) == 4 and parts[1] == 'ul':
+            if state.bandwidth:
+                sleep(len(body) / state.bandwidth)
+            return self.__reply(state.upload(parts[2], int(parts[3]), body))
+
+        self.send_error(404)
+
+    def do_GET(self):
+        state = self.server.state
+        parts = urlparse(self.path).path.split('/')
+
+        if state.latency:
+            sleep(state.latency)
+
+        data = state.download(parts[2]) if len(parts) == 3 and parts[1] == 'dl' else None
+        if data is None:
+            return self.send_error(404)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        view = memoryview(data)
+        block_size = 1024 * 1024
+        for start in range(0, len(view), block_size):
+            if state.bandwidth:
+                sleep(min(block_size, len(view) - start) / state.bandwidth)
+            self.wfile.write(view[start:start + block_size])
+
+    def log_message(self, format, *args):
+        pass
+
+    def __reply(self, text: str):
+        data = text.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, state: StubState, host: str = '127.0.0.1', port: int = 0) -> None:
+        super().__init__((host, port), StubHandler)
+        self.state = state
+        state.base_url = f'http://{host}:{self.server_address[1]}'
+
+    @property
+    def api_url(self) -> str:
+        return f'{self.state.base_url}/cs'
+
+    def handle_error(self, request, client_address):
+        # 用戶端提前關閉下載連線 (還原時已取得需要的分塊) 不顯示
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+def start_server(account: str, password: str, host: str = '127.0.0.1', port: int = 0, latency: float = 0, bandwidth: float = 0, keep_data: bool = False) -> StubServer:
+    """在背景執行緒啟動模擬伺服器
+
+    Args:
+        account (str): 帳號
+        password (str): 密碼
+        host (str, optional): 位址. Defaults to '127.0.0.1'.
+        port (int, optional): 連接埠 0 為自動. Defaults to 0.
+        latency (float, optional): 每次請求延遲秒數. Defaults to 0.
+        bandwidth (float, optional): 每條連線頻寬 bytes/s. Defaults to 0.
+        keep_data (bool, optional): 保存上傳內容 供下載. Defaults to False.
+
+    Returns:
+        StubServer: 伺服器 api_url 為 API 網址
+    """
+    server = StubServer(StubState(account, password, latency, bandwidth, keep_data), host, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8700)
+    parser.add_argument('--account', default='bench@example.com')
+    parser.add_argument('--password', default='bench')
+    parser.add_argument('--latency', type=float, default=0, help='每次請求延遲 ms')
+    parser.add_argument('--bandwidth', type=float, default=0, help='每條連線頻寬 MB/s, 0 為不限制')
+    parser.add_argument('--keep-data', action='store_true', help='保存上傳內容 供下載 (佔用記憶體)')
+    argv = parser.parse_args()
+
+    server = StubServer(StubState(argv.account, argv.password, argv.latency / 1000, argv.bandwidth * 1000 * 1000, argv.keep_data), argv.host, argv.port)
+    print(f'API 網址 {server.api_url} 帳號 {argv.account} 密碼 {argv.password}')
+    server.serve_forever()
@@ -0,0 +1,134 @@
+"""上傳分塊 MAC 與檔案 MAC 正確性檢查 不符時以非 0 結束
+
+1. 固定金鑰與內容的已知答案 (known-answer) 向量: 以上傳流程 (ChunkEncryptor → file_mac) 計算並比對
+2. aes_cbc_mac 與 逐區塊補零的標準 CBC-MAC, 及 upload_c 原本的迴圈 以隨機內容比對
+
+upload_c 原本的迴圈在 檔案大於16 bytes 且 最後一塊不超過16 bytes 時 (例如 0x20000 + 1 bytes)
+沿用上一塊留下的索引 i, 最後一塊的 MAC 為空字串 內容沒有被計算, 檔案 MAC 與標準不同,
+目前的實作依標準計算, 此差異以向量中的 legacy 值記錄, 其他大小兩者相同
+
+用法:
+python -m checks.check_chunk_mac
+"""
+from general.crypto import a32_to_str, aes_cbc_mac, get_chunks
+from general.mega_upload import ChunkEncryptor, file_mac
+from Crypto.Cipher import AES
+import tempfile
+import sys
+import os
+
+
+# 固定的檔案金鑰 a32 格式 6 個值
+UL_KEY = [0x01234567, 0x89abcdef, 0xfedcba98, 0x76543210, 0x0badf00d, 0xdeadbeef]
+
+# {檔案大小: (檔案 MAC, 最後一塊的 MAC, 原本迴圈的檔案 MAC)}
+VECTORS = {
+    5: ('a3ebb8c8ad53a965c8b550ce02cc40e4', '6b9fefc7189fd96ef83a6ef65267489f', 'a3ebb8c8ad53a965c8b550ce02cc40e4'),
+    # 最後一塊只有 1 byte: 原本的迴圈未計算該塊 檔案 MAC 不同
+    0x20000 + 1: ('85e999a70c6bb981dea19249ef31679e', '8adf4d2546694e64427c29cb78572065', '503a4b8dcf3639b0814bb6fc2589e841'),
+    0x20000 * 3 + 0x10000 + 17: ('8e1e45da01d840a273cec8a549292839', '98c466a442899380d8277a33df239a3a', '8e1e45da01d840a273cec8a549292839'),
+}
+
+failures = []
+
+
+def check(ok: bool, msg: str):
+    print(f'{"OK  " if ok else "FAIL"} {msg}')
+    if not ok:
+        failures.append(msg)
+
+
+def vector_data(size: int) -> bytes:
+    """向量的固定內容"""
+    return bytes((i * 7 + 3) & 0xff for i in range(size))
+
+
+def legacy_chunk_mac(chunk: bytes, key: bytes, iv: bytes, file_size: int, i: int = 0) -> tuple:
+    """upload_c 原本的分塊 MAC 迴圈, i 為上一塊迴圈留下的索引
+
+    Returns:
+        tuple: (分塊 MAC, 迴圈結束時的索引)
+    """
+    encryptor = AES.new(key, AES.MODE_CBC, iv)
+    for i in range(0, len(chunk) - 16, 16):
+        block = chunk[i:i + 16]
+        encryptor.encrypt(block)
+
+    # fix for files under 16 bytes failing
+    if file_size > 16:
+        i += 16
+    else:
+        i = 0
+
+    block = chunk[i:i + 16]
+    if len(block) % 16:
+        block += b'\0' * (16 - len(block) % 16)
+    return encryptor.encrypt(block), i
+
+
+def reference_chunk_mac(chunk: bytes, key: bytes, iv: bytes) -> bytes:
+    """逐區塊補零的標準 CBC-MAC"""
+    encryptor = AES.new(key, AES.MODE_CBC, iv)
+    mac = b''
+    for i in range(0, len(chunk), 16):
+        block = chunk[i:i + 16]
+        mac = encryptor.encrypt(block + b'\0' * (16 - len(block)))
+    return mac
+
+
+def upload_macs(path: str, size: int) -> dict:
+    """以上傳流程的 ChunkEncryptor 計算各分塊 MAC"""
+    with open(path, 'rb') as f:
+        return {chunk_start: chunk_mac for chunk_start, chunk_mac, _ in ChunkEncryptor(f, size, UL_KEY)}
+
+
+def check_vectors():
+    key = a32_to_str(UL_KEY[:4])
+    iv = a32_to_str([UL_KEY[4], UL_KEY[5], UL_KEY[4], UL_KEY[5]])
+    for size, (expected, expected_last, expected_legacy) in VECTORS.items():
+        data = vector_data(size)
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(data)
+            f.flush()
+            macs = upload_macs(f.name, size)
+        last = max(macs)
+        check(file_mac(UL_KEY, macs).hex() == expected, f'{size:#x} bytes 檔案 MAC 符合向量')
+        check(macs[last].hex() == expected_last, f'{size:#x} bytes 最後一塊 MAC 符合向量')
+        check(reference_chunk_mac(data[last:], key, iv).hex() == expected_last, f'{size:#x} bytes 最後一塊 標準 CBC-MAC 符合向量')
+
+        legacy = {}
+        i = 0
+        for chunk_start, chunk_size in get_chunks(size):
+            legacy[chunk_start], i = legacy_chunk_mac(data[chunk_start:chunk_start + chunk_size], key, iv, size, i)
+        check(file_mac(UL_KEY, legacy).hex() == expected_legacy, f'{size:#x} bytes 原本迴圈的檔案 MAC 符合記錄')
+
+
+def check_random():
+    key = os.urandom(16)
+    iv = os.urandom(8) * 2
+
+    # 單一小檔案 (檔案 <= 16 bytes)
+    for size in (1, 5, 15, 16):
+        chunk = os.urandom(size)
+        check(aes_cbc_mac(chunk, key, iv) == legacy_chunk_mac(chunk, key, iv, size)[0], f'小檔案 {size} bytes 與原本迴圈一致')
+
+    # 大於 16 bytes 的分塊, 含未對齊的結尾
+    for size in (17, 31, 32, 33, 1000, 4096, 0x20000, 0x20000 + 5, 0x100000 - 3):
+        chunk = os.urandom(size)
+        mac = aes_cbc_mac(chunk, key, iv)
+        check(mac == legacy_chunk_mac(chunk, key, iv, size + 0x20000)[0], f'分塊 {size} bytes 與原本迴圈一致')
+        check(mac == reference_chunk_mac(chunk, key, iv), f'分塊 {size} bytes 與標準 CBC-MAC 一致')
+
+    # 大檔案的最後一塊不超過 16 bytes
+    for size in (1, 15, 16):
+        chunk = os.urandom(size)
+        check(aes_cbc_mac(chunk, key, iv) == reference_chunk_mac(chunk, key, iv), f'結尾分塊 {size} bytes 與標準 CBC-MAC 一致')
+
+
+if __name__ == '__main__':
+    check_vectors()
+    check_random()
+    if failures:
+        print(f'{len(failures)} 項不符')
+        sys.exit(1)
+    print('MAC 檢查通過')
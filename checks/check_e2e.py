@@ -0,0 +1,116 @@
+"""分割 → 上傳 → 還原 → 過期刪除 端對端檢查 使用本地 mega 模擬伺服器, 不符時以非 0 結束
+
+每種模式 (一般, 虛擬分割, gzip 壓縮, 未超過分割大小, 不計算分割摘要) 各自建立 mega 資料夾, 檢查:
+1. 上傳後 mega 資料夾內的檔案 與預期的分割檔 + 分割說明檔相同, 本地檔案已刪除
+2. 還原的檔案與原檔內容相同 (sha256)
+3. 節點時間戳往前 8 天後 到期排程刪除資料夾內所有節點
+
+用法:
+python -m checks.check_e2e [-s SIZE_MB] [-p PART_MB] [-m MODE ...]
+"""
+from benchmark.mega_stub_server import start_server
+from benchmark.bench_e2e import ACCOUNT, PASSWORD, login, sql_block
+from general.mega_backup import MegaBackupFile
+from general.mega_expiry import ExpiryScheduler
+from general.mega_restore import MegaRestore
+from general.mega_split import get_codec_extension, MANIFEST_EXTENSION
+import argparse
+import tempfile
+import hashlib
+import shutil
+import sys
+import re
+import os
+
+
+# {模式: (虛擬分割, 壓縮格式, 檔案是否超過分割大小, 計算分割摘要)}
+MODES = {
+    'plain': (False, None, True, True),
+    'virtual': (True, None, True, True),
+    'gzip': (False, 'gzip', True, True),
+    'small': (False, None, False, True),
+    'nodigest': (False, None, True, False),
+}
+
+failures = []
+
+
+def check(ok: bool, msg: str):
+    print(f'{"OK  " if ok else "FAIL"} {msg}')
+    if not ok:
+        failures.append(msg)
+
+
+def folder_files(client, folder_id: str) -> set:
+    """mega 資料夾內的檔名"""
+    nodes, _ = client.get_nodes()
+    return {node['a']['n'] for node in nodes if node['t'] == 0 and node.get('p') == folder_id and isinstance(node['a'], dict)}
+
+
+def run_mode(server, client, root_id: str, mode: str, size: int, part_size: int):
+    virtual, codec, large, split_digest = MODES[mode]
+    folder_id = client.create_folder_from_id(f'check-{mode}', root_id)[f'check-{mode}']
+    dir_path = tempfile.mkdtemp()
+    path = os.path.join(dir_path, 'check.tar')
+    try:
+        # 類似 SQL dump 的資料 結尾不對齊分割大小與 16 bytes
+        file_size = size if large else part_size // 2
+        data = b''.join(sql_block(seed) for seed in range(file_size // (1024 * 1024) + 1))[:file_size - 7]
+        with open(path, 'wb') as f:
+            f.write(data)
+        digest = hashlib.sha256(data).digest()
+
+        mbf = MegaBackupFile(path, mega_folder_id=folder_id)
+        mbf.set_chunk_size(part_size)
+        mbf.set_compression(codec)
+        mbf.set_split_digest(split_digest)
+        if virtual:
+            mbf.set_virtual_parts_on()
+        mbf.run_split()
+
+        count = -(-len(data) // part_size)
+        expected = {f'check.tar._{number}{get_codec_extension(codec)}' for number in range(1, count + 1)} | {f'check.tar{MANIFEST_EXTENSION}'}
+        for name in sorted(os.listdir(dir_path)):
+            if re.search(r'\.tar(\._\d+(\.vpart|\.gz)?|\.manifest)$', name):
+                upload = MegaBackupFile(os.path.join(dir_path, name), mega_folder_id=folder_id)
+                upload.set_mega_client(client)
+                upload.run()
+        check(folder_files(client, folder_id) == expected, f'{mode}: mega 上的檔案為 {count} 個分割檔 與分割說明檔')
+        check(not os.listdir(dir_path), f'{mode}: 上傳後本地檔案已刪除')
+
+        output_dir = os.path.join(dir_path, 'restore')
+        os.makedirs(output_dir)
+        restored = MegaRestore(client, folder_id).restore('check.tar', output_dir)
+        with open(restored, 'rb') as f:
+            check(hashlib.sha256(f.read()).digest() == digest, f'{mode}: 還原內容與原檔相同')
+
+        server.state.age_nodes(8 * 24 * 60 * 60)
+        ExpiryScheduler(client, folder_id, expired_days=7).run_once()
+        check(server.state.count_children(folder_id) == 0, f'{mode}: 過期刪除後 資料夾內沒有節點')
+    except Exception as err:
+        check(False, f'{mode}: {type(err).__name__} {err}')
+    finally:
+        shutil.rmtree(dir_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--size', type=int, default=24, help='測試檔案大小 MB')
+    parser.add_argument('-p', '--part', type=int, default=8, help='分割大小 MB')
+    parser.add_argument('-m', '--mode', nargs='+', choices=list(MODES), default=list(MODES), help='檢查的模式')
+    argv = parser.parse_args()
+
+    server = start_server(ACCOUNT, PASSWORD, keep_data=True)
+    try:
+        client = login(server.api_url)
+        nodes, _ = client.get_nodes()
+        root_id = [node['h'] for node in nodes if node['t'] == 2][0]
+        for mode in argv.mode:
+            run_mode(server, client, root_id, mode, argv.size * 1024 * 1024, argv.part * 1024 * 1024)
+    finally:
+        server.shutdown()
+
+    if failures:
+        print(f'{len(failures)} 項不符')
+        sys.exit(1)
+    print('端對端檢查通過')
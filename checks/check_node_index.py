@@ -0,0 +1,126 @@
+"""節點索引 action packet 增量更新檢查 使用本地 mega 模擬伺服器, 不符時以非 0 結束
+
+1. 第一次更新 以 'f' 取得完整節點列表 並寫入快取檔
+2. 伺服器 新增 ('t') 刪除 ('d') 改名與時間戳變更 ('u') 後更新, 伺服器只收到 sc 請求 沒有新的 'f',
+   資料夾內的節點 時間戳 改名後的屬性 與伺服器相同
+3. 以快取檔建立新的索引 只以 sc 更新 內容與原索引相同
+4. 快取檔帳號不符時 改為完整更新
+
+用法:
+python -m checks.check_node_index
+"""
+from benchmark.mega_stub_server import start_server
+from benchmark.bench_e2e import ACCOUNT, PASSWORD, login
+from general.mega_index import NodeIndex
+import tempfile
+import shutil
+import sys
+import os
+
+
+failures = []
+
+
+def check(ok: bool, msg: str):
+    print(f'{"OK  " if ok else "FAIL"} {msg}')
+    if not ok:
+        failures.append(msg)
+
+
+def upload(client, dir_path: str, name: str, folder_id: str) -> dict:
+    """上傳小檔案
+
+    Returns:
+        dict: 已解密的節點
+    """
+    path = os.path.join(dir_path, name)
+    with open(path, 'wb') as f:
+        f.write(os.urandom(1000))
+    info = client.upload_c(path, dest=folder_id)
+    os.remove(path)
+    return client.process_node(info['f'][0])
+
+
+def snapshot(index: NodeIndex, folder_id: str) -> dict:
+    """資料夾內節點的 {節點 id: (檔名, 時間戳)}"""
+    return {handle: (info['a']['n'], info['ts']) for handle, info in index.get_children(folder_id).items()}
+
+
+def server_snapshot(server, folder_id: str) -> dict:
+    """伺服器上資料夾內節點的 {節點 id: 時間戳}"""
+    with server.state.lock:
+        return {handle: node['ts'] for handle, node in server.state.nodes.items() if node['p'] == folder_id}
+
+
+def counts(server) -> tuple:
+    """伺服器收到的 ('f' 請求數, sc 請求數, API 請求數)"""
+    stats = server.state.stats
+    return stats['actions'].get('f', 0), stats['sc'], stats['api']
+
+
+def run(server, client, dir_path: str):
+    nodes, _ = client.get_nodes()
+    root_id = [node['h'] for node in nodes if node['t'] == 2][0]
+    folder_id = client.create_folder_from_id('index', root_id)['index']
+    first = upload(client, dir_path, 'first.tar._1', folder_id)
+    second = upload(client, dir_path, 'second.tar._1', folder_id)
+
+    cache_path = os.path.join(dir_path, 'nodes.json')
+    index = NodeIndex(client, cache_path, ACCOUNT)
+    f_count, sc_count, _ = counts(server)
+    index.refresh()
+    check(counts(server)[0] == f_count + 1, '第一次更新 以 f 取得完整節點列表')
+    check(os.path.exists(cache_path), '第一次更新 寫入快取檔')
+    check(set(index.get_children(folder_id)) == {first['h'], second['h']}, '第一次更新 資料夾內為 2 個節點')
+
+    # 新增 刪除 改名 時間戳往前 1 天
+    third = upload(client, dir_path, 'third.tar._1', folder_id)
+    client.destroy(first['h'])
+    client.rename((second['h'], second), 'renamed.tar._1')
+    server.state.age_nodes(24 * 60 * 60)
+
+    f_count, sc_count, api_count = counts(server)
+    index.refresh()
+    f_after, sc_after, api_after = counts(server)
+    check(f_after == f_count, '增量更新 沒有新的 f 請求')
+    check(sc_after > sc_count and api_after == api_count, '增量更新 只有 sc 請求')
+
+    expected = server_snapshot(server, folder_id)
+    children = snapshot(index, folder_id)
+    check(set(children) == {second['h'], third['h']} == set(expected), '增量更新 新增與刪除的節點')
+    check(all(children[handle][1] == ts for handle, ts in expected.items()), '增量更新 時間戳與伺服器相同')
+    check(children.get(second['h'], ('',))[0] == 'renamed.tar._1', '增量更新 改名後的檔名')
+    check(children.get(third['h'], ('',))[0] == 'third.tar._1', '增量更新 新增節點的檔名')
+
+    # 以快取檔建立新的索引
+    reloaded = NodeIndex(client, cache_path, ACCOUNT)
+    f_count, sc_count, api_count = counts(server)
+    reloaded.refresh()
+    f_after, sc_after, api_after = counts(server)
+    check(f_after == f_count and sc_after > sc_count and api_after == api_count, '快取檔重新載入 只有 sc 請求')
+    check(reloaded.sn == index.sn, '快取檔重新載入 序號相同')
+    check(snapshot(reloaded, folder_id) == children, '快取檔重新載入 資料夾內節點 檔名 時間戳相同')
+
+    # 快取檔帳號不符
+    other = NodeIndex(client, cache_path, 'other@example.com')
+    f_count, _, _ = counts(server)
+    other.refresh()
+    check(counts(server)[0] == f_count + 1, '快取檔帳號不符 以 f 完整更新')
+    check(snapshot(other, folder_id) == children, '快取檔帳號不符 完整更新後內容相同')
+
+
+if __name__ == '__main__':
+    server = start_server(ACCOUNT, PASSWORD)
+    dir_path = tempfile.mkdtemp()
+    try:
+        run(server, login(server.api_url), dir_path)
+    except Exception as err:
+        check(False, f'{type(err).__name__} {err}')
+    finally:
+        server.shutdown()
+        shutil.rmtree(dir_path)
+
+    if failures:
+        print(f'{len(failures)} 項不符')
+        sys.exit(1)
+    print('節點索引檢查通過')
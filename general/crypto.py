@@ -44,36 +44,72 @@ def aes_cbc_decrypt_a32(data, key):
     return str_to_a32(aes_cbc_decrypt(a32_to_str(data), a32_to_str(key)))
 
 
+def aes_cbc_encrypt_repeat(block, key, rounds):
+    """
+    Encrypt one 16-byte block `rounds` times with the same key.
+    With a zero IV, CBC over `block` followed by zero blocks feeds every
+    ciphertext block back as the next plaintext, so the last output block
+    equals `rounds` chained encryptions done in a single cipher call.
+    """
+    if rounds <= 0:
+        return block
+    aes_cipher = AES.new(key, AES.MODE_CBC, makebyte('\0' * 16))
+    return aes_cipher.encrypt(block + b'\0' * (16 * (rounds - 1)))[-16:]
+
+
+def aes_cbc_mac(data, key, iv):
+    """
+    CBC-MAC of `data` zero padded to a multiple of 16 bytes.
+    The aligned part goes through the cipher in one call and only the last
+    ciphertext block is kept; a short tail is padded and encrypted after it.
+    """
+    aes_cipher = AES.new(key, AES.MODE_CBC, iv)
+    aligned = len(data) - len(data) % 16
+    mac = b''
+    if aligned:
+        mac = aes_cipher.encrypt(memoryview(data)[:aligned])[-16:]
+    if aligned != len(data):
+        mac = aes_cipher.encrypt(data[aligned:] + b'\0' * (16 - len(data) % 16))
+    return mac
+
+
 def stringhash(str, aeskey):
     s32 = str_to_a32(str)
     h32 = [0, 0, 0, 0]
     for i in range(len(s32)):
         h32[i % 4] ^= s32[i]
-    for r in range(0x4000):
-        h32 = aes_cbc_encrypt_a32(h32, aeskey)
+    h32 = str_to_a32(aes_cbc_encrypt_repeat(a32_to_str(h32), a32_to_str(aeskey), 0x4000))
     return a32_to_base64((h32[0], h32[2]))
 
 
 def prepare_key(arr):
     pkey = [0x93C467E3, 0x7DB0C7A4, 0xD1BE3F81, 0x0152CB56]
-    for r in range(0x10000):
-        for j in range(0, len(arr), 4):
-            key = [0, 0, 0, 0]
-            for i in range(4):
-                if i + j < len(arr):
-                    key[i] = arr[i + j]
-            pkey = aes_cbc_encrypt_a32(pkey, key)
-    return pkey
+    if not len(arr):
+        return pkey
+    keys = []
+    for j in range(0, len(arr), 4):
+        key = list(arr[j:j + 4])
+        keys.append(a32_to_str(key + [0] * (4 - len(key))))
+
+    block = a32_to_str(pkey)
+    if len(keys) == 1:
+        block = aes_cbc_encrypt_repeat(block, keys[0], 0x10000)
+    else:
+        # one cipher per key, a single block in CBC with zero IV is ECB
+        encrypts = [AES.new(key, AES.MODE_ECB).encrypt for key in keys]
+        for r in range(0x10000):
+            for encrypt in encrypts:
+                block = encrypt(block)
+    return str_to_a32(block)
 
 
 def encrypt_key(a, key):
-    return sum((aes_cbc_encrypt_a32(a[i:i + 4], key)
-                for i in range(0, len(a), 4)), ())
+    # every 4-word block is encrypted on its own with a zero IV, i.e. ECB
+    return str_to_a32(AES.new(a32_to_str(key), AES.MODE_ECB).encrypt(a32_to_str(a)))
 
 
 def decrypt_key(a, key):
-    return sum((aes_cbc_decrypt_a32(a[i:i + 4], key)
-                for i in range(0, len(a), 4)), ())
+    return str_to_a32(AES.new(a32_to_str(key), AES.MODE_ECB).decrypt(a32_to_str(a)))
 
 
 def encrypt_attr(attr, key):
@@ -1,12 +1,20 @@
 from datetime import datetime
 from .mega_log import logger
-from mega import Mega
-from time import sleep, time
-from Crypto.Cipher import AES
-from Crypto.Util import Counter
-from .crypto import a32_to_str, get_chunks, makebyte, str_to_a32, a32_to_base64, base64_url_encode, encrypt_attr, encrypt_key
-import requests
-import random
+from .mega_client import Mega_Custom
+from .mega_session import MegaSession
+from .mega_http import MegaHttpSession
+from .mega_watcher import DirectoryWatcher
+from .mega_index import NodeIndex
+from .mega_expiry import ExpiryScheduler
+from .mega_metrics import MegaMetrics
+from .mega_bandwidth import BandwidthLimiter, parse_bandwidth_profile
+from .mega_claim import PartClaimer, LEASE_EXTENSION
+from .mega_dedup import ChunkStore, CHUNK_FOLDER_NAME
+from .mega_split import compress_range, copy_range, get_codec_extension, get_parts, new_hasher, write_manifest, write_virtual_parts, read_virtual_part, remove_virtual_part, MANIFEST_EXTENSION, VIRTUAL_PART_EXTENSION
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+import threading
+import logging
 import json
 import re
 import os
@@ -35,7 +43,19 @@ class MegaBackupFile:
         self.sub_folder_name = None
 
         self.chunk_size = 500000000
+        self.split_workers = 1
+        self.virtual_parts = False
+        # 分割時的壓縮格式 None 為不壓縮
+        self.compression = None
+        self.compression_level = None
+        # 分割時是否計算各分割檔摘要 寫入分割說明檔
+        self.split_digest = True
+        # 去重複備份 None 時不使用去重複
+        self.chunk_store = None
         self.expired_days = 7
+        self.metrics = MegaMetrics.get_instance()
+        # 本地節點索引 None 時每次取得完整節點列表
+        self.node_index = None
         self.test = test
 
     def set_mega_auth(self, account: str, password: str):
@@ -46,8 +66,23 @@ class MegaBackupFile:
             account (str): mega 帳號
             password (str): mega 密碼
         """
-        mega = Mega_Custom()
-        self.mega_client = mega.login(account, password)
+        self.mega_client = MegaSession.get_instance(account, password).get_client()
+
+    def set_mega_client(self, client: Mega_Custom):
+        """設置已登入的 client
+
+        Args:
+            client (Mega_Custom): 已登入的 client
+        """
+        self.mega_client = client
+
+    def set_node_index(self, node_index: NodeIndex):
+        """設置 本地節點索引 檢查過期檔案時 只更新變更的節點
+
+        Args:
+            node_index (NodeIndex): 節點索引
+        """
+        self.node_index = node_index
 
     def set_chunk_size(self, size: int):
         """設置分割檔案大小 byte
@@ -57,6 +92,14 @@ class MegaBackupFile:
         """
         self.chunk_size = size
 
+    def set_split_workers(self, workers: int):
+        """設置 同時寫入的分割檔數
+
+        Args:
+            workers (int): 分割檔數
+        """
+        self.split_workers = max(1, workers)
+
     def set_expired_days(self, days: int):
         """設置過期天數
 
@@ -65,6 +108,43 @@ class MegaBackupFile:
         """
         self.expired_days = days
 
+    def set_compression(self, codec: str, level: int = None):
+        """設置 分割時的壓縮格式 各分割檔獨立串流壓縮
+
+        Args:
+            codec (str): gzip, bz2, xz, None 為不壓縮
+            level (int, optional): 壓縮等級. Defaults to 壓縮格式的預設等級.
+        """
+        get_codec_extension(codec)
+        self.compression = codec or None
+        self.compression_level = level
+
+    def set_split_digest(self, split_digest: bool):
+        """設置 分割時是否計算各分割檔摘要, 不計算時 分割說明檔只記錄位置 還原時不驗證摘要
+
+        Args:
+            split_digest (bool): 是否計算
+        """
+        self.split_digest = split_digest
+
+    def set_chunk_store(self, chunk_store: ChunkStore):
+        """設置 去重複備份 設置時不分割 只上傳新的分塊與說明檔
+
+        Args:
+            chunk_store (ChunkStore): 去重複備份
+        """
+        self.chunk_store = chunk_store
+
+    def set_virtual_parts_on(self):
+        """使用虛擬分割 只寫入分割說明檔 上傳時直接讀取原檔範圍
+        """
+        self.virtual_parts = True
+
+    def set_virtual_parts_off(self):
+        """關閉虛擬分割
+        """
+        self.virtual_parts = False
+
     def set_sub_folder_upload_on(self):
         """使用子資料夾資訊上傳
         """
@@ -138,55 +218,136 @@ class MegaBackupFile:
         """
         logger.info(f'=== {msg} ===')
 
-    def __split_file(self, path: str, chunk_size: int = 1024 * 1024 * 5, filename: str = None):
-        """分割檔案
+    def __split_file(self, path: str, chunk_size: int = 1024 * 1024 * 5, filename: str = None) -> bool:
+        """分割檔案 並寫入分割說明檔
+
+        每個分割檔以固定大小緩衝寫入, 讀取的同時計算摘要 不需再讀取一次,
+        不會將整個分割檔讀入記憶體, split_workers 大於 1 時 同時寫入(壓縮)多個分割檔
+        設置壓縮格式時 分割檔名加上壓縮格式的副檔名 例如 test.tar._1.gz
+        失敗時 刪除已寫入的分割檔與 .temp 檔, 保留原檔
 
         Args:
             path (str): 檔案路徑
-            chunk_size (str): 分割大小. Defaults to 500MB 1024 * 1024 * 5
+            chunk_size (str): 分割大小. Defaults to 5MB 1024 * 1024 * 5
             filename (str, optional): 檔名. Defaults to None.
-        """
-        file_number = 1
 
+        Returns:
+            bool: 是否完成
+        """
         if not filename:
             filename = os.path.basename(path)
         file_dir = os.path.dirname(path)
 
         self.__print_msg(f'分割 {filename} 開始')
 
+        start = time()
         try:
-            with open(path, 'rb') as f:
-                chunk = f.read(chunk_size)
-                while chunk:
-                    split_file = f'{file_dir}/{filename}._{str(file_number)}'
-                    with open(f"{split_file}.temp", 'wb') as chunk_file:
-                        chunk_file.write(chunk)
-                    os.rename(f"{split_file}.temp", split_file)
-                    file_number += 1
-                    chunk = f.read(chunk_size)
+            parts = self.__process_parts(path, chunk_size, filename, write=True)
+            write_manifest(f'{file_dir}/{filename}', os.path.getsize(path), chunk_size, parts, self.compression)
         except Exception as err:
             logger.error(msg=err, exc_info=True)
+            self.__remove_split_files(path, chunk_size, filename)
+            return False
+        finally:
+            self.metrics.observe('mega_split_seconds', time() - start)
 
         self.__print_msg(f'分割 {filename} 結束')
+        return True
 
-    def __cat_files(self, path: str, filename: str = None):
-        """合併檔案
+    def __remove_split_files(self, path: str, chunk_size: int, filename: str):
+        """刪除分割失敗時 已寫入的分割檔 .temp 檔 與分割說明檔的 .temp 檔
 
         Args:
             path (str): 檔案路徑
-            filename (str, optional): 檔名. Defaults to None.
+            chunk_size (int): 分割大小
+            filename (str): 檔名
         """
-        if not filename:
-            filename = os.path.basename(path)
         file_dir = os.path.dirname(path)
+        paths = [f'{file_dir}/{filename}{MANIFEST_EXTENSION}.temp']
+        for number, _, _ in get_parts(os.path.getsize(path), chunk_size):
+            split_file = f'{file_dir}/{filename}._{str(number)}{get_codec_extension(self.compression)}'
+            paths += [split_file, f'{split_file}.temp']
+        for split_path in paths:
+            try:
+                os.remove(split_path)
+                logger.warning(f'分割失敗 刪除 {os.path.basename(split_path)}')
+            except FileNotFoundError:
+                pass
+            except Exception as err:
+                logger.error(msg=err, exc_info=True)
 
-        self.__print_msg(f'合併 {filename} 開始')
+    def __dedup_file(self, path: str) -> bool:
+        """去重複備份 上傳新的分塊 並寫入說明檔 {檔名}.recipe
 
-        command = f'cat {file_dir}/{filename}* >> {file_dir}/{filename}'
-        logger.debug(command)
-        os.system(command)
+        Args:
+            path (str): 檔案路徑
 
-        self.__print_msg(f'合併 {filename} 結束')
+        Returns:
+            bool: 是否完成
+        """
+        filename = os.path.basename(path)
+        self.__print_msg(f'去重複 {filename} 開始')
+        try:
+            self.chunk_store.backup(path)
+        except Exception as err:
+            logger.error(msg=err, exc_info=True)
+            return False
+        self.__print_msg(f'去重複 {filename} 結束')
+        return True
+
+    def __process_parts(self, path: str, chunk_size: int, filename: str, write: bool) -> list:
+        """計算各分割範圍的摘要, write 為 True 時 同時寫入分割檔
+        未設置計算摘要時 分割範圍不含 digest, 不寫入分割檔時 不讀取檔案
+
+        Args:
+            path (str): 檔案路徑
+            chunk_size (int): 分割大小
+            filename (str): 檔名
+            write (bool): 是否寫入分割檔
+
+        Returns:
+            list: 依編號排序的 [{'name', 'offset', 'length', 'digest'(計算摘要時), 'stored_length'(壓縮時)}]
+        """
+        file_dir = os.path.dirname(path)
+        codec = self.compression if write else None
+
+        def process_part(src_fd, number, offset, length):
+            split_file = f'{file_dir}/{filename}._{str(number)}{get_codec_extension(codec)}'
+            if not write and not self.split_digest:
+                return {'name': os.path.basename(split_file), 'offset': offset, 'length': length}
+            hasher = new_hasher() if self.split_digest else None
+            dst_fd = os.open(f"{split_file}.temp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644) if write else None
+            try:
+                if codec:
+                    copied, stored_length = compress_range(src_fd, dst_fd, offset, length, codec, self.compression_level, hasher)
+                else:
+                    copied = copy_range(src_fd, dst_fd, offset, length, hasher=hasher)
+            finally:
+                if dst_fd is not None:
+                    os.close(dst_fd)
+            if copied != length:
+                raise IOError(f'{split_file} 讀取 {copied} bytes, 應為 {length} bytes')
+            part = {'name': os.path.basename(split_file), 'offset': offset, 'length': length}
+            if hasher is not None:
+                part['digest'] = hasher.hexdigest()
+            if write:
+                os.rename(f"{split_file}.temp", split_file)
+                self.metrics.inc('mega_split_bytes_total', copied)
+            if codec:
+                part['stored_length'] = stored_length
+                self.metrics.inc('mega_split_compressed_bytes_total', stored_length)
+            return part
+
+        src_fd = os.open(path, os.O_RDONLY)
+        try:
+            parts = get_parts(os.fstat(src_fd).st_size, chunk_size)
+            if self.split_workers > 1:
+                with ThreadPoolExecutor(max_workers=self.split_workers) as executor:
+                    futures = [executor.submit(process_part, src_fd, *part) for part in parts]
+                    return [future.result() for future in futures]
+            return [process_part(src_fd, *part) for part in parts]
+        finally:
+            os.close(src_fd)
 
     def create_folder(self, name: str, folder_id: str = None) -> dict:
         """建立mega資料夾 回傳資料夾名稱 資料夾id
@@ -204,20 +365,31 @@ class MegaBackupFile:
             info = self.mega_client.create_folder_from_id(name, self.mega_folder_id)
         return info
 
-    def __upload_to_mega(self, path: str, folder_id: str = None, folder_name: str = None):
+    def __upload_to_mega(self, path: str, folder_id: str = None, folder_name: str = None, part: dict = None):
         """上傳至mega
 
         Args:
             path (str): 檔案路徑
             folder_id (str): 指定上傳目標資料夾id. Defaults to self.mega_folder_id.
             folder_name (str): 指定上傳目標資料夾名稱. Defaults to self.mega_folder.
+            part (dict): 虛擬分割檔說明. Defaults to None.
 
         Returns:
             _type_: 回傳上傳資訊
         """
+        if part:
+            upload_path = part['source_path']
+            filename = part['name']
+            offset = part['offset']
+            length = part['length']
+        else:
+            upload_path = path
+            filename = os.path.basename(path)
+            offset = 0
+            length = os.path.getsize(path)
+
         # 取得檔案大小 MB
-        tar_size = round(os.path.getsize(path) / float(1000 * 1000), 2)
-        filename = os.path.basename(path)
+        tar_size = round(length / float(1000 * 1000), 2)
 
         if not folder_name:
             folder_name = self.mega_folder
@@ -230,18 +402,23 @@ class MegaBackupFile:
         upload_start_time = time()
 
         mega_info = self.mega_client.upload_c(
-            filename=path,
+            filename=upload_path,
             dest=folder_id,
-            dest_filename=filename
+            dest_filename=filename,
+            journal_path=f'{path}.journal',
+            offset=offset,
+            length=length
         )
 
         logger.debug(mega_info)
 
         upload_end_time = time()
+        self.metrics.observe('mega_upload_file_seconds', upload_end_time - upload_start_time)
 
         take_time = self.__get_time_str(int(round(upload_end_time - upload_start_time, 0)))
 
         self.__print_msg(f'上傳資料 {filename} 至 {folder_name} 完成,耗時{take_time}')
+        logger.info(f'連線統計 {self.mega_client.http.get_stats()}')
 
         return mega_info
 
@@ -260,6 +437,8 @@ class MegaBackupFile:
         self.__print_msg(f'刪除mega上的 {filename} 開始')
         try:
             self.mega_client.destroy(private_id)
+            if self.node_index is not None:
+                self.node_index.remove(private_id)
         except Exception as err:
             logger.error(msg=err, exc_info=True)
         self.__print_msg(f'刪除mega上的 {filename} 結束')
@@ -285,6 +464,9 @@ class MegaBackupFile:
         """
         # folder_id = self.mega_client.find(self.mega_folder)[0]
         folder_id = self.mega_folder_id
+        if self.node_index is not None:
+            self.node_index.refresh()
+            return self.node_index.get_children(folder_id)
         all_files = self.mega_client.get_files()
         folder_files = {}
         for _, file_info in all_files.items():
@@ -317,11 +499,14 @@ class MegaBackupFile:
         files = self.__get_mega_folder_files()
 
         # 紀錄已處理的id
-        processed_id = []
+        processed_id = set()
 
         for private_id, info in files.items():
+            # 去重複備份的 pack 檔 依最後使用時間刪除
+            if info['t'] == 1 and isinstance(info['a'], dict) and info['a'].get('n') == CHUNK_FOLDER_NAME:
+                continue
             if private_id not in processed_id:
-                processed_id.append(private_id)
+                processed_id.add(private_id)
                 if self.__is_expired(info['ts']):
                     if isinstance(info['a'], dict):
                         self.__print_msg(f'{info["a"]["n"]} 創建日期{self.__get_date(info["ts"])} 已超過{self.expired_days}天')
@@ -339,19 +524,39 @@ class MegaBackupFile:
         if path == None:
             path = self.file_path
 
-        if os.path.getsize(self.file_path) > self.chunk_size:
-            # 分割檔案
-            self.__split_file(self.file_path, self.chunk_size)
-
-            # 非測試時 刪除檔案
-            if not self.test:
+        if self.chunk_store is not None:
+            # 去重複 不分割, 失敗時保留檔案 下次掃描時重試
+            if self.__dedup_file(self.file_path) and not self.test:
+                self.__remove_file(self.file_path)
+        elif self.compression:
+            # 壓縮 需寫入分割檔, 未超過分割大小的檔案 也壓縮為單一分割檔
+            if self.virtual_parts:
+                logger.warning('已設置壓縮 不使用虛擬分割')
+            # 非測試時 分割完成才刪除檔案, 失敗時保留檔案 下次掃描時重試
+            if self.__split_file(self.file_path, self.chunk_size) and not self.test:
+                self.__remove_file(self.file_path)
+        elif os.path.getsize(self.file_path) > self.chunk_size and self.virtual_parts:
+            # 虛擬分割 只寫入分割說明檔 原檔於所有範圍上傳完成後刪除
+            filename = os.path.basename(self.file_path)
+            self.__print_msg(f'虛擬分割 {filename} 開始')
+            file_size = os.path.getsize(self.file_path)
+            parts = self.__process_parts(self.file_path, self.chunk_size, filename, write=False)
+            count = write_virtual_parts(self.file_path, self.chunk_size)
+            write_manifest(self.file_path, file_size, self.chunk_size, parts)
+            self.__print_msg(f'虛擬分割 {filename} 結束 共{count}個分割')
+        elif os.path.getsize(self.file_path) > self.chunk_size:
+            # 分割檔案, 非測試時 分割完成才刪除檔案, 失敗時保留檔案 下次掃描時重試
+            if self.__split_file(self.file_path, self.chunk_size) and not self.test:
                 self.__remove_file(self.file_path)
         else:
             filename = os.path.basename(self.file_path)
             file_dir = os.path.dirname(self.file_path)
             logger.debug(f'執行分割 filename: {filename}, file_dir: {file_dir}')
             if not bool(re.search(r'\.tar\._[\d]{1,10}$', filename)):
+                file_size = os.path.getsize(self.file_path)
+                parts = self.__process_parts(self.file_path, max(file_size, 1), filename, write=False)
                 os.rename(self.file_path, f"{file_dir}/{filename}._1")
+                write_manifest(self.file_path, file_size, max(file_size, 1), parts)
 
     def run(self, path=None):
         """執行上傳
@@ -359,24 +564,33 @@ class MegaBackupFile:
         if path == None:
             path = self.file_path
 
+        # 虛擬分割檔 上傳原檔中的範圍
+        part = None
+        if path.endswith(VIRTUAL_PART_EXTENSION):
+            part = read_virtual_part(path)
+
         if self.sub_f:
-            info = self.__upload_to_mega(path, self.sub_folder_id, f'{self.mega_folder}/{self.sub_folder_name}')
+            info = self.__upload_to_mega(path, self.sub_folder_id, f'{self.mega_folder}/{self.sub_folder_name}', part)
         else:
-            info = self.__upload_to_mega(path)
+            info = self.__upload_to_mega(path, part=part)
 
         # 非測試時
         logger.debug(info)
 
         # 非測試時 刪除檔案
         if not self.test:
-            self.__remove_file(path)
+            if part:
+                if remove_virtual_part(path, part):
+                    self.__print_msg(f'{part["source"]} 所有範圍已上傳 刪除原檔')
+            else:
+                self.__remove_file(path)
 
 
 class MegaListen:
     """監聽資料夾 若有符合條間的檔案則執行上傳至mega
     """
 
-    def __init__(self, dir_path: str, mega_account: str, mega_password: str, folder_id: str, listen_type: int = 1, test=False) -> None:
+    def __init__(self, dir_path: str, mega_account: str, mega_password: str, folder_id: str, listen_type: int = 1, test=False, session_cache_path: str = None, session_ttl: int = None, api_url: str = None) -> None:
         """_summary_
 
         Args:
@@ -386,6 +600,9 @@ class MegaListen:
             folder_id (str): mega目標資料夾ID
             test (bool, optional): 是否為測試. Defaults to False.
             listen_type (int): 0: 'split', 1: 'upload', 2: 'check_expired_file' . Defaults to 1.
+            session_cache_path (str, optional): session 快取檔路徑. Defaults to None.
+            session_ttl (int, optional): session 快取有效秒數. Defaults to None.
+            api_url (str, optional): API 網址 (例如本地模擬伺服器). Defaults to None.
         """
         if not os.path.exists(dir_path):
             os.makedirs(dir_path)
@@ -404,6 +621,46 @@ class MegaListen:
         self.mega_password = mega_password
         self.folder_id = folder_id
 
+        # 程序內共用的登入 session
+        self.mega_session = MegaSession.get_instance(mega_account, mega_password, session_cache_path, session_ttl)
+        if api_url:
+            self.mega_session.set_api_url(api_url)
+        # 單一檔案同時上傳的分塊數
+        self.upload_connections = 1
+        # 預先讀取並加密的分塊數上限
+        self.upload_queue_depth = 2
+        # 連續分塊合併為一次 POST 的大小上限
+        self.upload_max_send_size = 16 * 1024 * 1024
+        # 上傳頻寬時段 與 跨程序共用的頻寬狀態檔, 未設置時不限制
+        self.bandwidth_profile = []
+        self.bandwidth_state_path = None
+        # 同時寫入的分割檔數
+        self.split_workers = 1
+        # 是否使用虛擬分割
+        self.virtual_parts = False
+        # 分割時的壓縮格式 與 壓縮等級
+        self.compression = None
+        self.compression_level = None
+        # 分割時是否計算各分割檔摘要
+        self.split_digest = True
+        # 去重複備份的分塊索引檔路徑 None 時不使用去重複
+        self.dedup_index_path = None
+        # 平均分塊大小 與 pack 檔大小
+        self.dedup_chunk_size = 1024 * 1024
+        self.dedup_pack_size = 64 * 1024 * 1024
+        self.chunk_store = None
+        # 監聽資料夾完整掃描間隔秒數
+        self.rescan_interval = 60
+        # 到期排程重新整理節點索引的間隔秒數
+        self.expiry_rescan_interval = 3600
+        # 本地節點索引快取檔路徑 None 時不使用索引
+        self.node_index_path = None
+        self.node_index = None
+        # 分割檔認領逾時秒數 超過未更新視為上傳程序已中斷
+        self.lease_timeout = 300
+        # 程序內同時上傳的檔案數
+        self.workers = 1
+
         self.test = test
         self.listen_type = type_dict[listen_type]
         self.is_sleep = False
@@ -415,11 +672,11 @@ class MegaListen:
         self.date = datetime.now().__format__("%Y%m%d")
         self.sub_f_info_json = 'sub_folder_info.json'
 
-        self.pass_extensions = ['.temp']
+        self.pass_extensions = ['.temp', LEASE_EXTENSION, '.stale']
 
         # 分割功能 才進行 初始化子資料夾
         if not self.__check_sub_f_name() and listen_type == 0:
-            client = Mega_Custom().login(self.mega_account, self.mega_password)
+            client = self.__get_mega_client()
             sub_f_info = client.create_folder_from_id(self.date, self.folder_id)
             self.set_sub_folder_info_to_json(self.date, sub_f_info[self.date])
 
@@ -439,13 +696,153 @@ class MegaListen:
         self.expired_days = days
 
     def set_schedule_quantity(self, schedule_quantity: int):
-        """設置 排程數量
+        """設置 排程數量 (上傳已改為認領分配 僅保留相容)
 
         Args:
             schedule_quantity (int): 排程數量
         """
         self.schedule_quantity = schedule_quantity
 
+    def set_upload_connections(self, connections: int):
+        """設置 單一檔案同時上傳的分塊數
+
+        Args:
+            connections (int): 分塊數
+        """
+        self.upload_connections = connections
+
+    def set_upload_queue_depth(self, depth: int):
+        """設置 預先讀取並加密的分塊數上限
+
+        Args:
+            depth (int): 分塊數
+        """
+        self.upload_queue_depth = depth
+
+    def set_upload_max_send_size(self, size: int):
+        """設置 連續分塊合併為一次 POST 的大小上限
+
+        Args:
+            size (int): bytes
+        """
+        self.upload_max_send_size = size
+
+    def set_bandwidth(self, profile: str, state_path: str = None):
+        """設置 上傳頻寬限制 同一主機的程序 以同一個狀態檔共用頻寬
+
+        Args:
+            profile (str): 頻寬 MB/s, 或時段設定 例如 08:00-18:00=2,18:00-08:00=0
+            state_path (str, optional): 共用的狀態檔路徑. Defaults to 只在程序內共用.
+        """
+        self.bandwidth_profile = parse_bandwidth_profile(profile)
+        self.bandwidth_state_path = state_path
+
+    def set_split_workers(self, workers: int):
+        """設置 同時寫入的分割檔數
+
+        Args:
+            workers (int): 分割檔數
+        """
+        self.split_workers = workers
+
+    def set_virtual_parts(self, virtual_parts: bool):
+        """設置 是否使用虛擬分割
+
+        Args:
+            virtual_parts (bool): 是否使用
+        """
+        self.virtual_parts = virtual_parts
+
+    def set_compression(self, codec: str, level: int = None):
+        """設置 分割時的壓縮格式
+
+        Args:
+            codec (str): gzip, bz2, xz, None 為不壓縮
+            level (int, optional): 壓縮等級. Defaults to 壓縮格式的預設等級.
+        """
+        get_codec_extension(codec)
+        self.compression = codec or None
+        self.compression_level = level
+
+    def set_split_digest(self, split_digest: bool):
+        """設置 分割時是否計算各分割檔摘要
+
+        Args:
+            split_digest (bool): 是否計算
+        """
+        self.split_digest = split_digest
+
+    def set_dedup(self, index_path: str, chunk_size: int = None, pack_size: int = None):
+        """設置 去重複備份 依內容分塊 只上傳新的分塊, 不分割
+
+        Args:
+            index_path (str): 分塊索引檔路徑
+            chunk_size (int, optional): 平均分塊大小 只在建立新索引時套用. Defaults to 1MB.
+            pack_size (int, optional): 新的分塊合併上傳的 pack 檔大小. Defaults to 64MB.
+        """
+        self.dedup_index_path = index_path
+        if chunk_size:
+            self.dedup_chunk_size = chunk_size
+        if pack_size:
+            self.dedup_pack_size = pack_size
+
+    def set_rescan_interval(self, seconds: int):
+        """設置 監聽資料夾完整掃描間隔秒數
+
+        Args:
+            seconds (int): 秒數
+        """
+        self.rescan_interval = seconds
+
+    def set_expiry_rescan_interval(self, seconds: int):
+        """設置 到期排程重新整理節點索引的間隔秒數
+
+        Args:
+            seconds (int): 秒數
+        """
+        self.expiry_rescan_interval = seconds
+
+    def set_workers(self, workers: int):
+        """設置 程序內同時上傳的檔案數 共用登入的 client 與連線池
+
+        Args:
+            workers (int): 上傳執行緒數
+        """
+        self.workers = max(1, workers)
+
+    def set_lease_timeout(self, seconds: int):
+        """設置 分割檔認領逾時秒數
+
+        Args:
+            seconds (int): 秒數
+        """
+        self.lease_timeout = seconds
+
+    def set_node_index_path(self, path: str):
+        """設置 本地節點索引快取檔路徑
+
+        Args:
+            path (str): 快取檔路徑
+        """
+        self.node_index_path = path
+
+    def set_metrics_path(self, path: str, interval: int = 15):
+        """設置 效能統計檔路徑 定期寫入, 副檔名 .json 為 JSON, 其他 (.prom) 為 Prometheus 文字格式
+
+        Args:
+            path (str): 統計檔路徑
+            interval (int, optional): 寫入間隔秒數. Defaults to 15.
+        """
+        MegaMetrics.get_instance().start_exporter(path, interval)
+
+    def set_http_pool_size(self, pool_size: int):
+        """設置 共用連線池 每個主機保留的連線數
+
+        Args:
+            pool_size (int): 連線數
+        """
+        MegaHttpSession.get_instance().set_pool_size(pool_size)
+
     def set_pattern(self, pattern):
         """設置 匹配檔名 pattern
 
@@ -516,6 +913,49 @@ class MegaListen:
         self.sub_f_info = sub_f_info
         return sub_f_info
 
+    def __get_mega_client(self) -> Mega_Custom:
+        """取得共用 session 的 client 並套用上傳設定
+
+        Returns:
+            Mega_Custom: 已登入的 client
+        """
+        client = self.mega_session.get_client()
+        client.set_upload_connections(self.upload_connections)
+        client.set_upload_queue_depth(self.upload_queue_depth)
+        client.set_upload_max_send_size(self.upload_max_send_size)
+        if self.bandwidth_profile:
+            client.set_bandwidth_limiter(BandwidthLimiter.get_instance(self.bandwidth_profile, self.bandwidth_state_path))
+        return client
+
+    def __get_chunk_store(self) -> ChunkStore:
+        """取得程序內共用的去重複備份
+
+        Returns:
+            ChunkStore: 去重複備份
+        """
+        client = self.__get_mega_client()
+        if self.chunk_store is None:
+            self.chunk_store = ChunkStore(client, self.folder_id, self.dedup_index_path, self.mega_account, self.dedup_pack_size, int(self.expired_days or 7))
+            self.chunk_store.set_chunk_size(self.dedup_chunk_size)
+            self.chunk_store.set_gc_grace(self.expiry_rescan_interval)
+            self.chunk_store.set_compression(self.compression, self.compression_level)
+        else:
+            self.chunk_store.set_client(client)
+        return self.chunk_store
+
+    def __get_node_index(self) -> NodeIndex:
+        """取得程序內共用的節點索引
+
+        Returns:
+            NodeIndex: 節點索引
+        """
+        client = self.__get_mega_client()
+        if self.node_index is None:
+            self.node_index = NodeIndex(client, self.node_index_path, self.mega_account)
+        else:
+            self.node_index.set_client(client)
+        return self.node_index
+
     def __check_sub_f_name(self) -> bool:
         """檢查子資料夾名稱是否已建立id資訊
 
@@ -582,85 +1022,126 @@ class MegaListen:
         else:
             return True
 
+    def __upload_file(self, file: str):
+        """上傳已認領的分割檔
+
+        Args:
+            file (str): 分割檔名
+        """
+        mbf = MegaBackupFile(f'{self.dir_path}/{file}', mega_folder_id=self.folder_id, test=self.test)
+
+        if not self.test:
+            mbf.set_mega_client(self.__get_mega_client())
+
+        if self.expired_days:
+            mbf.set_expired_days(self.expired_days)
+
+        try:
+            # 使用日期子資料夾
+            sub_f_info = self.get_sub_folder_info_from_json()
+            mbf.set_sub_folder_info(
+                folder_id=sub_f_info['folder_id'],
+                folder_name=sub_f_info['name']
+            )
+            mbf.set_sub_folder_upload_on()
+        except Exception as err:
+            logger.error(msg=err, exc_info=True)
+            mbf.set_sub_folder_upload_off()
+
+        mbf.run()
+
+    def __claim_and_upload(self, file: str, claimer: PartClaimer):
+        """認領分割檔後上傳 已被其他程序認領則略過
+
+        Args:
+            file (str): 分割檔名
+            claimer (PartClaimer): 認領
+        """
+        if not claimer.claim(file):
+            logger.debug('%s 已被其他程序認領', file)
+            return
+        try:
+            self.__upload_file(file)
+        finally:
+            claimer.release(file)
+
+    def __upload_worker(self, file: str, claimer: PartClaimer, uploading: set, uploading_lock: threading.Lock):
+        """上傳執行緒 失敗時記錄錯誤 留下的檔案於完整掃描時重試
+
+        Args:
+            file (str): 分割檔名
+            claimer (PartClaimer): 認領
+            uploading (set): 已送出的檔名
+            uploading_lock (threading.Lock): uploading 的鎖
+        """
+        try:
+            self.__claim_and_upload(file, claimer)
+        except Exception as err:
+            logger.error(msg=err, exc_info=True)
+        finally:
+            with uploading_lock:
+                uploading.discard(file)
+
+    def __run_expiry(self):
+        """執行到期排程 共用同一個 client 與節點索引
+        """
+        scheduler = ExpiryScheduler(
+            self.__get_mega_client(),
+            self.folder_id,
+            expired_days=int(self.expired_days or 7),
+            rescan_interval=self.expiry_rescan_interval,
+            node_index=self.__get_node_index()
+        )
+        scheduler.run()
+
     def listen(self, cannal_id=None):
         """執行監聽
         """
+        if self.listen_type == 'check_expired_file':
+            # 過期檢查依到期時間排程 不由本地檔案觸發
+            self.__run_expiry()
+            return
+
+        watcher = DirectoryWatcher(self.dir_path, self.rescan_interval)
+        executor = None
+        if self.listen_type == 'upload':
+            claimer = PartClaimer(self.dir_path, lease_timeout=self.lease_timeout)
+            if cannal_id is not None:
+                claimer.set_worker_id(f'{claimer.worker_id}-{cannal_id}')
+            # 程序內多個上傳執行緒 共用 client 與連線池, 由同一個監聽迴圈分配檔案
+            if self.workers > 1:
+                executor = ThreadPoolExecutor(max_workers=self.workers)
+                uploading = set()
+                uploading_lock = threading.Lock()
         while True:
-            files = os.listdir(self.dir_path)
+            # 只取得新寫入完成或移入的檔案, 定期完整掃描以重試留下的檔案
+            files = watcher.get_files(timeout=1)
             for file in files:
+                # 事件中的檔案可能已被處理
+                if not os.path.exists(f'{self.dir_path}/{file}'):
+                    continue
                 _, file_extension = os.path.splitext(file)
                 if file_extension not in self.pass_extensions:
-                    msg = {
-                        'file': file,
-                        'check_filename': self.__check_filename(file, self.pattern),
-                        'check_extension': self.__check_extension(file)
-                    }
-                    logger.debug(msg)
-                    if self.__check_filename(file, self.pattern) and self.__check_extension(file):
+                    check_filename = self.__check_filename(file, self.pattern)
+                    check_extension = self.__check_extension(file)
+                    if logger.isEnabledFor(logging.DEBUG):
+                        msg = {
+                            'file': file,
+                            'check_filename': check_filename,
+                            'check_extension': check_extension
+                        }
+                        logger.debug(msg)
+                    if check_filename and check_extension:
                         if self.listen_type == 'upload':
-                            # 判斷是否多開
-                            if self.schedule_quantity > 0:
-                                try:
-                                    split_num = int(re.findall(r'\.tar\._(.*)', file)[0])
-                                    s_info = {
-                                        'split_num': split_num,
-                                        'schedule_quantity': self.schedule_quantity,
-                                        'cannal_id': cannal_id,
-                                        'remainder': split_num % self.schedule_quantity
-                                    }
-                                except Exception as err:
-                                    logger.error(msg=err, exc_info=True)
-
-                                logger.debug(s_info)
-
-                                # 若非分割檔格式 進入下一圈
-                                if split_num is None:
-                                    continue
-
-                                if s_info['remainder'] == s_info['cannal_id']:
-                                    mbf = MegaBackupFile(f'{self.dir_path}/{file}', mega_folder_id=self.folder_id, test=self.test)
-
-                                    if not self.test:
-                                        mbf.set_mega_auth(self.mega_account, self.mega_password)
-
-                                    if self.expired_days:
-                                        mbf.set_expired_days(self.expired_days)
-
-                                    try:
-                                        # 使用日期子資料夾
-                                        sub_f_info = self.get_sub_folder_info_from_json()
-                                        mbf.set_sub_folder_info(
-                                            folder_id=sub_f_info['folder_id'],
-                                            folder_name=sub_f_info['name']
-                                        )
-                                        mbf.set_sub_folder_upload_on()
-                                    except Exception as err:
-                                        logger.error(msg=err, exc_info=True)
-                                        mbf.set_sub_folder_upload_off()
-
-                                    mbf.run()
+                            if executor is None:
+                                self.__claim_and_upload(file, claimer)
                             else:
-                                mbf = MegaBackupFile(f'{self.dir_path}/{file}', mega_folder_id=self.folder_id, test=self.test)
-
-                                if not self.test:
-                                    mbf.set_mega_auth(self.mega_account, self.mega_password)
-
-                                if self.expired_days:
-                                    mbf.set_expired_days(self.expired_days)
-
-                                try:
-                                    # 使用日期子資料夾
-                                    sub_f_info = self.get_sub_folder_info_from_json()
-                                    mbf.set_sub_folder_info(
-                                        folder_id=sub_f_info['folder_id'],
-                                        folder_name=sub_f_info['name']
-                                    )
-                                    mbf.set_sub_folder_upload_on()
-                                except Exception as err:
-                                    logger.error(msg=err, exc_info=True)
-                                    mbf.set_sub_folder_upload_off()
-
-                                mbf.run()
+                                # 交給上傳執行緒 同一檔案不重複送出
+                                with uploading_lock:
+                                    if file in uploading:
+                                        continue
+                                    uploading.add(file)
+                                executor.submit(self.__upload_worker, file, claimer, uploading, uploading_lock)
                         elif self.listen_type == 'split':
 
                             mbf = MegaBackupFile(f'{self.dir_path}/{file}', mega_folder_id=self.folder_id, test=self.test)
@@ -668,155 +1149,23 @@ class MegaListen:
                             # 是否建立日期子資料夾
                             if not self.__check_sub_f_name():
                                 if not self.test:
-                                    mbf.set_mega_auth(self.mega_account, self.mega_password)
+                                    mbf.set_mega_client(self.__get_mega_client())
 
                                 sub_f_info = mbf.create_folder(self.date, mbf.mega_folder_id)
 
                                 self.set_sub_folder_info_to_json(self.date, sub_f_info[self.date])
 
                             # 分割
+                            mbf.set_split_workers(self.split_workers)
+                            mbf.set_compression(self.compression, self.compression_level)
+                            mbf.set_split_digest(self.split_digest)
+                            if self.dedup_index_path and not self.test:
+                                mbf.set_chunk_store(self.__get_chunk_store())
+                            if self.virtual_parts:
+                                mbf.set_virtual_parts_on()
                             mbf.run_split()
-                        elif self.listen_type == 'check_expired_file':
-                            # 刪除超過指定天數的檔案
-                            mbf = MegaBackupFile(f'{self.dir_path}/{file}', mega_folder_id=self.folder_id, test=self.test)
-
-                            if not self.test:
-                                mbf.set_mega_auth(self.mega_account, self.mega_password)
-
-                            if self.expired_days:
-                                mbf.set_expired_days(self.expired_days)
-
-                            # 刪除過期的mega檔案
-                            mbf.check_mega_files()
                 self.is_sleep = False
-            else:
+            if not files:
                 if not self.is_sleep:
                     self.is_sleep = True
                     print('等候中')
-                sleep(1)
-
-
-class Mega_Custom(Mega):
-    """繼承Mega套件 客製化功能
-    """
-
-    def create_folder_from_id(self, directory_name, parent_node_id):
-        """依照資料夾id 在資料夾內建立新資料夾
-
-        Args:
-            directory_name (_type_): 新資料夾名稱
-            parent_node_id (_type_): 資料夾id
-
-        Returns:
-            _type_: {directory_name: node_id}
-        """
-        created_node = self._mkdir(
-            name=directory_name,
-            parent_node_id=parent_node_id
-        )
-        node_id = created_node['f'][0]['h']
-        return {directory_name: node_id}
-
-    def upload_c(self, filename, dest=None, dest_filename=None):
-        # determine storage node
-        if dest is None:
-            # if none set, upload to cloud drive node
-            if not hasattr(self, 'root_id'):
-                self.get_files()
-            dest = self.root_id
-
-        # request upload url, call 'u' method
-        with open(filename, 'rb') as input_file:
-            file_size = os.path.getsize(filename)
-            ul_url = self._api_request({'a': 'u', 's': file_size})['p']
-
-            # generate random aes key (128) for file
-            ul_key = [random.randint(0, 0xFFFFFFFF) for _ in range(6)]
-            k_str = a32_to_str(ul_key[:4])
-            count = Counter.new(128, initial_value=((ul_key[4] << 32) + ul_key[5]) << 64)
-            aes = AES.new(k_str, AES.MODE_CTR, counter=count)
-
-            upload_progress = 0
-            completion_file_handle = None
-
-            mac_str = '\0' * 16
-            mac_encryptor = AES.new(
-                k_str, AES.MODE_CBC,
-                mac_str.encode("utf8")
-            )
-            iv_str = a32_to_str([ul_key[4], ul_key[5], ul_key[4], ul_key[5]])
-            if file_size > 0:
-                for chunk_start, chunk_size in get_chunks(file_size):
-                    chunk = input_file.read(chunk_size)
-                    upload_progress += len(chunk)
-
-                    encryptor = AES.new(k_str, AES.MODE_CBC, iv_str)
-                    for i in range(0, len(chunk) - 16, 16):
-                        block = chunk[i:i + 16]
-                        encryptor.encrypt(block)
-
-                    # fix for files under 16 bytes failing
-                    if file_size > 16:
-                        i += 16
-                    else:
-                        i = 0
-
-                    block = chunk[i:i + 16]
-                    if len(block) % 16:
-                        block += makebyte('\0' * (16 - len(block) % 16))
-                    mac_str = mac_encryptor.encrypt(encryptor.encrypt(block))
-
-                    # encrypt file and upload
-                    chunk = aes.encrypt(chunk)
-                    output_file = requests.post(
-                        ul_url + "/" +
-                        str(chunk_start),
-                        data=chunk,
-                        timeout=self.timeout
-                    )
-                    completion_file_handle = output_file.text
-                    # 計算百分比
-                    precent = float(round(100 * upload_progress / file_size, 1))
-                    logger.info(f'{upload_progress} of {file_size} uploaded, {precent}%')
-            else:
-                output_file = requests.post(
-                    ul_url + "/0",
-                    data='',
-                    timeout=self.timeout
-                )
-                completion_file_handle = output_file.text
-
-            file_mac = str_to_a32(mac_str)
-
-            # determine meta mac
-            meta_mac = (file_mac[0] ^ file_mac[1], file_mac[2] ^ file_mac[3])
-
-            dest_filename = dest_filename or os.path.basename(filename)
-            attribs = {'n': dest_filename}
-
-            encrypt_attribs = base64_url_encode(
-                encrypt_attr(attribs, ul_key[:4]))
-            key = [
-                ul_key[0] ^ ul_key[4],
-                ul_key[1] ^ ul_key[5],
-                ul_key[2] ^ meta_mac[0],
-                ul_key[3] ^ meta_mac[1],
-                ul_key[4],
-                ul_key[5],
-                meta_mac[0],
-                meta_mac[1]
-            ]
-            encrypted_key = a32_to_base64(encrypt_key(key, self.master_key))
-            # update attributes
-            data = self._api_request({
-                'a': 'p',
-                't': dest,
-                'i': self.request_id,
-                'n': [{
-                    'h': completion_file_handle,
-                    't': 0,
-                    'a': encrypt_attribs,
-                    'k': encrypted_key
-                }]
-            })
-            return data
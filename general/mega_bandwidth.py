@@ -0,0 +1,243 @@
+from .mega_log import logger
+from .mega_metrics import MegaMetrics
+from datetime import datetime
+from time import time, sleep
+import threading
+import struct
+import fcntl
+import re
+import os
+
+
+# 共用狀態檔內容: 剩餘 token (bytes, 可為負數), 上次更新時間戳
+STATE_FORMAT = 'dd'
+STATE_SIZE = struct.calcsize(STATE_FORMAT)
+
+
+def parse_bandwidth_profile(text: str) -> list:
+    """解析頻寬設定 單位 MB/s, 0 為不限制
+
+    格式: 單一數字 整天套用, 或以逗號分隔的時段 例如 08:00-18:00=2,18:00-08:00=0
+    結束時間不大於開始時間 表示跨越午夜, 未設定的時段不限制
+
+    Args:
+        text (str): 頻寬設定
+
+    Returns:
+        list: [(開始分鐘, 結束分鐘, bytes/s)]
+    """
+    if not text:
+        return []
+    text = text.strip()
+    try:
+        return [(0, 24 * 60, float(text) * 1000 * 1000)]
+    except ValueError:
+        pass
+    profile = []
+    for item in text.split(','):
+        r = re.search(r'^\s*(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})\s*=\s*([\d.]+)\s*$', item)
+        if r is None:
+            raise ValueError(f'頻寬時段格式錯誤: {item}')
+        start = int(r.group(1)) * 60 + int(r.group(2))
+        end = int(r.group(3)) * 60 + int(r.group(4))
+        rate = float(r.group(5)) * 1000 * 1000
+        if end > start:
+            profile.append((start, end, rate))
+        else:
+            profile.append((start, 24 * 60, rate))
+            profile.append((0, end, rate))
+    return profile
+
+
+class BandwidthLimiter:
+    """token bucket 上傳頻寬限制
+
+    程序內的上傳執行緒共用同一個實例, 同一主機的多個程序 以 flock 鎖定的共用狀態檔 共用同一個 bucket
+    取用時先扣除 token 允許成為負數, 再等待欠額補回, 先取用者先送出 不會互相餓死
+    """
+
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    def __init__(self, profile: list = None, state_path: str = None, burst_seconds: float = 1) -> None:
+        """_summary_
+
+        Args:
+            profile (list, optional): parse_bandwidth_profile 的結果. Defaults to 不限制.
+            state_path (str, optional): 跨程序共用的狀態檔路徑. Defaults to 只在程序內共用.
+            burst_seconds (float, optional): bucket 容量 以目前頻寬的秒數計. Defaults to 1.
+        """
+        self.profile = profile or []
+        self.state_path = state_path
+        self.burst_seconds = burst_seconds
+        self.lock = threading.Lock()
+        self.fd = None
+        self.tokens = None
+        self.last = None
+        self.metrics = MegaMetrics.get_instance()
+
+    @classmethod
+    def get_instance(cls, profile: list = None, state_path: str = None):
+        """取得程序內共用的限制 已存在時更新設定
+
+        Args:
+            profile (list, optional): parse_bandwidth_profile 的結果. Defaults to None.
+            state_path (str, optional): 跨程序共用的狀態檔路徑. Defaults to None.
+
+        Returns:
+            BandwidthLimiter: 共用的限制
+        """
+        with cls.__instance_lock:
+            if cls.__instance is None:
+                cls.__instance = cls(profile, state_path)
+            else:
+                cls.__instance.set_profile(profile)
+                cls.__instance.set_state_path(state_path)
+            return cls.__instance
+
+    def set_profile(self, profile: list):
+        """設置 頻寬時段
+
+        Args:
+            profile (list): parse_bandwidth_profile 的結果
+        """
+        self.profile = profile or []
+
+    def set_state_path(self, path: str):
+        """設置 跨程序共用的狀態檔路徑
+
+        Args:
+            path (str): 路徑
+        """
+        with self.lock:
+            if path == self.state_path:
+                return
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+            self.state_path = path
+
+    def get_rate(self, now: datetime = None) -> float:
+        """目前時段的頻寬
+
+        Args:
+            now (datetime, optional): 時間. Defaults to 現在.
+
+        Returns:
+            float: bytes/s, 0 為不限制
+        """
+        if not self.profile:
+            return 0
+        now = now or datetime.now()
+        minute = now.hour * 60 + now.minute
+        for start, end, rate in self.profile:
+            if start <= minute < end:
+                return rate
+        return 0
+
+    def is_limited(self) -> bool:
+        """目前時段是否限制頻寬
+
+        Returns:
+            bool: _description_
+        """
+        return self.get_rate() > 0
+
+    def acquire(self, size: int):
+        """取用 size bytes 的 token, 不足時等待
+
+        Args:
+            size (int): bytes
+        """
+        rate = self.get_rate()
+        if rate <= 0:
+            return
+        self.metrics.set_gauge('mega_bandwidth_rate_bytes', rate)
+        with self.lock:
+            if self.state_path:
+                tokens = self.__take_shared(size, rate)
+            else:
+                self.tokens, self.last = self.__refill(self.tokens, self.last, rate)
+                self.tokens -= size
+                tokens = self.tokens
+        if tokens < 0:
+            wait = -tokens / rate
+            self.metrics.inc('mega_bandwidth_wait_seconds_total', wait)
+            sleep(wait)
+
+    def __refill(self, tokens: float, last: float, rate: float) -> tuple:
+        """依經過時間補充 token 不超過 bucket 容量
+
+        Args:
+            tokens (float): 剩餘 token, None 為新的 bucket
+            last (float): 上次更新時間戳
+            rate (float): bytes/s
+
+        Returns:
+            tuple: (token, 現在時間戳)
+        """
+        now = time()
+        capacity = rate * self.burst_seconds
+        if tokens is None:
+            return capacity, now
+        return min(capacity, tokens + max(0, now - last) * rate), now
+
+    def __take_shared(self, size: int, rate: float) -> float:
+        """鎖定共用狀態檔 補充並扣除 token
+
+        Args:
+            size (int): bytes
+            rate (float): bytes/s
+
+        Returns:
+            float: 扣除後的 token
+        """
+        try:
+            if self.fd is None:
+                self.fd = os.open(self.state_path, os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+        except OSError as err:
+            # 無法使用共用狀態檔時 只限制本程序
+            logger.error(msg=err, exc_info=True)
+            self.state_path = None
+            self.tokens, self.last = self.__refill(self.tokens, self.last, rate)
+            self.tokens -= size
+            return self.tokens
+        try:
+            data = os.pread(self.fd, STATE_SIZE, 0)
+            tokens, last = struct.unpack(STATE_FORMAT, data) if len(data) == STATE_SIZE else (None, None)
+            tokens, last = self.__refill(tokens, last, rate)
+            tokens -= size
+            os.pwrite(self.fd, struct.pack(STATE_FORMAT, tokens, last), 0)
+            return tokens
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+
+class ThrottledBody:
+    """POST 內容 逐段取用頻寬後送出
+
+    有 __len__ 時 requests 仍會設置 Content-Length, 可重複迭代 供重試使用
+    """
+
+    def __init__(self, data: bytes, limiter: BandwidthLimiter, block_size: int = 256 * 1024) -> None:
+        """_summary_
+
+        Args:
+            data (bytes): 內容
+            limiter (BandwidthLimiter): 頻寬限制
+            block_size (int, optional): 每次取用的大小. Defaults to 256KB.
+        """
+        self.data = data
+        self.limiter = limiter
+        self.block_size = block_size
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __iter__(self):
+        view = memoryview(self.data)
+        for start in range(0, len(view), self.block_size):
+            block = view[start:start + self.block_size]
+            self.limiter.acquire(len(block))
+            yield block
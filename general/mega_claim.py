@@ -0,0 +1,182 @@
+from .mega_log import logger
+from time import time
+import threading
+import socket
+import os
+
+
+# 認領檔的副檔名
+LEASE_EXTENSION = '.lease'
+
+
+class PartClaimer:
+    """以認領檔分配分割檔給上傳程序
+
+    上傳前以 O_EXCL 建立 {分割檔}.lease, 只有一個程序能建立成功
+    背景執行緒定期更新認領檔的修改時間 (心跳)
+    認領檔超過 lease_timeout 秒未更新 視為程序已中斷, 其他程序可重新認領
+    """
+
+    def __init__(self, dir_path: str, worker_id: str = None, lease_timeout: int = 300) -> None:
+        """_summary_
+
+        Args:
+            dir_path (str): 監聽路徑
+            worker_id (str, optional): 程序識別. Defaults to {hostname}-{pid}.
+            lease_timeout (int, optional): 認領逾時秒數. Defaults to 300.
+        """
+        self.dir_path = dir_path
+        self.worker_id = worker_id or f'{socket.gethostname()}-{os.getpid()}'
+        self.lease_timeout = lease_timeout
+
+        self.lock = threading.Lock()
+        # 持有中的認領檔路徑
+        self.leases = set()
+        self.heartbeat_thread = None
+        self.stop_event = threading.Event()
+
+    def set_worker_id(self, worker_id: str):
+        """設置 程序識別
+
+        Args:
+            worker_id (str): 程序識別
+        """
+        self.worker_id = worker_id
+
+    def set_lease_timeout(self, seconds: int):
+        """設置 認領逾時秒數
+
+        Args:
+            seconds (int): 秒數
+        """
+        self.lease_timeout = seconds
+
+    def claim(self, filename: str) -> bool:
+        """認領分割檔
+
+        Args:
+            filename (str): 分割檔名
+
+        Returns:
+            bool: 是否認領成功
+        """
+        lease_path = self.__lease_path(filename)
+        if not self.__create_lease(lease_path):
+            if not self.__remove_stale_lease(lease_path) or not self.__create_lease(lease_path):
+                return False
+
+        # 建立認領檔前 分割檔可能已被其他程序上傳完成
+        if not os.path.exists(os.path.join(self.dir_path, filename)):
+            self.release(filename)
+            return False
+
+        self.__start_heartbeat()
+        return True
+
+    def release(self, filename: str):
+        """釋放認領
+
+        Args:
+            filename (str): 分割檔名
+        """
+        lease_path = self.__lease_path(filename)
+        with self.lock:
+            self.leases.discard(lease_path)
+        try:
+            if self.__read_owner(lease_path) == self.worker_id:
+                os.remove(lease_path)
+        except FileNotFoundError:
+            pass
+
+    def stop(self):
+        """停止心跳
+        """
+        self.stop_event.set()
+
+    def __lease_path(self, filename: str) -> str:
+        return os.path.join(self.dir_path, f'{filename}{LEASE_EXTENSION}')
+
+    def __create_lease(self, lease_path: str) -> bool:
+        """以 O_EXCL 建立認領檔
+
+        Args:
+            lease_path (str): 認領檔路徑
+
+        Returns:
+            bool: 是否建立成功
+        """
+        try:
+            fd = os.open(lease_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as f:
+            f.write(self.worker_id)
+        with self.lock:
+            self.leases.add(lease_path)
+        return True
+
+    def __remove_stale_lease(self, lease_path: str) -> bool:
+        """移除逾時的認領檔 改名後再刪除 同時只有一個程序能改名成功
+
+        檢查逾時與改名之間 認領檔可能已被其他程序移除並重新建立,
+        改名後確認 inode 修改時間 認領程序 皆與檢查時相同, 不同時表示改名的是新的認領檔 以 link 放回後放棄認領
+
+        Args:
+            lease_path (str): 認領檔路徑
+
+        Returns:
+            bool: 是否已移除
+        """
+        try:
+            observed = os.stat(lease_path)
+            if time() - observed.st_mtime < self.lease_timeout:
+                return False
+            owner = self.__read_owner(lease_path)
+            stale_path = f'{lease_path}.{self.worker_id}.stale'
+            os.rename(lease_path, stale_path)
+        except FileNotFoundError:
+            # 已被釋放 或 已被其他程序重新認領
+            return not os.path.exists(lease_path)
+
+        renamed = os.stat(stale_path)
+        if (renamed.st_ino, renamed.st_mtime) != (observed.st_ino, observed.st_mtime) or self.__read_owner(stale_path) != owner:
+            try:
+                # link 不會覆蓋已存在的認領檔
+                os.link(stale_path, lease_path)
+            except FileExistsError:
+                logger.error(f'認領檔 {os.path.basename(lease_path)} 已被重新認領 無法放回')
+            os.remove(stale_path)
+            logger.warning(f'認領檔 {os.path.basename(lease_path)} 已被其他程序重新認領, 放棄認領')
+            return False
+
+        os.remove(stale_path)
+        logger.warning(f'認領檔 {os.path.basename(lease_path)} 已逾時 ({owner}), 重新認領')
+        return True
+
+    def __read_owner(self, lease_path: str) -> str:
+        with open(lease_path, 'r') as f:
+            return f.read()
+
+    def __start_heartbeat(self):
+        """啟動心跳執行緒
+        """
+        with self.lock:
+            if self.heartbeat_thread is not None:
+                return
+            self.heartbeat_thread = threading.Thread(target=self.__heartbeat, daemon=True)
+            self.heartbeat_thread.start()
+
+    def __heartbeat(self):
+        """定期更新持有中認領檔的修改時間
+        """
+        interval = max(1, self.lease_timeout / 3)
+        while not self.stop_event.wait(interval):
+            with self.lock:
+                leases = list(self.leases)
+            for lease_path in leases:
+                try:
+                    os.utime(lease_path)
+                except FileNotFoundError:
+                    logger.warning(f'認領檔 {os.path.basename(lease_path)} 已被移除')
+                    with self.lock:
+                        self.leases.discard(lease_path)
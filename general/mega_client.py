@@ -0,0 +1,419 @@
+from .mega_log import logger
+from mega import Mega
+from mega.errors import RequestError
+from .crypto import a32_to_str, get_chunks, str_to_a32, a32_to_base64, base64_url_encode, encrypt_attr, encrypt_key, base64_to_a32, prepare_key, stringhash
+from .mega_upload import ChunkEncryptor, ChunkUploader, SendSizer, EEXPIRED, file_mac as upload_file_mac
+from .mega_journal import UploadJournal
+from .mega_http import MegaHttpSession
+from .mega_metrics import MegaMetrics
+from tenacity import retry, wait_exponential, retry_if_exception_type
+import threading
+import hashlib
+import random
+import json
+import os
+
+
+# mega API 錯誤碼: session 無效或已過期
+ESID = -15
+
+
+class Mega_Custom(Mega):
+    """繼承Mega套件 客製化功能
+    """
+
+    def __init__(self, options=None):
+        super().__init__(options)
+        # 共用 keep-alive 連線池
+        self.http = MegaHttpSession.get_instance()
+        self.metrics = MegaMetrics.get_instance()
+        # API 網址 None 時使用 schema 與 domain 組成
+        self.api_url = None
+        self.sequence_lock = threading.Lock()
+        self.relogin_lock = threading.Lock()
+        # session 失效時的重新登入處理 參數為 client 本身
+        self.session_expired_handler = None
+        # 單一檔案同時上傳的分塊數
+        self.upload_connections = 1
+        # 預先讀取並加密的分塊數上限
+        self.upload_queue_depth = 2
+        # 連續分塊合併 POST 的大小 依量測結果調整 各檔案共用
+        self.send_sizer = SendSizer()
+        # 上傳頻寬限制 None 時不限制
+        self.bandwidth_limiter = None
+
+    def set_session_expired_handler(self, handler):
+        """設置 session 失效時的處理函式
+
+        Args:
+            handler (callable): 接收 client 的函式, 需重新設置 sid 與 master_key
+        """
+        self.session_expired_handler = handler
+
+    def set_api_url(self, url: str):
+        """設置 API 網址
+
+        Args:
+            url (str): 例如 https://g.api.mega.co.nz/cs
+        """
+        self.api_url = url
+
+    def set_upload_connections(self, connections: int):
+        """設置 單一檔案同時上傳的分塊數
+
+        Args:
+            connections (int): 分塊數
+        """
+        self.upload_connections = max(1, connections)
+
+    def set_upload_queue_depth(self, depth: int):
+        """設置 預先讀取並加密的分塊數上限
+
+        Args:
+            depth (int): 分塊數
+        """
+        self.upload_queue_depth = max(1, depth)
+
+    def set_upload_max_send_size(self, size: int):
+        """設置 連續分塊合併為一次 POST 的大小上限
+
+        Args:
+            size (int): bytes
+        """
+        self.send_sizer.set_max_size(size)
+
+    def set_bandwidth_limiter(self, limiter):
+        """設置 上傳頻寬限制
+
+        Args:
+            limiter (BandwidthLimiter): 頻寬限制 None 時不限制
+        """
+        self.bandwidth_limiter = limiter
+
+    def login_user(self, email: str, password: str):
+        """帳號密碼登入
+
+        與 login() 不同 不會取得完整檔案列表來尋找垃圾桶節點
+
+        Args:
+            email (str): mega 帳號
+            password (str): mega 密碼
+
+        Returns:
+            Mega_Custom: client 本身
+        """
+        self._login_user(email, password)
+        return self
+
+    def _login_user(self, email, password):
+        """帳號密碼登入 使用 general.crypto 的 prepare_key, stringhash 計算金鑰
+
+        流程與 mega 套件相同
+        """
+        logger.info('mega 登入中')
+        email = email.lower()
+        get_user_salt_resp = self._api_request({'a': 'us0', 'user': email})
+        try:
+            user_salt = base64_to_a32(get_user_salt_resp['s'])
+        except KeyError:
+            # v1 帳號
+            password_aes = prepare_key(str_to_a32(password))
+            user_hash = stringhash(email, password_aes)
+        else:
+            # v2 帳號
+            pbkdf2_key = hashlib.pbkdf2_hmac(
+                hash_name='sha512',
+                password=password.encode(),
+                salt=a32_to_str(user_salt),
+                iterations=100000,
+                dklen=32
+            )
+            password_aes = str_to_a32(pbkdf2_key[:16])
+            user_hash = base64_url_encode(pbkdf2_key[-16:])
+        resp = self._api_request({'a': 'us', 'user': email, 'uh': user_hash})
+        if isinstance(resp, int):
+            raise RequestError(resp)
+        self._login_process(resp, password_aes)
+
+    def restore_session(self, sid: str, master_key: list):
+        """使用已儲存的 session 資訊 略過登入
+
+        Args:
+            sid (str): session id
+            master_key (list): 主金鑰 a32 格式
+
+        Returns:
+            Mega_Custom: client 本身
+        """
+        self.sid = sid
+        self.master_key = tuple(master_key)
+        return self
+
+    def _api_request(self, data):
+        """呼叫 mega API, 若 session 失效 重新登入後再試一次
+        """
+        sid = self.sid
+        try:
+            return self.__api_request(data)
+        except RequestError as err:
+            if err.code != ESID or self.session_expired_handler is None:
+                raise
+        self.__handle_session_expired(sid)
+        return self.__api_request(data)
+
+    def __handle_session_expired(self, rejected_sid: str):
+        """session 失效時重新登入 若其他執行緒已更新 session 則直接重試
+
+        Args:
+            rejected_sid (str): 被拒絕的 session id
+        """
+        with self.relogin_lock:
+            if self.sid != rejected_sid:
+                return
+            logger.warning('mega session 已失效 重新登入')
+            self.session_expired_handler(self)
+
+    @retry(retry=retry_if_exception_type(RuntimeError), wait=wait_exponential(multiplier=2, min=2, max=60))
+    def __api_request(self, data):
+        """使用共用連線池呼叫 mega API
+
+        流程與 mega 套件相同, -3 (EAGAIN) 時重試
+        """
+        with self.sequence_lock:
+            params = {'id': self.sequence_num}
+            self.sequence_num += 1
+
+        if self.sid:
+            params.update({'sid': self.sid})
+
+        # ensure input data is a list
+        if not isinstance(data, list):
+            data = [data]
+
+        url = self.api_url or f'{self.schema}://g.api.{self.domain}/cs'
+        with self.metrics.timer('mega_api_request_seconds', action=data[0].get('a', '') if isinstance(data[0], dict) else ''):
+            response = self.http.post(
+                url,
+                params=params,
+                data=json.dumps(data),
+                timeout=self.timeout
+            )
+        json_resp = json.loads(response.text)
+        int_resp = None
+        try:
+            if isinstance(json_resp, list):
+                int_resp = json_resp[0] if isinstance(json_resp[0], int) else None
+            elif isinstance(json_resp, int):
+                int_resp = json_resp
+        except IndexError:
+            int_resp = None
+        if int_resp is not None:
+            if int_resp == 0:
+                return int_resp
+            if int_resp == -3:
+                msg = 'Request failed, retrying'
+                logger.info(msg)
+                raise RuntimeError(msg)
+            raise RequestError(int_resp)
+        return json_resp[0]
+
+    def get_nodes(self):
+        """取得帳號內所有節點 (已解密屬性) 與 目前的 action packet 序號
+
+        Returns:
+            tuple: (節點 list, 序號 sn)
+        """
+        files = self._api_request({'a': 'f', 'c': 1, 'r': 1})
+        shared_keys = {}
+        self._init_shared_keys(files, shared_keys)
+        nodes = [self._process_file(file, shared_keys) for file in files['f']]
+        return nodes, files.get('sn')
+
+    def process_node(self, node: dict) -> dict:
+        """解密 action packet 中的節點屬性
+
+        Args:
+            node (dict): 節點
+
+        Returns:
+            dict: 已解密的節點
+        """
+        return self._process_file(node, getattr(self, 'shared_keys', {}))
+
+    def get_action_packets(self, sn: str) -> dict:
+        """取得序號 sn 之後的 action packets, session 失效時 重新登入後再試一次
+
+        Args:
+            sn (str): 序號
+
+        Returns:
+            dict: {'a': [action packet], 'sn': 新序號} 或 已是最新時 {'w': 等候網址, 'sn': 序號}
+        """
+        sid = self.sid
+        try:
+            return self.__sc_request(sn)
+        except RequestError as err:
+            if err.code != ESID or self.session_expired_handler is None:
+                raise
+        self.__handle_session_expired(sid)
+        return self.__sc_request(sn)
+
+    def __sc_request(self, sn: str) -> dict:
+        """呼叫 action packet 通道 (sc) 網址由 API 網址 /cs 改為 /sc
+
+        Args:
+            sn (str): 序號
+
+        Returns:
+            dict: 回應
+        """
+        url = self.api_url or f'{self.schema}://g.api.{self.domain}/cs'
+        if url.endswith('/cs'):
+            url = f'{url[:-3]}/sc'
+        with self.metrics.timer('mega_api_request_seconds', action='sc'):
+            response = self.http.post(
+                url,
+                params={'sn': sn, 'sid': self.sid},
+                data=b'',
+                timeout=self.timeout
+            )
+        json_resp = json.loads(response.text)
+        if isinstance(json_resp, int):
+            raise RequestError(json_resp)
+        return json_resp
+
+    def create_folder_from_id(self, directory_name, parent_node_id):
+        """依照資料夾id 在資料夾內建立新資料夾
+
+        Args:
+            directory_name (_type_): 新資料夾名稱
+            parent_node_id (_type_): 資料夾id
+
+        Returns:
+            _type_: {directory_name: node_id}
+        """
+        created_node = self._mkdir(
+            name=directory_name,
+            parent_node_id=parent_node_id
+        )
+        node_id = created_node['f'][0]['h']
+        return {directory_name: node_id}
+
+    def upload_c(self, filename, dest=None, dest_filename=None, journal_path=None, offset=0, length=None):
+        """上傳檔案 分塊同時上傳 並記錄上傳紀錄檔 中斷後可續傳
+
+        Args:
+            filename (_type_): 檔案路徑
+            dest (_type_, optional): 目標資料夾id. Defaults to None.
+            dest_filename (_type_, optional): mega 上的檔名. Defaults to None.
+            journal_path (str, optional): 上傳紀錄檔路徑. Defaults to '{filename}.journal'.
+            offset (int, optional): 只上傳檔案中 offset 起的範圍. Defaults to 0.
+            length (int, optional): 上傳範圍長度. Defaults to 檔案結尾.
+
+        Returns:
+            _type_: 'p' API 回應
+        """
+        # determine storage node
+        if dest is None:
+            # if none set, upload to cloud drive node
+            if not hasattr(self, 'root_id'):
+                self.get_files()
+            dest = self.root_id
+
+        journal = UploadJournal(journal_path or f'{filename}.journal')
+
+        with open(filename, 'rb') as input_file:
+            file_size = length if length is not None else os.path.getsize(filename) - offset
+
+            if journal.load(file_size) and len(journal.chunks) == len(list(get_chunks(file_size))) and not journal.completion_file_handle:
+                # 分塊皆已確認 但未記錄 completion handle 無法續傳
+                journal.remove()
+            elif journal.ul_url is not None:
+                logger.info(f'續傳 {filename}, 已確認 {len(journal.chunks)} 個分塊')
+                try:
+                    completion_file_handle = self.__upload_chunks(input_file, file_size, journal, offset)
+                except RequestError as err:
+                    # 只有上傳網址過期時 重新上傳
+                    if err.code != EEXPIRED:
+                        raise
+                    logger.warning(f'上傳網址已過期 重新上傳 {filename}')
+                    journal.remove()
+
+            if journal.ul_url is None:
+                # request upload url, call 'u' method
+                ul_url = self._api_request({'a': 'u', 's': file_size})['p']
+                # generate random aes key (128) for file
+                ul_key = [random.randint(0, 0xFFFFFFFF) for _ in range(6)]
+                journal.start(ul_url, ul_key, file_size)
+                completion_file_handle = self.__upload_chunks(input_file, file_size, journal, offset)
+
+        ul_key = journal.ul_key
+        file_mac = str_to_a32(upload_file_mac(ul_key, journal.chunks))
+
+        # determine meta mac
+        meta_mac = (file_mac[0] ^ file_mac[1], file_mac[2] ^ file_mac[3])
+
+        dest_filename = dest_filename or os.path.basename(filename)
+        attribs = {'n': dest_filename}
+
+        encrypt_attribs = base64_url_encode(
+            encrypt_attr(attribs, ul_key[:4]))
+        key = [
+            ul_key[0] ^ ul_key[4],
+            ul_key[1] ^ ul_key[5],
+            ul_key[2] ^ meta_mac[0],
+            ul_key[3] ^ meta_mac[1],
+            ul_key[4],
+            ul_key[5],
+            meta_mac[0],
+            meta_mac[1]
+        ]
+        encrypted_key = a32_to_base64(encrypt_key(key, self.master_key))
+        # update attributes
+        data = self._api_request({
+            'a': 'p',
+            't': dest,
+            'i': self.request_id,
+            'n': [{
+                'h': completion_file_handle,
+                't': 0,
+                'a': encrypt_attribs,
+                'k': encrypted_key
+            }]
+        })
+        journal.remove()
+        return data
+
+    def __upload_chunks(self, input_file, file_size: int, journal: UploadJournal, offset: int = 0) -> str:
+        """上傳紀錄檔中尚未確認的分塊
+
+        Args:
+            input_file (_type_): 已開啟的檔案
+            file_size (int): 上傳的大小
+            journal (UploadJournal): 上傳紀錄
+            offset (int, optional): 上傳範圍在檔案中的起始位置. Defaults to 0.
+
+        Returns:
+            str: completion handle
+        """
+        chunk_sizes = dict(get_chunks(file_size))
+        if file_size > 0 and len(journal.chunks) == len(chunk_sizes) and journal.completion_file_handle:
+            return journal.completion_file_handle
+
+        def on_uploaded(chunk_macs, text):
+            if chunk_macs:
+                journal.ack(chunk_macs, text)
+
+        uploaded = sum(chunk_sizes[chunk_start] for chunk_start in journal.chunks if chunk_start in chunk_sizes)
+        uploader = ChunkUploader(journal.ul_url, file_size, self.upload_connections, self.timeout, self.http, uploaded, on_uploaded, self.send_sizer, self.bandwidth_limiter)
+        if file_size > 0:
+            # 讀取 MAC CTR加密 在背景執行緒依序進行, POST 同時進行
+            encryptor = ChunkEncryptor(input_file, file_size, journal.ul_key, self.upload_queue_depth, journal.chunks, offset)
+            try:
+                for chunk_start, chunk_mac, chunk in encryptor:
+                    uploader.submit(chunk_start, chunk, chunk_mac)
+            finally:
+                encryptor.stop()
+        else:
+            uploader.submit(0, b'')
+        return uploader.wait()
@@ -0,0 +1,583 @@
+from .mega_log import logger
+from .mega_metrics import MegaMetrics
+from .mega_split import CODECS, DIGEST_ALGORITHM, get_codec_extension, new_hasher
+from collections import Counter
+from time import time
+import hashlib
+import threading
+import math
+import json
+import uuid
+import zlib
+import os
+
+
+# 去重複備份說明檔的副檔名 內容為 依序的分塊摘要 與各分塊所在的 pack 檔
+RECIPE_EXTENSION = '.recipe'
+# mega 備份資料夾內 存放 pack 檔的資料夾名稱 不會被到期排程刪除
+CHUNK_FOLDER_NAME = 'chunks'
+# pack 檔的副檔名
+PACK_EXTENSION = '.pack'
+
+# 分塊時每次讀取的大小 至少為分塊上限的兩倍
+CHUNK_READ_SIZE = 16 * 1024 * 1024
+# 候選位置前 計算 crc32 的 bytes
+CHUNK_WINDOW = 48
+# 校正對照表時讀取的大小
+CALIBRATION_SIZE = 8 * 1024 * 1024
+# 校正時 候選位置的平均間隔下限
+CANDIDATE_GAP = 4096
+
+
+class ContentChunker:
+    """內容定義分塊 (content-defined chunking) 依內容決定分塊邊界, 插入或刪除資料只影響附近的分塊
+
+    每個 byte 以對照表 (bytes.translate) 轉為 0/1, 以 bytes.find 尋找 0 之後連續 run 個 1 的位置作為候選,
+    候選位置前 CHUNK_WINDOW bytes 的 crc32 低 mask_bits 位元皆為 0 時 作為分塊邊界,
+    轉換與搜尋都在 C 中執行 不需以 Python 逐 byte 計算滾動雜湊
+    對照表以第一次備份的 byte 分布校正 (0/1 各約一半), 之後必須沿用相同參數 邊界才會一致
+    """
+
+    def __init__(self, min_size: int = 256 * 1024, avg_size: int = 1024 * 1024, max_size: int = 4 * 1024 * 1024, params: dict = None) -> None:
+        """_summary_
+
+        Args:
+            min_size (int, optional): 分塊大小下限. Defaults to 256KB.
+            avg_size (int, optional): 平均分塊大小. Defaults to 1MB.
+            max_size (int, optional): 分塊大小上限. Defaults to 4MB.
+            params (dict, optional): get_params 的結果 沿用之前的參數. Defaults to 尚未校正.
+        """
+        self.min_size = min_size
+        self.avg_size = avg_size
+        self.max_size = max_size
+        self.table = None
+        self.marker = None
+        self.mask = None
+        if params:
+            self.set_params(params)
+
+    def is_calibrated(self) -> bool:
+        """是否已校正
+
+        Returns:
+            bool: _description_
+        """
+        return self.table is not None
+
+    def get_params(self) -> dict:
+        """分塊參數 存於分塊索引
+
+        Returns:
+            dict: {'min_size', 'avg_size', 'max_size', 'table', 'run', 'mask_bits'}
+        """
+        return {
+            'min_size': self.min_size,
+            'avg_size': self.avg_size,
+            'max_size': self.max_size,
+            'table': self.table.hex(),
+            'run': len(self.marker) - 1,
+            'mask_bits': self.mask.bit_length()
+        }
+
+    def set_params(self, params: dict):
+        """沿用之前的分塊參數
+
+        Args:
+            params (dict): get_params 的結果
+        """
+        self.min_size = params['min_size']
+        self.avg_size = params['avg_size']
+        self.max_size = params['max_size']
+        self.table = bytes.fromhex(params['table'])
+        self.marker = b'\x00' + b'\x01' * params['run']
+        self.mask = (1 << params['mask_bits']) - 1
+
+    def calibrate(self, sample: bytes):
+        """依樣本的 byte 分布建立對照表, 再選擇 run 長度 與 crc32 位元數 使平均分塊接近 avg_size
+
+        Args:
+            sample (bytes): 樣本 (檔案開頭)
+        """
+        # 由出現次數多的 byte 開始 分配至目前合計較少的一方
+        ones = set()
+        totals = [0, 0]
+        for byte, count in Counter(sample).most_common():
+            side = 0 if totals[0] <= totals[1] else 1
+            totals[side] += count
+            if side:
+                ones.add(byte)
+        self.table = bytes(1 if byte in ones else 0 for byte in range(256))
+
+        bits = sample.translate(self.table)
+        for run in range(8, 33):
+            self.marker = b'\x00' + b'\x01' * run
+            count = bits.count(self.marker)
+            if not count or len(sample) / count >= CANDIDATE_GAP:
+                break
+        gap = len(sample) / count if count else self.avg_size
+        self.mask = (1 << max(0, round(math.log2(max(1, (self.avg_size - self.min_size) / gap))))) - 1
+        logger.info(f'分塊參數校正 run {len(self.marker) - 1}, 候選間隔 {round(gap)} bytes, mask {self.mask.bit_length()} 位元')
+
+    def split(self, fd: int, size: int):
+        """依內容分塊
+
+        Args:
+            fd (int): 檔案 fd
+            size (int): 檔案大小
+
+        Yields:
+            tuple: (起始位置, 分塊內容 memoryview 只在下一次 yield 前有效)
+        """
+        read_size = max(CHUNK_READ_SIZE, self.max_size * 2)
+        offset = 0
+        while offset < size:
+            window = os.pread(fd, min(read_size, size - offset), offset)
+            if not window:
+                raise IOError(f'讀取 {offset} 時已到檔案結尾, 應為 {size} bytes')
+            eof = offset + len(window) >= size
+            bits = window.translate(self.table)
+            view = memoryview(window)
+            start = 0
+            while start < len(window):
+                # 剩餘不足分塊上限時 與下一次讀取的內容一起分塊
+                if len(window) - start < self.max_size and not eof:
+                    break
+                end = self.__find_boundary(view, bits, start, min(start + self.max_size, len(window)))
+                yield offset + start, view[start:end]
+                start = end
+            offset += start
+
+    def __find_boundary(self, view: memoryview, bits: bytes, start: int, limit: int) -> int:
+        """尋找分塊邊界
+
+        Args:
+            view (memoryview): 讀取的內容
+            bits (bytes): 轉換後的 0/1
+            start (int): 分塊起始位置
+            limit (int): 分塊結束位置上限
+
+        Returns:
+            int: 分塊結束位置 找不到邊界時為 limit
+        """
+        position = start + self.min_size - len(self.marker)
+        while True:
+            found = bits.find(self.marker, position, limit)
+            if found < 0:
+                return limit
+            boundary = found + len(self.marker)
+            if not zlib.crc32(view[boundary - CHUNK_WINDOW:boundary]) & self.mask:
+                return boundary
+            position = found + 1
+
+
+class ChunkIndex:
+    """本地分塊索引 記錄已存於 mega 的分塊 與 pack 檔, 存於快取檔 權限 600
+
+    只由分割程序讀寫, pack 檔上傳完成後才加入索引,
+    索引遺失時 只會重新上傳全部分塊 (舊的 pack 檔需手動清除)
+    """
+
+    def __init__(self, path: str = '.mega_chunks.json', account: str = None) -> None:
+        """_summary_
+
+        Args:
+            path (str, optional): 索引檔路徑. Defaults to '.mega_chunks.json'.
+            account (str, optional): mega 帳號 索引檔帳號不符時重新建立. Defaults to None.
+        """
+        self.path = path
+        self.account = account.lower() if account else None
+        self.loaded = False
+        # 分塊參數
+        self.chunker = None
+        # pack 檔的資料夾 id
+        self.folder_id = None
+        # {分塊摘要: [pack 檔名, pack 內位置, 儲存大小, 原始大小]}
+        self.chunks = {}
+        # {pack 檔名: {'h': 節點 id, 'size', 'codec', 'last_used': 最後被備份使用的時間戳}}
+        self.packs = {}
+
+    def load(self):
+        """讀取索引檔 帳號不符或格式錯誤時忽略
+        """
+        if self.loaded:
+            return
+        self.loaded = True
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as f:
+                index = json.loads(f.read())
+            if self.account and index.get('account') != self.account:
+                return
+            self.chunker = index['chunker']
+            self.folder_id = index['folder_id']
+            self.chunks = index['chunks']
+            self.packs = index['packs']
+        except Exception as err:
+            logger.error(msg=err, exc_info=True)
+            self.chunker = None
+            self.folder_id = None
+            self.chunks = {}
+            self.packs = {}
+
+    def save(self):
+        """寫入索引檔 權限 600
+        """
+        if not self.path:
+            return
+        index = {
+            'account': self.account,
+            'chunker': self.chunker,
+            'folder_id': self.folder_id,
+            'chunks': self.chunks,
+            'packs': self.packs,
+            'ts': int(time())
+        }
+        temp_path = f'{self.path}.temp'
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(json.dumps(index))
+        os.replace(temp_path, self.path)
+
+    def add_pack(self, name: str, handle: str, size: int, codec: str, chunks: dict):
+        """加入已上傳的 pack 檔
+
+        Args:
+            name (str): pack 檔名
+            handle (str): 節點 id
+            size (int): pack 檔大小
+            codec (str): 壓縮格式 None 為不壓縮
+            chunks (dict): {分塊摘要: [pack 內位置, 儲存大小, 原始大小]}
+        """
+        self.packs[name] = {'h': handle, 'size': size, 'codec': codec, 'last_used': int(time())}
+        for digest, (offset, stored_length, length) in chunks.items():
+            self.chunks[digest] = [name, offset, stored_length, length]
+
+    def touch(self, names: set):
+        """更新 pack 檔最後被使用的時間
+
+        Args:
+            names (set): pack 檔名
+        """
+        now = int(time())
+        for name in names:
+            if name in self.packs:
+                self.packs[name]['last_used'] = now
+
+    def remove_pack(self, name: str):
+        """移除 pack 檔 與其中的分塊
+
+        Args:
+            name (str): pack 檔名
+        """
+        self.packs.pop(name, None)
+        self.chunks = {digest: entry for digest, entry in self.chunks.items() if entry[0] != name}
+
+
+class ChunkStore:
+    """去重複備份: 依內容分塊, 只上傳索引中沒有的分塊, 並寫入重建備份用的說明檔 {檔名}.recipe
+
+    新的分塊依序寫入本地 pack 檔 (可壓縮), 達到 pack 大小時上傳至 mega 的 chunks 資料夾 再加入索引,
+    中斷後重新執行 已上傳的 pack 檔中的分塊不會再次上傳
+    說明檔記錄 依序的分塊摘要與大小 以及各分塊所在的 pack 檔, 與分割檔一樣 由上傳程序上傳至日期子資料夾
+    pack 檔超過 保留天數 + 寬限時間 未被任何備份使用時 刪除,
+    最後使用時間在說明檔上傳前更新, 說明檔於上傳後 (時間較晚) 才開始計算保留天數, 且到期排程每隔重新整理間隔才刪除,
+    所以需多保留寬限時間 (至少 1 天 與到期排程的重新整理間隔), 避免 pack 檔早於引用它的說明檔被刪除
+    """
+
+    def __init__(self, client, folder_id: str, index_path: str = '.mega_chunks.json', account: str = None, pack_size: int = 64 * 1024 * 1024, expired_days: int = 7) -> None:
+        """_summary_
+
+        Args:
+            client (Mega_Custom): 已登入的 client
+            folder_id (str): 備份的 mega 資料夾 id
+            index_path (str, optional): 分塊索引檔路徑. Defaults to '.mega_chunks.json'.
+            account (str, optional): mega 帳號. Defaults to None.
+            pack_size (int, optional): pack 檔大小. Defaults to 64MB.
+            expired_days (int, optional): 保留天數. Defaults to 7.
+        """
+        self.client = client
+        self.folder_id = folder_id
+        self.index = ChunkIndex(index_path, account)
+        self.pack_size = pack_size
+        self.expired_days = expired_days
+        self.gc_grace = 24 * 60 * 60
+        self.compression = None
+        self.compression_level = None
+        self.chunk_sizes = (256 * 1024, 1024 * 1024, 4 * 1024 * 1024)
+        self.lock = threading.Lock()
+        self.metrics = MegaMetrics.get_instance()
+
+    def set_client(self, client):
+        """設置 client
+
+        Args:
+            client (Mega_Custom): 已登入的 client
+        """
+        self.client = client
+
+    def set_pack_size(self, size: int):
+        """設置 pack 檔大小
+
+        Args:
+            size (int): bytes
+        """
+        self.pack_size = size
+
+    def set_expired_days(self, days: int):
+        """設置 保留天數
+
+        Args:
+            days (int): 天數
+        """
+        self.expired_days = days
+
+    def set_gc_grace(self, seconds: int):
+        """設置 刪除 pack 檔前 超過保留天數後的寬限時間, 不小於 1 天
+
+        Args:
+            seconds (int): 秒數, 應不小於到期排程的重新整理間隔
+        """
+        self.gc_grace = max(24 * 60 * 60, seconds)
+
+    def set_compression(self, codec: str, level: int = None):
+        """設置 分塊的壓縮格式 各分塊獨立壓縮
+
+        Args:
+            codec (str): gzip, bz2, xz, None 為不壓縮
+            level (int, optional): 壓縮等級. Defaults to 壓縮格式的預設等級.
+        """
+        get_codec_extension(codec)
+        self.compression = codec or None
+        self.compression_level = level
+
+    def set_chunk_size(self, avg_size: int):
+        """設置 平均分塊大小 下限為 1/4 上限為 4 倍, 只在建立新索引時套用
+
+        Args:
+            avg_size (int): bytes
+        """
+        self.chunk_sizes = (max(CHUNK_WINDOW * 2, avg_size // 4), avg_size, avg_size * 4)
+
+    def backup(self, path: str) -> str:
+        """分塊並上傳新的分塊 寫入說明檔 {path}.recipe
+
+        Args:
+            path (str): 檔案路徑
+
+        Returns:
+            str: 說明檔路徑
+        """
+        with self.lock:
+            self.index.load()
+            start = time()
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                size = os.fstat(fd).st_size
+                chunker = self.__get_chunker(fd)
+                chunks, locations, used, uploaded = self.__store_chunks(path, fd, size, chunker)
+            finally:
+                os.close(fd)
+
+            digest = new_hasher()
+            for chunk_digest, _ in chunks:
+                digest.update(bytes.fromhex(chunk_digest))
+            recipe = {
+                'name': os.path.basename(path),
+                'size': size,
+                'algorithm': DIGEST_ALGORITHM,
+                'digest': digest.hexdigest(),
+                'chunks': chunks,
+                'locations': locations
+            }
+            recipe_path = f'{path}{RECIPE_EXTENSION}'
+            with open(f'{recipe_path}.temp', 'w') as f:
+                f.write(json.dumps(recipe))
+
+            self.index.touch(used)
+            self.index.save()
+            os.replace(f'{recipe_path}.temp', recipe_path)
+
+            self.metrics.inc('mega_dedup_bytes_total', size)
+            self.metrics.inc('mega_dedup_uploaded_bytes_total', uploaded)
+            self.metrics.observe('mega_dedup_seconds', time() - start)
+            logger.info(f'=== 去重複 {recipe["name"]} {len(chunks)} 個分塊 {len(locations)} 個不重複, 上傳 {uploaded} / {size} bytes 耗時{round(time() - start, 2)}秒 ===')
+
+            self.collect_garbage()
+            return recipe_path
+
+    def collect_garbage(self):
+        """刪除超過 保留天數 + 寬限時間 未被使用的 pack 檔
+        """
+        expired = time() - self.expired_days * 24 * 60 * 60 - self.gc_grace
+        for name, pack in list(self.index.packs.items()):
+            if pack['last_used'] >= expired:
+                continue
+            logger.info(f'=== 刪除mega上的 {name} 已超過{self.expired_days}天未使用 ===')
+            try:
+                self.client.destroy(pack['h'])
+            except Exception as err:
+                logger.error(msg=err, exc_info=True)
+                continue
+            self.index.remove_pack(name)
+            self.index.save()
+            self.metrics.inc('mega_dedup_removed_packs_total')
+
+    def __get_chunker(self, fd: int) -> ContentChunker:
+        """建立分塊物件 索引中沒有參數時 以檔案開頭校正, 檔案太小時不保存參數 下次重新校正
+
+        Args:
+            fd (int): 檔案 fd
+
+        Returns:
+            ContentChunker: 分塊物件
+        """
+        if self.index.chunker:
+            return ContentChunker(params=self.index.chunker)
+        chunker = ContentChunker(*self.chunk_sizes)
+        sample = os.pread(fd, CALIBRATION_SIZE, 0)
+        chunker.calibrate(sample)
+        if len(sample) >= CALIBRATION_SIZE:
+            self.index.chunker = chunker.get_params()
+        return chunker
+
+    def __store_chunks(self, path: str, fd: int, size: int, chunker: ContentChunker) -> tuple:
+        """分塊 新的分塊寫入 pack 檔並上傳
+
+        Args:
+            path (str): 檔案路徑
+            fd (int): 檔案 fd
+            size (int): 檔案大小
+            chunker (ContentChunker): 分塊物件
+
+        Returns:
+            tuple: ([[分塊摘要, 大小]], {分塊摘要: [pack 檔名, pack 內位置, 儲存大小, 壓縮格式]}, 使用的 pack 檔名, 上傳的 bytes)
+        """
+        chunks = []
+        locations = {}
+        used = set()
+        uploaded = 0
+        pack = None
+        number = 0
+        try:
+            for _, data in chunker.split(fd, size):
+                digest = hashlib.new(DIGEST_ALGORITHM, data).hexdigest()
+                chunks.append([digest, len(data)])
+                if digest in locations:
+                    continue
+                entry = self.index.chunks.get(digest)
+                if entry is not None:
+                    locations[digest] = [entry[0], entry[1], entry[2], self.index.packs[entry[0]]['codec']]
+                    used.add(entry[0])
+                    continue
+
+                if pack is None:
+                    number += 1
+                    pack = self.__new_pack(f'{path}.{number}{PACK_EXTENSION}.temp')
+                stored = self.__compress(data)
+                offset = pack['size']
+                view = memoryview(stored)
+                while view:
+                    view = view[os.write(pack['fd'], view):]
+                pack['size'] += len(stored)
+                pack['chunks'][digest] = [offset, len(stored), len(data)]
+                locations[digest] = [pack['name'], offset, len(stored), self.compression]
+                used.add(pack['name'])
+
+                if pack['size'] >= self.pack_size:
+                    uploaded += self.__upload_pack(pack)
+                    pack = None
+            if pack is not None:
+                uploaded += self.__upload_pack(pack)
+                pack = None
+        finally:
+            if pack is not None and pack['fd'] is not None:
+                os.close(pack['fd'])
+        return chunks, locations, used, uploaded
+
+    def __new_pack(self, path: str) -> dict:
+        """建立本地 pack 檔 舊的上傳紀錄檔屬於內容不同的 pack 檔 一併刪除
+
+        Args:
+            path (str): 本地路徑
+
+        Returns:
+            dict: {'name', 'path', 'fd', 'size', 'chunks'}
+        """
+        if os.path.exists(f'{path}.journal'):
+            os.remove(f'{path}.journal')
+        return {
+            'name': f'{uuid.uuid4().hex}{PACK_EXTENSION}',
+            'path': path,
+            'fd': os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644),
+            'size': 0,
+            'chunks': {}
+        }
+
+    def __compress(self, data: memoryview) -> bytes:
+        """壓縮分塊
+
+        Args:
+            data (memoryview): 分塊內容
+
+        Returns:
+            bytes: 儲存的內容
+        """
+        if not self.compression:
+            return bytes(data)
+        _, default_level, new_compressor, _ = CODECS[self.compression]
+        compressor = new_compressor(default_level if self.compression_level is None else self.compression_level)
+        return compressor.compress(data) + compressor.flush()
+
+    def __upload_pack(self, pack: dict) -> int:
+        """上傳 pack 檔至 chunks 資料夾 完成後加入索引 並刪除本地檔案
+
+        Args:
+            pack (dict): __new_pack 的結果
+
+        Returns:
+            int: 上傳的 bytes
+        """
+        os.close(pack['fd'])
+        pack['fd'] = None
+        info = self.client.upload_c(
+            filename=pack['path'],
+            dest=self.__get_folder_id(),
+            dest_filename=pack['name'],
+            journal_path=f'{pack["path"]}.journal'
+        )
+        self.index.add_pack(pack['name'], info['f'][0]['h'], pack['size'], self.compression, pack['chunks'])
+        self.index.save()
+        os.remove(pack['path'])
+        self.metrics.inc('mega_dedup_packs_total')
+        logger.info(f'{pack["name"]} 已上傳 {len(pack["chunks"])} 個分塊 {pack["size"]} bytes')
+        return pack['size']
+
+    def __get_folder_id(self) -> str:
+        """取得 chunks 資料夾 id, 索引中沒有時 尋找或建立
+
+        Returns:
+            str: 資料夾 id
+        """
+        if self.index.folder_id:
+            return self.index.folder_id
+        nodes, _ = self.client.get_nodes()
+        folders = [node['h'] for node in nodes if node['t'] == 1 and node.get('p') == self.folder_id and isinstance(node['a'], dict) and node['a'].get('n') == CHUNK_FOLDER_NAME]
+        if folders:
+            self.index.folder_id = folders[0]
+        else:
+            self.index.folder_id = self.client.create_folder_from_id(CHUNK_FOLDER_NAME, self.folder_id)[CHUNK_FOLDER_NAME]
+        return self.index.folder_id
+
+
+def read_recipe(path: str) -> dict:
+    """讀取去重複備份說明檔
+
+    Args:
+        path (str): 說明檔路徑
+
+    Returns:
+        dict: {'name', 'size', 'algorithm', 'digest', 'chunks', 'locations'}
+    """
+    with open(path, 'r') as f:
+        return json.loads(f.read())
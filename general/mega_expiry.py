@@ -0,0 +1,201 @@
+from .mega_log import logger
+from .mega_index import NodeIndex
+from .mega_metrics import MegaMetrics
+from .mega_dedup import CHUNK_FOLDER_NAME
+from datetime import datetime
+from time import time
+import threading
+import logging
+import heapq
+import re
+
+
+# 分割時建立的日期子資料夾名稱
+DATE_FOLDER_PATTERN = r'^\d{8}$'
+
+
+class ExpiryScheduler:
+    """依到期時間刪除 mega 資料夾內的過期節點
+
+    以最小堆積保存各節點的到期時間, 只在 下一個節點到期 或 重新整理間隔到時 才醒來
+    重新整理時以節點索引 (action packets) 更新 不會取得完整節點列表
+    日期子資料夾 (YYYYMMDD) 以資料夾內最新的檔案計算到期時間, 到期時一次刪除整個資料夾
+    刪除資料夾失敗時 才逐一刪除資料夾內的過期檔案
+    去重複備份的 chunks 資料夾不排程, 其中的 pack 檔由分割程序依最後使用時間刪除
+    """
+
+    def __init__(self, client, folder_id: str, expired_days: int = 7, rescan_interval: int = 3600, node_index: NodeIndex = None) -> None:
+        """_summary_
+
+        Args:
+            client (Mega_Custom): 已登入的 client
+            folder_id (str): 檢查的 mega 資料夾 id
+            expired_days (int, optional): 保留天數. Defaults to 7.
+            rescan_interval (int, optional): 重新整理節點索引的間隔秒數. Defaults to 3600.
+            node_index (NodeIndex, optional): 節點索引. Defaults to 不存檔的節點索引.
+        """
+        self.client = client
+        self.folder_id = folder_id
+        self.expired_days = expired_days
+        self.rescan_interval = rescan_interval
+        self.node_index = node_index or NodeIndex(client, cache_path=None)
+
+        # [(到期時間戳, 節點 id)]
+        self.heap = []
+        self.stop_event = threading.Event()
+        self.metrics = MegaMetrics.get_instance()
+
+    def set_expired_days(self, days: int):
+        """設置 保留天數
+
+        Args:
+            days (int): 天數
+        """
+        self.expired_days = days
+
+    def set_rescan_interval(self, seconds: int):
+        """設置 重新整理節點索引的間隔秒數
+
+        Args:
+            seconds (int): 秒數
+        """
+        self.rescan_interval = seconds
+
+    def run(self):
+        """執行排程 直到 stop()
+        """
+        while not self.stop_event.is_set():
+            try:
+                self.rescan()
+            except Exception as err:
+                logger.error(msg=err, exc_info=True)
+
+            next_rescan = time() + self.rescan_interval
+            while not self.stop_event.is_set():
+                now = time()
+                if now >= next_rescan:
+                    break
+                if self.heap and self.heap[0][0] <= now:
+                    self.__expire(now)
+                    continue
+                wake = next_rescan
+                if self.heap:
+                    wake = min(wake, self.heap[0][0])
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug('下次檢查 %s', datetime.fromtimestamp(wake).__format__("%Y-%m-%d %H:%M:%S"))
+                self.stop_event.wait(wake - now)
+
+    def run_once(self):
+        """重新整理 並刪除目前已到期的節點
+        """
+        self.rescan()
+        self.__expire(time())
+
+    def stop(self):
+        """停止排程
+        """
+        self.stop_event.set()
+
+    def rescan(self):
+        """更新節點索引 重建到期時間堆積
+        """
+        with self.metrics.timer('mega_expiry_sweep_seconds', step='rescan'):
+            self.node_index.refresh()
+        self.heap = [(self.__expire_at(handle, info), handle) for handle, info in self.node_index.get_children(self.folder_id).items() if not self.__is_chunk_folder(info)]
+        heapq.heapify(self.heap)
+        logger.info(f'到期排程 {len(self.heap)} 個節點')
+
+    def __expire(self, now: float):
+        """刪除所有已到期的節點
+
+        Args:
+            now (float): 目前時間戳
+        """
+        start = time()
+        children = self.node_index.get_children(self.folder_id)
+        while self.heap and self.heap[0][0] <= now:
+            expire_at, handle = heapq.heappop(self.heap)
+            info = children.get(handle)
+            # 已被刪除 或 時間戳已更新
+            if info is None or self.__expire_at(handle, info) != expire_at:
+                continue
+            if self.__is_date_folder(info):
+                if not self.__remove(handle, info, expire_at):
+                    self.__remove_files(handle, now)
+            else:
+                self.__remove(handle, info, expire_at)
+        self.metrics.observe('mega_expiry_sweep_seconds', time() - start, step='expire')
+
+    def __is_date_folder(self, info: dict) -> bool:
+        """是否為日期子資料夾
+
+        Args:
+            info (dict): 節點資訊
+
+        Returns:
+            bool: _description_
+        """
+        return info['t'] == 1 and isinstance(info['a'], dict) and bool(re.search(DATE_FOLDER_PATTERN, info['a'].get('n', '')))
+
+    def __is_chunk_folder(self, info: dict) -> bool:
+        """是否為去重複備份的 chunks 資料夾
+
+        Args:
+            info (dict): 節點資訊
+
+        Returns:
+            bool: _description_
+        """
+        return info['t'] == 1 and isinstance(info['a'], dict) and info['a'].get('n') == CHUNK_FOLDER_NAME
+
+    def __expire_at(self, handle: str, info: dict) -> int:
+        """計算到期時間戳 日期子資料夾以資料夾內最新的檔案計算
+
+        Args:
+            handle (str): 節點 id
+            info (dict): 節點資訊
+
+        Returns:
+            int: 到期時間戳
+        """
+        ts = info['ts']
+        if self.__is_date_folder(info):
+            ts = max([ts] + [child['ts'] for child in self.node_index.get_children(handle).values()])
+        return ts + self.expired_days * 24 * 60 * 60
+
+    def __remove(self, handle: str, info: dict, expire_at: int) -> bool:
+        """刪除 mega 上的節點 資料夾會連同內容一起刪除
+
+        Args:
+            handle (str): 節點 id
+            info (dict): 節點資訊
+            expire_at (int): 到期時間戳
+
+        Returns:
+            bool: 是否已刪除
+        """
+        name = info['a']['n'] if isinstance(info['a'], dict) else handle
+        newest = datetime.fromtimestamp(expire_at - self.expired_days * 24 * 60 * 60).__format__("%Y-%m-%d %H:%M:%S")
+        logger.info(f'=== {name} 創建日期{newest} 已超過{self.expired_days}天 ===')
+        try:
+            self.client.destroy(handle)
+            self.node_index.remove(handle)
+            self.metrics.inc('mega_expired_nodes_total')
+            logger.info(f'=== 刪除mega上的 {name} 結束 ===')
+            return True
+        except Exception as err:
+            logger.error(msg=err, exc_info=True)
+            return False
+
+    def __remove_files(self, folder_id: str, now: float):
+        """逐一刪除資料夾內的過期檔案
+
+        Args:
+            folder_id (str): 資料夾 id
+            now (float): 目前時間戳
+        """
+        logger.warning(f'刪除資料夾 {folder_id} 失敗 改為逐一刪除過期檔案')
+        for handle, info in self.node_index.get_children(folder_id).items():
+            expire_at = self.__expire_at(handle, info)
+            if expire_at <= now:
+                self.__remove(handle, info, expire_at)
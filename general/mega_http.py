@@ -0,0 +1,141 @@
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+import threading
+import requests
+
+
+class _ConnectionCounter:
+    """統計 HTTP 請求數 與 新建立的連線數
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+
+    def add_request(self):
+        with self.lock:
+            self.requests += 1
+
+    def add_connection(self):
+        with self.lock:
+            self.new_connections += 1
+
+
+def _counting_pool(pool_class, counter: _ConnectionCounter):
+    """建立 新連線時計數 的連線池類別
+
+    Args:
+        pool_class (_type_): urllib3 連線池類別
+        counter (_ConnectionCounter): 計數器
+
+    Returns:
+        _type_: 連線池類別
+    """
+    class CountingPool(pool_class):
+        def _new_conn(self):
+            counter.add_connection()
+            return super()._new_conn()
+    return CountingPool
+
+
+class _CountingAdapter(HTTPAdapter):
+    """記錄請求數 與 新連線數 的 HTTPAdapter
+    """
+
+    def __init__(self, counter: _ConnectionCounter, *args, **kwargs) -> None:
+        self.counter = counter
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _counting_pool(HTTPConnectionPool, self.counter),
+            'https': _counting_pool(HTTPSConnectionPool, self.counter)
+        }
+
+    def send(self, *args, **kwargs):
+        self.counter.add_request()
+        return super().send(*args, **kwargs)
+
+
+class MegaHttpSession:
+    """程序內共用 keep-alive 的 HTTP 連線池
+
+    分塊上傳 與 API 請求 共用, 避免每個分塊重新建立 TLS 連線
+    """
+
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    def __init__(self, pool_size: int = 10) -> None:
+        """_summary_
+
+        Args:
+            pool_size (int, optional): 每個主機保留的連線數. Defaults to 10.
+        """
+        self.counter = _ConnectionCounter()
+        self.session = requests.Session()
+        self.pool_size = None
+        self.set_pool_size(pool_size)
+
+    @classmethod
+    def get_instance(cls):
+        """取得程序內共用的連線池
+
+        Returns:
+            MegaHttpSession: 共用的連線池
+        """
+        with cls.__instance_lock:
+            if cls.__instance is None:
+                cls.__instance = cls()
+            return cls.__instance
+
+    def set_pool_size(self, pool_size: int):
+        """設置 每個主機保留的連線數
+
+        Args:
+            pool_size (int): 連線數
+        """
+        pool_size = max(1, pool_size)
+        if pool_size == self.pool_size:
+            return
+        self.pool_size = pool_size
+        adapter = _CountingAdapter(self.counter, pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        """POST 請求
+
+        Args:
+            url (str): 網址
+
+        Returns:
+            requests.Response: 回應
+        """
+        return self.session.post(url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """GET 請求
+
+        Args:
+            url (str): 網址
+
+        Returns:
+            requests.Response: 回應
+        """
+        return self.session.get(url, **kwargs)
+
+    def get_stats(self) -> dict:
+        """取得連線重複使用統計
+
+        Returns:
+            dict: {'requests': 請求數, 'new_connections': 新建立連線數, 'reused_connections': 重複使用連線數}
+        """
+        with self.counter.lock:
+            return {
+                'requests': self.counter.requests,
+                'new_connections': self.counter.new_connections,
+                'reused_connections': max(0, self.counter.requests - self.counter.new_connections)
+            }
@@ -0,0 +1,251 @@
+from .mega_log import logger
+from .crypto import base64_url_decode, decrypt_attr
+from mega.errors import RequestError
+from time import time
+import threading
+import json
+import os
+
+
+class NodeIndex:
+    """本地 mega 節點索引 以父節點分類 存於快取檔
+
+    第一次 (或序號失效時) 以 'f' 取得完整節點列表,
+    之後只以 action packet 序號 (sc?sn=) 取得變更 (新增 't', 刪除 'd', 屬性更新 'u')
+    取得資料夾內的檔案 不需要每次下載並解密整個帳號的節點
+    """
+
+    def __init__(self, client, cache_path: str = '.mega_nodes.json', account: str = None) -> None:
+        """_summary_
+
+        Args:
+            client (Mega_Custom): 已登入的 client
+            cache_path (str, optional): 索引快取檔路徑, None 時不存檔. Defaults to '.mega_nodes.json'.
+            account (str, optional): mega 帳號 快取檔帳號不符時重新建立. Defaults to None.
+        """
+        self.client = client
+        self.cache_path = cache_path
+        self.account = account.lower() if account else None
+
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.sn = None
+        # {父節點: {節點: 節點資訊}}
+        self.children = {}
+        # {節點: 父節點}
+        self.parents = {}
+
+    def set_client(self, client):
+        """設置 client
+
+        Args:
+            client (Mega_Custom): 已登入的 client
+        """
+        self.client = client
+
+    def refresh(self):
+        """更新索引 有序號時只套用 action packets, 否則完整更新
+        """
+        with self.lock:
+            if not self.loaded:
+                self.__load()
+                self.loaded = True
+
+            if self.sn is None:
+                self.__full_refresh()
+                return
+
+            try:
+                changed = self.__apply_action_packets()
+            except RequestError as err:
+                logger.warning(f'取得 action packets 失敗 ({err}) 改為完整更新')
+                self.__full_refresh()
+                return
+            if changed:
+                self.__save()
+
+    def get_children(self, parent: str) -> dict:
+        """取得資料夾內的節點
+
+        Args:
+            parent (str): 資料夾 id
+
+        Returns:
+            dict: {節點 id: {'h', 'p', 't', 'ts', 'a'}}
+        """
+        with self.lock:
+            return dict(self.children.get(parent, {}))
+
+    def remove(self, handle: str):
+        """自索引移除節點與其子節點 (已自 mega 刪除時呼叫)
+
+        Args:
+            handle (str): 節點 id
+        """
+        with self.lock:
+            if self.__remove(handle):
+                self.__save()
+
+    def __full_refresh(self):
+        """以 'f' 取得完整節點列表 重建索引
+        """
+        start = time()
+        nodes, sn = self.client.get_nodes()
+        self.children = {}
+        self.parents = {}
+        for node in nodes:
+            self.__add(node)
+        self.sn = sn
+        self.__save()
+        logger.info(f'節點索引 完整更新 {len(self.parents)} 個節點 耗時{round(time() - start, 1)}秒')
+
+    def __apply_action_packets(self) -> bool:
+        """套用序號之後的 action packets 直到已是最新
+
+        Returns:
+            bool: 索引是否有變更
+        """
+        changed = False
+        while True:
+            resp = self.client.get_action_packets(self.sn)
+            packets = resp.get('a', [])
+            for packet in packets:
+                if self.__apply(packet):
+                    changed = True
+            if resp.get('sn') and resp['sn'] != self.sn:
+                self.sn = resp['sn']
+                changed = True
+            if 'w' in resp or not packets:
+                break
+        return changed
+
+    def __apply(self, packet: dict) -> bool:
+        """套用單一 action packet
+
+        Args:
+            packet (dict): action packet
+
+        Returns:
+            bool: 索引是否有變更
+        """
+        action = packet.get('a')
+        if action == 't':
+            changed = False
+            for node in packet.get('t', {}).get('f', []):
+                if self.__add(self.client.process_node(node)):
+                    changed = True
+            return changed
+        if action == 'd':
+            return self.__remove(packet.get('n'))
+        if action == 'u':
+            return self.__update(packet)
+        return False
+
+    def __add(self, node: dict) -> bool:
+        """加入節點 只保留到期檢查需要的欄位
+
+        Args:
+            node (dict): 已解密的節點
+
+        Returns:
+            bool: 是否已加入
+        """
+        if not node.get('a'):
+            return False
+        handle = node['h']
+        parent = node.get('p', '')
+        # 節點被移動時 先自原資料夾移除
+        old_parent = self.parents.get(handle)
+        if old_parent is not None and old_parent != parent:
+            self.children[old_parent].pop(handle, None)
+
+        info = {
+            'h': handle,
+            'p': parent,
+            't': node['t'],
+            'ts': node.get('ts', 0),
+            'a': node['a']
+        }
+        if isinstance(node.get('k'), (tuple, list)):
+            info['k'] = list(node['k'])
+        self.children.setdefault(parent, {})[handle] = info
+        self.parents[handle] = parent
+        return True
+
+    def __remove(self, handle: str) -> bool:
+        """移除節點與其子節點
+
+        Args:
+            handle (str): 節點 id
+
+        Returns:
+            bool: 是否已移除
+        """
+        if handle not in self.parents:
+            return False
+        stack = [handle]
+        while stack:
+            current = stack.pop()
+            parent = self.parents.pop(current, None)
+            if parent is not None:
+                self.children.get(parent, {}).pop(current, None)
+            stack.extend(self.children.pop(current, {}).keys())
+        return True
+
+    def __update(self, packet: dict) -> bool:
+        """更新節點屬性 (改名等)
+
+        Args:
+            packet (dict): action packet {'a': 'u', 'n': 節點 id, 'at': 加密屬性, 'ts': 時間戳}
+
+        Returns:
+            bool: 是否已更新
+        """
+        handle = packet.get('n')
+        parent = self.parents.get(handle)
+        if parent is None:
+            return False
+        info = self.children[parent][handle]
+        if 'ts' in packet:
+            info['ts'] = packet['ts']
+        if 'at' in packet and 'k' in info:
+            attributes = decrypt_attr(base64_url_decode(packet['at']), info['k'])
+            if attributes:
+                info['a'] = attributes
+        return True
+
+    def __load(self):
+        """讀取快取檔 帳號不符或格式錯誤時忽略
+        """
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, 'r') as f:
+                cache = json.loads(f.read())
+            if self.account and cache.get('account') != self.account:
+                return
+            self.children = cache['children']
+            self.parents = {handle: parent for parent, nodes in self.children.items() for handle in nodes}
+            self.sn = cache['sn']
+        except Exception as err:
+            logger.error(msg=err, exc_info=True)
+            self.children = {}
+            self.parents = {}
+            self.sn = None
+
+    def __save(self):
+        """寫入快取檔 權限 600
+        """
+        if not self.cache_path:
+            return
+        cache = {
+            'account': self.account,
+            'sn': self.sn,
+            'children': self.children,
+            'ts': int(time())
+        }
+        temp_path = f'{self.cache_path}.temp'
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(json.dumps(cache))
+        os.replace(temp_path, self.cache_path)
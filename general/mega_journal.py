@@ -0,0 +1,117 @@
+from .mega_log import logger
+from time import time
+import binascii
+import threading
+import json
+import os
+
+
+class UploadJournal:
+    """上傳紀錄檔 用於中斷後續傳
+
+    記錄 上傳網址, ul_key, 已確認的分塊位置 與 各分塊的 MAC
+    程序中斷或容器重啟後 可從最後確認的分塊繼續上傳
+    """
+
+    def __init__(self, path: str) -> None:
+        """_summary_
+
+        Args:
+            path (str): 紀錄檔路徑
+        """
+        self.path = path
+        self.lock = threading.Lock()
+
+        self.ul_url = None
+        self.ul_key = None
+        self.file_size = None
+        # {分塊位置: 分塊 MAC}
+        self.chunks = {}
+        self.completion_file_handle = None
+
+    def load(self, file_size: int) -> bool:
+        """讀取紀錄檔 檔案大小不符 或 無法讀取 視為無紀錄
+
+        Args:
+            file_size (int): 檔案大小
+
+        Returns:
+            bool: 是否有可續傳的紀錄
+        """
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, 'r') as f:
+                journal = json.loads(f.read())
+        except Exception as err:
+            logger.error(msg=err, exc_info=True)
+            return False
+
+        if journal.get('file_size') != file_size:
+            logger.debug(f'上傳紀錄 {self.path} 檔案大小不符')
+            return False
+
+        self.ul_url = journal['ul_url']
+        self.ul_key = journal['ul_key']
+        self.file_size = file_size
+        self.chunks = {int(chunk_start): binascii.unhexlify(chunk_mac) for chunk_start, chunk_mac in journal['chunks'].items()}
+        self.completion_file_handle = journal.get('completion_file_handle')
+        return True
+
+    def start(self, ul_url: str, ul_key: list, file_size: int):
+        """開始新的上傳紀錄
+
+        Args:
+            ul_url (str): 上傳網址
+            ul_key (list): 檔案金鑰 a32 格式
+            file_size (int): 檔案大小
+        """
+        with self.lock:
+            self.ul_url = ul_url
+            self.ul_key = list(ul_key)
+            self.file_size = file_size
+            self.chunks = {}
+            self.completion_file_handle = None
+            self.__save()
+
+    def ack(self, chunk_macs: dict, completion_file_handle: str = None):
+        """記錄同一次 POST 確認的分塊
+
+        Args:
+            chunk_macs (dict): {分塊位置: 分塊 MAC}
+            completion_file_handle (str, optional): 完成上傳時的 completion handle. Defaults to None.
+        """
+        with self.lock:
+            self.chunks.update(chunk_macs)
+            if completion_file_handle:
+                self.completion_file_handle = completion_file_handle
+            self.__save()
+
+    def remove(self):
+        """刪除紀錄檔
+        """
+        with self.lock:
+            self.ul_url = None
+            self.chunks = {}
+            self.completion_file_handle = None
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def __save(self):
+        """寫入紀錄檔 權限 600 需在鎖內呼叫
+        """
+        journal = {
+            'ul_url': self.ul_url,
+            'ul_key': self.ul_key,
+            'file_size': self.file_size,
+            'chunks': {str(chunk_start): binascii.hexlify(chunk_mac).decode() for chunk_start, chunk_mac in self.chunks.items()},
+            'completion_file_handle': self.completion_file_handle,
+            'ts': int(time())
+        }
+        temp_path = f'{self.path}.temp'
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(json.dumps(journal))
+        os.replace(temp_path, self.path)
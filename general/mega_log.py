@@ -1,8 +1,13 @@
-from logging.handlers import TimedRotatingFileHandler, RotatingFileHandler
+from logging.handlers import TimedRotatingFileHandler, RotatingFileHandler, QueueHandler, QueueListener
 from traceback import print_exc
 from datetime import datetime
+from time import time
+import threading
 import logging
 import socket
+import atexit
+import queue
+import copy
 import os
 
 
@@ -29,21 +34,129 @@ try:
     # 指定保留log天數(輸入數字) 預設7
     LOG_DAYS = int(os.environ.get('LOG_DAYS', 7))
 
+    # 非同步寫入log 由背景執行緒寫入檔案與終端 預設開啟
+    LOG_ASYNC = os.environ.get('LOG_ASYNC', True)
+    if LOG_ASYNC == 'false' or LOG_ASYNC == 'False' or LOG_ASYNC == '0':
+        LOG_ASYNC = False
+    else:
+        LOG_ASYNC = True
+
+    # 非同步佇列上限 佇列已滿時捨棄新的log 不阻塞呼叫端
+    LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+
+    # 上傳進度log 最短間隔秒數 與 最小百分比間隔
+    LOG_PROGRESS_INTERVAL = float(os.environ.get('LOG_PROGRESS_INTERVAL', 5))
+    LOG_PROGRESS_STEP = float(os.environ.get('LOG_PROGRESS_STEP', 10))
+
     log_setting = {
         'LOG_PATH': LOG_PATH,
         'LOG_DISABLE': LOG_DISABLE,
         'LOG_FILE_DISABLE': LOG_FILE_DISABLE,
         'LOG_LEVEL': LOG_LEVEL,
         'LOG_SIZE': LOG_SIZE,
-        'LOG_DAYS': LOG_DAYS
+        'LOG_DAYS': LOG_DAYS,
+        'LOG_ASYNC': LOG_ASYNC,
+        'LOG_QUEUE_SIZE': LOG_QUEUE_SIZE,
+        'LOG_PROGRESS_INTERVAL': LOG_PROGRESS_INTERVAL,
+        'LOG_PROGRESS_STEP': LOG_PROGRESS_STEP
     }
 except Exception as err:
     print_exc()
 
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """佇列已滿時捨棄 log 不阻塞呼叫端, 呼叫端只合併訊息參數 格式化由背景執行緒處理
+    捨棄的筆數 於下次放入佇列成功時 (或程序結束時) 以 WARNING 記錄
+    """
+
+    def __init__(self, log_queue: queue.Queue) -> None:
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            if self.dropped:
+                self.queue.put_nowait(self.__dropped_record(record.name))
+                self.dropped = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def report_dropped(self):
+        """記錄尚未回報的捨棄筆數 程序結束時 於背景執行緒停止前呼叫
+        """
+        with self.lock:
+            if not self.dropped:
+                return
+            try:
+                self.queue.put(self.__dropped_record(logger.name), timeout=1)
+                self.dropped = 0
+            except queue.Full:
+                pass
+
+    def __dropped_record(self, name: str) -> logging.LogRecord:
+        return logging.makeLogRecord({
+            'name': name,
+            'levelno': logging.WARNING,
+            'levelname': logging.getLevelName(logging.WARNING),
+            'msg': f'log 佇列已滿 已捨棄 {self.dropped} 筆 log'
+        })
+
+
+class ProgressThrottle:
+    """合併進度 log, 距上次記錄超過 interval 秒 或 進度增加超過 step 百分比 才記錄, 完成時一定記錄
+    """
+
+    def __init__(self, interval: float = None, step: float = None) -> None:
+        """_summary_
+
+        Args:
+            interval (float, optional): 最短間隔秒數. Defaults to LOG_PROGRESS_INTERVAL.
+            step (float, optional): 最小百分比間隔. Defaults to LOG_PROGRESS_STEP.
+        """
+        self.interval = LOG_PROGRESS_INTERVAL if interval is None else interval
+        self.step = LOG_PROGRESS_STEP if step is None else step
+        self.lock = threading.Lock()
+        self.last_time = 0
+        self.last_precent = None
+
+    def should_log(self, done: int, total: int) -> bool:
+        """是否記錄這次進度
+
+        Args:
+            done (int): 已完成
+            total (int): 總數
+
+        Returns:
+            bool: _description_
+        """
+        precent = 100.0 * done / total if total else 100.0
+        now = time()
+        with self.lock:
+            if (
+                done >= total
+                or self.last_precent is None
+                or now - self.last_time >= self.interval
+                or precent - self.last_precent >= self.step
+            ):
+                self.last_time = now
+                self.last_precent = precent
+                return True
+        return False
+
+
 # 建立log資料夾
 if not os.path.exists(LOG_PATH) and not LOG_DISABLE:
     os.makedirs(LOG_PATH)
 
+logger = logging.getLogger(HOSTNAME)
+
 if LOG_DISABLE:
     logging.disable()
 else:
@@ -63,8 +176,6 @@ else:
     log_msg_handler = logging.StreamHandler()
     log_msg_handler.setFormatter(log_formatter)
 
-    logger = logging.getLogger(HOSTNAME)
-
     if LOG_LEVEL == 'DEBUG':
         logger.setLevel(logging.DEBUG)
     elif LOG_LEVEL == 'INFO':
@@ -76,8 +187,21 @@ else:
     elif LOG_LEVEL == 'CRITICAL':
         logger.setLevel(logging.CRITICAL)
 
+    log_handlers = [log_msg_handler]
     if not LOG_FILE_DISABLE:
-        logger.addHandler(log_file_handler)
-    logger.addHandler(log_msg_handler)
+        log_handlers.insert(0, log_file_handler)
+
+    if LOG_ASYNC:
+        # 呼叫端只放入佇列 由背景執行緒寫入 程序結束時寫完佇列中的 log
+        log_queue_handler = _NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        log_listener = QueueListener(log_queue_handler.queue, *log_handlers)
+        log_listener.start()
+        atexit.register(log_listener.stop)
+        # atexit 依註冊的相反順序執行 先回報捨棄筆數 再停止背景執行緒
+        atexit.register(log_queue_handler.report_dropped)
+        logger.addHandler(log_queue_handler)
+    else:
+        for log_handler in log_handlers:
+            logger.addHandler(log_handler)
 
     logger.debug(log_setting)
@@ -0,0 +1,229 @@
+from .mega_log import logger
+from contextlib import contextmanager
+from time import time, perf_counter
+import threading
+import atexit
+import json
+import os
+
+
+# 直方圖預設區間 (秒)
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+
+
+def _metric_key(name: str, labels: dict) -> str:
+    """名稱與標籤組成 Prometheus 格式的 key, 例如 mega_api_request_seconds{action="p"}
+
+    Args:
+        name (str): 名稱
+        labels (dict): 標籤
+
+    Returns:
+        str: key
+    """
+    if not labels:
+        return name
+    label_str = ','.join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+    return f'{name}{{{label_str}}}'
+
+
+class _Histogram:
+    """累計型直方圖
+    """
+
+    def __init__(self, buckets: tuple) -> None:
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+
+class MegaMetrics:
+    """程序內共用的各階段效能統計 (counter, gauge, histogram)
+
+    定期寫入 Prometheus textfile (.prom) 或 JSON 檔 供 node exporter 收集
+    """
+
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        # {name: {key: value}}
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+        self.path = None
+        self.interval = 15
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    @classmethod
+    def get_instance(cls):
+        """取得程序內共用的統計
+
+        Returns:
+            MegaMetrics: 共用的統計
+        """
+        with cls.__instance_lock:
+            if cls.__instance is None:
+                cls.__instance = cls()
+            return cls.__instance
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """counter 增加
+
+        Args:
+            name (str): 名稱
+            value (float, optional): 增加值. Defaults to 1.
+        """
+        key = _metric_key(name, labels)
+        with self.lock:
+            metric = self.counters.setdefault(name, {})
+            metric[key] = metric.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        """設置 gauge
+
+        Args:
+            name (str): 名稱
+            value (float): 值
+        """
+        key = _metric_key(name, labels)
+        with self.lock:
+            self.gauges.setdefault(name, {})[key] = value
+
+    def observe(self, name: str, value: float, **labels):
+        """記錄一次 histogram 量測
+
+        Args:
+            name (str): 名稱
+            value (float): 值 (秒)
+        """
+        key = _metric_key(name, labels)
+        with self.lock:
+            metric = self.histograms.setdefault(name, {})
+            histogram = metric.get(key)
+            if histogram is None:
+                histogram = metric[key] = _Histogram(DEFAULT_BUCKETS)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """記錄區塊執行秒數至 histogram
+
+        Args:
+            name (str): 名稱
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, perf_counter() - start, **labels)
+
+    def start_exporter(self, path: str, interval: int = 15):
+        """啟動背景執行緒 定期寫入統計檔, 副檔名 .json 為 JSON, 其他為 Prometheus 文字格式
+        程序結束時 寫入最後一次
+
+        Args:
+            path (str): 統計檔路徑
+            interval (int, optional): 寫入間隔秒數. Defaults to 15.
+        """
+        self.path = path
+        self.interval = interval
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self.__export_loop, daemon=True)
+            self.thread.start()
+        atexit.register(self.stop_exporter)
+
+    def stop_exporter(self):
+        """停止背景寫入 並寫入最後一次
+        """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=self.interval)
+        if self.path:
+            try:
+                self.write(self.path)
+            except Exception as err:
+                logger.error(msg=err, exc_info=True)
+
+    def write(self, path: str):
+        """寫入統計檔 先寫入 .temp 再改名 避免被讀到寫入中的檔案
+
+        Args:
+            path (str): 統計檔路徑
+        """
+        text = self.to_json() if path.endswith('.json') else self.to_prometheus()
+        temp_path = f'{path}.temp'
+        with open(temp_path, 'w') as f:
+            f.write(text)
+        os.replace(temp_path, path)
+
+    def to_prometheus(self) -> str:
+        """Prometheus 文字格式
+
+        Returns:
+            str: 文字
+        """
+        lines = []
+        with self.lock:
+            for name, metric in sorted(self.counters.items()):
+                lines.append(f'# TYPE {name} counter')
+                lines.extend(f'{key} {value}' for key, value in sorted(metric.items()))
+            for name, metric in sorted(self.gauges.items()):
+                lines.append(f'# TYPE {name} gauge')
+                lines.extend(f'{key} {value}' for key, value in sorted(metric.items()))
+            for name, metric in sorted(self.histograms.items()):
+                lines.append(f'# TYPE {name} histogram')
+                for key, histogram in sorted(metric.items()):
+                    labels = key[len(name) + 1:-1] if key != name else ''
+                    prefix = f'{labels},' if labels else ''
+                    suffix = f'{{{labels}}}' if labels else ''
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {count}')
+                    lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {histogram.count}')
+                    lines.append(f'{name}_sum{suffix} {histogram.sum}')
+                    lines.append(f'{name}_count{suffix} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def to_json(self) -> str:
+        """JSON 格式
+
+        Returns:
+            str: 文字
+        """
+        with self.lock:
+            stats = {
+                'ts': int(time()),
+                'counters': {key: value for metric in self.counters.values() for key, value in metric.items()},
+                'gauges': {key: value for metric in self.gauges.values() for key, value in metric.items()},
+                'histograms': {
+                    key: {
+                        'count': histogram.count,
+                        'sum': histogram.sum,
+                        'buckets': {str(bound): count for bound, count in zip(histogram.buckets, histogram.counts)}
+                    }
+                    for metric in self.histograms.values() for key, histogram in metric.items()
+                }
+            }
+        return json.dumps(stats)
+
+    def __export_loop(self):
+        """定期寫入統計檔
+        """
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.write(self.path)
+            except Exception as err:
+                logger.error(msg=err, exc_info=True)
@@ -0,0 +1,393 @@
+from .mega_log import logger
+from .mega_http import MegaHttpSession
+from .mega_metrics import MegaMetrics
+from .mega_split import CODECS, DIGEST_ALGORITHM, MANIFEST_EXTENSION, get_decompressor, new_hasher
+from .mega_dedup import CHUNK_FOLDER_NAME, RECIPE_EXTENSION
+from .crypto import a32_to_str
+from Crypto.Cipher import AES
+from Crypto.Util import Counter
+from concurrent.futures import ThreadPoolExecutor
+from tenacity import retry, stop_after_attempt, wait_exponential
+from time import time
+import hashlib
+import json
+import re
+import os
+
+
+# 下載時每次讀取 解密 寫入的大小
+DOWNLOAD_BLOCK_SIZE = 1024 * 1024
+
+# 分割檔名 {備份檔名}._{編號}[壓縮格式副檔名]
+PART_PATTERN = r'^(.+)\._(\d+)(' + '|'.join(re.escape(codec[0]) for codec in CODECS.values()) + r')?$'
+
+
+class MegaRestore:
+    """自 mega 資料夾 同時下載備份的分割檔 並寫入還原檔中各自的位置
+
+    每個分割檔: 'g' API 取得下載網址, 串流下載 CTR 解密 (壓縮的分割檔同時解壓縮), 以 pwrite 寫入預先配置大小的還原檔,
+    分割檔依編號 (而非檔名排序) 決定位置, 有分割說明檔時 以說明檔的位置與摘要驗證
+    去重複備份 依說明檔 (.recipe) 同時下載需要的 pack 檔, 只保留需要的分塊 驗證摘要後寫入各自的位置
+    """
+
+    def __init__(self, client, folder_id: str, connections: int = 4, timeout: int = 160, http: MegaHttpSession = None) -> None:
+        """_summary_
+
+        Args:
+            client (Mega_Custom): 已登入的 client
+            folder_id (str): 備份的 mega 資料夾 id
+            connections (int, optional): 同時下載的分割檔數. Defaults to 4.
+            timeout (int, optional): 下載 timeout 秒數. Defaults to 160.
+            http (MegaHttpSession, optional): 連線池. Defaults to 程序內共用的連線池.
+        """
+        self.client = client
+        self.folder_id = folder_id
+        self.connections = max(1, connections)
+        self.timeout = timeout
+        self.http = http or MegaHttpSession.get_instance()
+        self.metrics = MegaMetrics.get_instance()
+
+    def set_connections(self, connections: int):
+        """設置 同時下載的分割檔數
+
+        Args:
+            connections (int): 分割檔數
+        """
+        self.connections = max(1, connections)
+
+    def list_backups(self, date: str = None) -> dict:
+        """列出資料夾內的備份
+
+        Args:
+            date (str, optional): 日期子資料夾 YYYYMMDD. Defaults to 直接列出備份資料夾.
+
+        Returns:
+            dict: {備份檔名: 分割數}, 去重複備份為 0
+        """
+        backups = {}
+        for name in self.__get_files(date):
+            r = re.search(PART_PATTERN, name)
+            if r:
+                backups[r.group(1)] = backups.get(r.group(1), 0) + 1
+            elif name.endswith(RECIPE_EXTENSION):
+                backups.setdefault(name[:-len(RECIPE_EXTENSION)], 0)
+        return backups
+
+    def restore(self, name: str, output_dir: str, date: str = None) -> str:
+        """下載並組合備份 先寫入 .temp 全部完成並驗證後才改為正式檔名
+
+        Args:
+            name (str): 備份檔名 例如 backup.tar
+            output_dir (str): 還原檔資料夾
+            date (str, optional): 日期子資料夾 YYYYMMDD. Defaults to 直接使用備份資料夾.
+
+        Returns:
+            str: 還原檔路徑
+        """
+        files = self.__get_files(date)
+        recipe_name = f'{name}{RECIPE_EXTENSION}'
+        if recipe_name in files:
+            recipe = json.loads(self.__download_bytes(files[recipe_name]))
+            parts, manifest = [], recipe
+            size = recipe['size']
+        else:
+            recipe = None
+            parts, manifest = self.__get_layout(name, files)
+            size = sum(part['length'] for part in parts)
+
+        path = os.path.join(output_dir, name)
+        if os.path.exists(path):
+            raise FileExistsError(f'{path} 已存在')
+        temp_path = f'{path}.temp'
+
+        logger.info(f'=== 還原 {name} 開始, {len(recipe["chunks"]) if recipe else len(parts)} 個{"分塊" if recipe else "分割"} 共 {size} bytes ===')
+        start = time()
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            if recipe is not None:
+                digests = self.__download_recipe(recipe, fd)
+            else:
+                with ThreadPoolExecutor(max_workers=self.connections) as executor:
+                    codec = manifest.get('codec') if manifest is not None else None
+                    futures = [executor.submit(self.__download_part, files[part['name']], part, fd, codec) for part in parts]
+                    digests = [future.result() for future in futures]
+            os.fsync(fd)
+        except BaseException:
+            os.close(fd)
+            os.remove(temp_path)
+            raise
+        os.close(fd)
+
+        if manifest is not None and manifest.get('digest'):
+            digest = new_hasher()
+            for part_digest in digests:
+                digest.update(bytes.fromhex(part_digest))
+            if digest.hexdigest() != manifest['digest']:
+                os.remove(temp_path)
+                raise IOError(f'{name} 摘要不符')
+        elif manifest is not None:
+            logger.warning(f'{name} 分割時未計算摘要 未驗證摘要')
+        else:
+            logger.warning(f'{name} 沒有分割說明檔 未驗證摘要')
+
+        os.replace(temp_path, path)
+        self.metrics.observe('mega_restore_seconds', time() - start)
+        logger.info(f'=== 還原 {name} 完成 耗時{round(time() - start, 2)}秒 ===')
+        return path
+
+    def __get_files(self, date: str = None) -> dict:
+        """取得備份資料夾 (或日期子資料夾) 內的檔案
+
+        Args:
+            date (str, optional): 日期子資料夾 YYYYMMDD. Defaults to None.
+
+        Returns:
+            dict: {檔名: 已解密的節點}
+        """
+        nodes, _ = self.client.get_nodes()
+        folder_id = self.folder_id
+        if date:
+            folders = [node['h'] for node in nodes if node['t'] == 1 and node.get('p') == self.folder_id and isinstance(node['a'], dict) and node['a'].get('n') == date]
+            if not folders:
+                raise FileNotFoundError(f'找不到日期資料夾 {date}')
+            folder_id = folders[0]
+        return {node['a']['n']: node for node in nodes if node['t'] == 0 and node.get('p') == folder_id and isinstance(node['a'], dict)}
+
+    def __get_pack_files(self) -> dict:
+        """取得去重複備份 chunks 資料夾內的 pack 檔
+
+        Returns:
+            dict: {檔名: 已解密的節點}
+        """
+        nodes, _ = self.client.get_nodes()
+        folders = [node['h'] for node in nodes if node['t'] == 1 and node.get('p') == self.folder_id and isinstance(node['a'], dict) and node['a'].get('n') == CHUNK_FOLDER_NAME]
+        if not folders:
+            raise FileNotFoundError(f'找不到 {CHUNK_FOLDER_NAME} 資料夾')
+        return {node['a']['n']: node for node in nodes if node['t'] == 0 and node.get('p') == folders[0] and isinstance(node['a'], dict)}
+
+    def __get_layout(self, name: str, files: dict) -> tuple:
+        """取得各分割檔在還原檔中的位置, 有分割說明檔時使用說明檔
+
+        Args:
+            name (str): 備份檔名
+            files (dict): {檔名: 節點}
+
+        Returns:
+            tuple: ([{'name', 'offset', 'length', 'digest'(有說明檔時)}], 分割說明檔 或 None)
+        """
+        manifest_name = f'{name}{MANIFEST_EXTENSION}'
+        if manifest_name in files:
+            manifest = json.loads(self.__download_bytes(files[manifest_name]))
+            missing = [part['name'] for part in manifest['parts'] if part['name'] not in files]
+            if missing:
+                raise FileNotFoundError(f'{name} 缺少分割檔 {", ".join(missing)}')
+            return manifest['parts'], manifest
+
+        numbers = {}
+        for filename in files:
+            r = re.search(PART_PATTERN, filename)
+            if r and r.group(1) == name:
+                if r.group(3):
+                    # 壓縮前的大小只記錄在說明檔 無法計算位置
+                    raise FileNotFoundError(f'{name} 的分割檔已壓縮 需要分割說明檔 {manifest_name}')
+                numbers[int(r.group(2))] = filename
+        if not numbers:
+            raise FileNotFoundError(f'找不到 {name} 的分割檔')
+        missing = [str(number) for number in range(1, max(numbers) + 1) if number not in numbers]
+        if missing:
+            raise FileNotFoundError(f'{name} 缺少分割編號 {", ".join(missing)}')
+
+        parts = []
+        offset = 0
+        for number in sorted(numbers):
+            length = files[numbers[number]]['s']
+            parts.append({'name': numbers[number], 'offset': offset, 'length': length})
+            offset += length
+        return parts, None
+
+    def __open(self, node: dict):
+        """取得下載網址 開始串流下載
+
+        Args:
+            node (dict): 已解密的檔案節點
+
+        Returns:
+            tuple: (回應, CTR 解密物件, 檔案大小)
+        """
+        data = self.client._api_request({'a': 'g', 'g': 1, 'n': node['h']})
+        if 'g' not in data:
+            raise IOError(f'{node["a"]["n"]} 無法取得下載網址')
+        response = self.http.get(data['g'], stream=True, timeout=self.timeout)
+        response.raise_for_status()
+        iv = node['iv']
+        count = Counter.new(128, initial_value=((iv[0] << 32) + iv[1]) << 64)
+        cipher = AES.new(a32_to_str(node['k']), AES.MODE_CTR, counter=count)
+        return response, cipher, int(data['s'])
+
+    def __download_bytes(self, node: dict) -> bytes:
+        """下載小檔案 (分割說明檔) 至記憶體
+
+        Args:
+            node (dict): 已解密的檔案節點
+
+        Returns:
+            bytes: 檔案內容
+        """
+        response, cipher, _ = self.__open(node)
+        with response:
+            return cipher.decrypt(response.content)
+
+    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=2, min=2, max=60), reraise=True)
+    def __download_part(self, node: dict, part: dict, fd: int, codec: str = None) -> str:
+        """下載分割檔 解密 (解壓縮) 後寫入還原檔中的位置 失敗時整個分割檔重新下載
+
+        Args:
+            node (dict): 已解密的檔案節點
+            part (dict): {'name', 'offset', 'length', 'digest', 'stored_length'(壓縮時)}
+            fd (int): 還原檔 fd
+            codec (str, optional): 壓縮格式. Defaults to 不壓縮.
+
+        Returns:
+            str: 分割檔摘要
+        """
+        start = time()
+        response, cipher, size = self.__open(node)
+        stored_length = part.get('stored_length', part['length'])
+        if size != stored_length:
+            raise IOError(f'{part["name"]} 大小 {size} bytes, 應為 {stored_length} bytes')
+
+        decompressor = get_decompressor(codec) if codec else None
+        hasher = new_hasher()
+        position = 0
+
+        def write(data):
+            nonlocal position
+            if position + len(data) > part['length']:
+                raise IOError(f'{part["name"]} 超過分割大小')
+            data = memoryview(data)
+            hasher.update(data)
+            while data:
+                n = os.pwrite(fd, data, part['offset'] + position)
+                data = data[n:]
+                position += n
+
+        with response:
+            for block in response.iter_content(DOWNLOAD_BLOCK_SIZE):
+                data = cipher.decrypt(block)
+                write(decompressor.decompress(data) if decompressor else data)
+        if decompressor is not None and hasattr(decompressor, 'flush'):
+            write(decompressor.flush())
+        if position != part['length']:
+            raise IOError(f'{part["name"]} 還原 {position} bytes, 應為 {part["length"]} bytes')
+
+        digest = hasher.hexdigest()
+        if 'digest' in part and digest != part['digest']:
+            raise IOError(f'{part["name"]} 摘要不符')
+        self.metrics.inc('mega_restore_bytes_total', size)
+        self.metrics.observe('mega_restore_part_seconds', time() - start)
+        logger.info(f'{part["name"]} 已下載 {size} bytes')
+        return digest
+
+    def __download_recipe(self, recipe: dict, fd: int) -> list:
+        """依去重複備份說明檔 同時下載各 pack 檔 將需要的分塊寫入還原檔
+
+        Args:
+            recipe (dict): 說明檔
+            fd (int): 還原檔 fd
+
+        Returns:
+            list: 依序的分塊摘要
+        """
+        # {分塊摘要: [還原檔中的位置]}, 重複的分塊只下載一次
+        positions = {}
+        lengths = {}
+        offset = 0
+        for digest, length in recipe['chunks']:
+            positions.setdefault(digest, []).append(offset)
+            lengths[digest] = length
+            offset += length
+        if offset != recipe['size']:
+            raise IOError(f'{recipe["name"]} 說明檔分塊合計 {offset} bytes, 應為 {recipe["size"]} bytes')
+
+        # {pack 檔名: [(pack 內位置, 儲存大小, 壓縮格式, 分塊摘要, 原始大小, [還原檔中的位置])]}
+        packs = {}
+        for digest, offsets in positions.items():
+            pack, pack_offset, stored_length, codec = recipe['locations'][digest]
+            packs.setdefault(pack, []).append((pack_offset, stored_length, codec, digest, lengths[digest], offsets))
+
+        files = self.__get_pack_files()
+        missing = [pack for pack in packs if pack not in files]
+        if missing:
+            raise FileNotFoundError(f'{recipe["name"]} 缺少 pack 檔 {", ".join(missing)}')
+
+        with ThreadPoolExecutor(max_workers=self.connections) as executor:
+            futures = [executor.submit(self.__download_pack, files[pack], sorted(entries), fd) for pack, entries in packs.items()]
+            for future in futures:
+                future.result()
+        return [digest for digest, _ in recipe['chunks']]
+
+    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=2, min=2, max=60), reraise=True)
+    def __download_pack(self, node: dict, entries: list, fd: int):
+        """串流下載 pack 檔 解密後只保留需要的分塊, 解壓縮並驗證摘要後寫入還原檔 失敗時整個 pack 檔重新下載
+
+        需要的分塊都已寫入時 不再下載 pack 檔的其餘內容
+
+        Args:
+            node (dict): 已解密的檔案節點
+            entries (list): 依 pack 內位置排序的 [(pack 內位置, 儲存大小, 壓縮格式, 分塊摘要, 原始大小, [還原檔中的位置])]
+            fd (int): 還原檔 fd
+        """
+        start = time()
+        response, cipher, _ = self.__open(node)
+        buffer = bytearray()
+        # buffer[0] 在 pack 檔中的位置
+        base = 0
+        downloaded = 0
+        index = 0
+        with response:
+            for block in response.iter_content(DOWNLOAD_BLOCK_SIZE):
+                downloaded += len(block)
+                buffer += cipher.decrypt(block)
+                while index < len(entries) and base + len(buffer) >= entries[index][0] + entries[index][1]:
+                    pack_offset, stored_length, codec, digest, length, offsets = entries[index]
+                    self.__write_chunk(buffer[pack_offset - base:pack_offset - base + stored_length], codec, digest, length, offsets, fd)
+                    index += 1
+                if index == len(entries):
+                    break
+                # 丟棄下一個需要的分塊之前的內容
+                drop = min(entries[index][0] - base, len(buffer))
+                del buffer[:drop]
+                base += drop
+        if index != len(entries):
+            raise IOError(f'{node["a"]["n"]} 大小不足 缺少 {len(entries) - index} 個分塊')
+
+        self.metrics.inc('mega_restore_bytes_total', downloaded)
+        self.metrics.observe('mega_restore_part_seconds', time() - start)
+        logger.info(f'{node["a"]["n"]} 已下載 {downloaded} bytes, {len(entries)} 個分塊')
+
+    def __write_chunk(self, stored: bytearray, codec: str, digest: str, length: int, offsets: list, fd: int):
+        """解壓縮並驗證分塊 寫入還原檔中的各個位置
+
+        Args:
+            stored (bytearray): 儲存的內容
+            codec (str): 壓縮格式 None 為不壓縮
+            digest (str): 分塊摘要
+            length (int): 原始大小
+            offsets (list): 還原檔中的位置
+            fd (int): 還原檔 fd
+        """
+        data = stored
+        if codec:
+            decompressor = get_decompressor(codec)
+            data = decompressor.decompress(stored)
+            if hasattr(decompressor, 'flush'):
+                data += decompressor.flush()
+        if len(data) != length or hashlib.new(DIGEST_ALGORITHM, data).hexdigest() != digest:
+            raise IOError(f'分塊 {digest} 摘要不符')
+        for offset in offsets:
+            view = memoryview(data)
+            while view:
+                n = os.pwrite(fd, view, offset)
+                view = view[n:]
+                offset += n
@@ -0,0 +1,205 @@
+from .mega_log import logger
+from .mega_client import Mega_Custom
+from .mega_metrics import MegaMetrics
+from time import time
+import threading
+import fcntl
+import json
+import os
+
+
+class MegaSession:
+    """共用 mega 登入 session
+
+    同一程序內 相同帳號只登入一次, 並將 session (sid, master_key) 存至快取檔
+    重新啟動 或 其他 -u N 上傳程序 可直接使用快取 略過密碼金鑰計算
+    """
+
+    # 程序內共用的 session {帳號: MegaSession}
+    __instances = {}
+    __instances_lock = threading.Lock()
+
+    def __init__(self, account: str, password: str, cache_path: str = '.mega_session.json', ttl: int = 86400) -> None:
+        """_summary_
+
+        Args:
+            account (str): mega 帳號
+            password (str): mega 密碼
+            cache_path (str, optional): session 快取檔路徑. Defaults to '.mega_session.json'.
+            ttl (int, optional): 快取有效秒數. Defaults to 86400.
+        """
+        self.account = account
+        self.password = password
+        self.cache_path = cache_path
+        self.ttl = ttl
+
+        # API 網址 None 時使用 mega 預設網址
+        self.api_url = None
+
+        self.client = None
+        self.lock = threading.RLock()
+
+    @classmethod
+    def get_instance(cls, account: str, password: str, cache_path: str = None, ttl: int = None):
+        """取得程序內共用的 session, 不存在則建立
+
+        Args:
+            account (str): mega 帳號
+            password (str): mega 密碼
+            cache_path (str, optional): session 快取檔路徑. Defaults to None.
+            ttl (int, optional): 快取有效秒數. Defaults to None.
+
+        Returns:
+            MegaSession: 共用的 session
+        """
+        with cls.__instances_lock:
+            session = cls.__instances.get(account)
+            if session is None:
+                session = cls(account, password)
+                cls.__instances[account] = session
+            if cache_path:
+                session.cache_path = cache_path
+            if ttl:
+                session.ttl = ttl
+            return session
+
+    def set_api_url(self, url: str):
+        """設置 API 網址 (例如本地模擬伺服器) 需在首次 get_client 前設置
+
+        Args:
+            url (str): API 網址
+        """
+        self.api_url = url
+
+    def get_client(self) -> Mega_Custom:
+        """取得已登入的 client, 首次呼叫時才登入
+
+        Returns:
+            Mega_Custom: 已登入的 client
+        """
+        with self.lock:
+            if self.client is None:
+                client = Mega_Custom()
+                client.set_api_url(self.api_url)
+                client.set_session_expired_handler(self.relogin)
+                with self.__cache_lock():
+                    cache = self.__load_cache()
+                    if cache:
+                        logger.debug(f'使用 session 快取 {self.cache_path}')
+                        client.restore_session(cache['sid'], cache['master_key'])
+                    else:
+                        self.__login(client)
+                self.client = client
+            return self.client
+
+    def relogin(self, client: Mega_Custom):
+        """session 被 API 拒絕時 重新登入
+
+        若快取中的 session 已被其他程序更新 直接使用新的 session
+
+        Args:
+            client (Mega_Custom): session 失效的 client
+        """
+        with self.lock:
+            rejected_sid = client.sid
+            with self.__cache_lock():
+                cache = self.__load_cache()
+                if cache and cache['sid'] != rejected_sid:
+                    logger.debug('使用其他程序更新的 session 快取')
+                    client.restore_session(cache['sid'], cache['master_key'])
+                else:
+                    self.__login(client)
+
+    def __login(self, client: Mega_Custom):
+        """登入並寫入快取 需在快取鎖內呼叫
+
+        Args:
+            client (Mega_Custom): client
+        """
+        start = time()
+        client.sid = None
+        client.login_user(self.account, self.password)
+        MegaMetrics.get_instance().observe('mega_login_seconds', time() - start)
+        logger.info(f'mega 登入完成 耗時{round(time() - start, 2)}秒')
+        self.__save_cache(client.sid, client.master_key)
+
+    def __cache_lock(self):
+        """取得跨程序的快取檔鎖
+
+        Returns:
+            _CacheLock: with 使用的鎖
+        """
+        if not self.cache_path:
+            return _CacheLock(None)
+        return _CacheLock(f'{self.cache_path}.lock')
+
+    def __load_cache(self):
+        """讀取 session 快取 無效或過期回傳 None
+
+        Returns:
+            dict: {'account', 'sid', 'master_key', 'ts'}
+        """
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return None
+        try:
+            with open(self.cache_path, 'r') as f:
+                cache = json.loads(f.read())
+        except Exception as err:
+            logger.error(msg=err, exc_info=True)
+            return None
+
+        if cache.get('account') != self.account.lower():
+            return None
+        if time() - cache.get('ts', 0) > self.ttl:
+            logger.debug('session 快取已過期')
+            return None
+        return cache
+
+    def __save_cache(self, sid: str, master_key):
+        """寫入 session 快取 權限 600
+
+        Args:
+            sid (str): session id
+            master_key (_type_): 主金鑰 a32 格式
+        """
+        if not self.cache_path or not sid:
+            return
+
+        cache = {
+            'account': self.account.lower(),
+            'sid': sid,
+            'master_key': list(master_key),
+            'ts': int(time())
+        }
+        temp_path = f'{self.cache_path}.temp'
+        try:
+            fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                f.write(json.dumps(cache))
+            os.chmod(temp_path, 0o600)
+            os.replace(temp_path, self.cache_path)
+        except Exception as err:
+            logger.error(msg=err, exc_info=True)
+
+
+class _CacheLock:
+    """以 flock 實作的跨程序檔案鎖
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.fd = None
+
+    def __enter__(self):
+        if not self.path:
+            return self
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        if self.fd is None:
+            return
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+        self.fd = None
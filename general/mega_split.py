@@ -0,0 +1,370 @@
+from .mega_log import logger
+import hashlib
+import errno
+import lzma
+import json
+import zlib
+import bz2
+import os
+
+
+# 使用者空間複製時的緩衝大小
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# 核心複製不支援時 改用下一種方式的錯誤碼
+_FALLBACK_ERRNO = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF)
+
+
+def copy_range(src_fd: int, dst_fd: int, offset: int, length: int, buffer_size: int = COPY_BUFFER_SIZE, hasher=None) -> int:
+    """將來源檔 offset 起的 length bytes 寫入目標檔目前位置
+
+    依序嘗試 copy_file_range, sendfile (在核心內複製 不經過使用者空間),
+    都不支援時 以固定大小緩衝 pread 複製
+    需要計算摘要時 核心複製後 再以固定緩衝 pread 計算 (剛複製的內容仍在 page cache 不會再讀取磁碟),
+    以緩衝複製時 讀取的同時更新摘要, dst_fd 為 None 時只計算摘要
+    不移動來源檔位置 可多執行緒共用來源檔
+
+    Args:
+        src_fd (int): 來源檔 fd
+        dst_fd (int): 目標檔 fd
+        offset (int): 來源檔起始位置
+        length (int): 複製長度
+        buffer_size (int, optional): 緩衝大小. Defaults to COPY_BUFFER_SIZE.
+        hasher (_type_, optional): hashlib 摘要物件. Defaults to None.
+
+    Returns:
+        int: 已複製的 bytes
+    """
+    if dst_fd is None:
+        return _copy_buffered(src_fd, None, offset, length, buffer_size, hasher)
+
+    copied, done = _copy_kernel(src_fd, dst_fd, offset, length)
+    if not done:
+        if not copied:
+            return _copy_buffered(src_fd, dst_fd, offset, length, buffer_size, hasher)
+        copied += _copy_buffered(src_fd, dst_fd, offset + copied, length - copied, buffer_size)
+    if hasher is not None:
+        _copy_buffered(src_fd, None, offset, copied, buffer_size, hasher)
+    return copied
+
+
+def _copy_kernel(src_fd: int, dst_fd: int, offset: int, length: int) -> tuple:
+    """依序嘗試 copy_file_range, sendfile 在核心內複製
+
+    Args:
+        src_fd (int): 來源檔 fd
+        dst_fd (int): 目標檔 fd
+        offset (int): 來源檔起始位置
+        length (int): 複製長度
+
+    Returns:
+        tuple: (已複製的 bytes, 是否已完成 False 時剩餘部分需改用緩衝複製)
+    """
+    copied = 0
+
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while copied < length:
+                n = os.copy_file_range(src_fd, dst_fd, min(length - copied, 1 << 30), offset + copied)
+                if n == 0:
+                    return copied, True
+                copied += n
+            return copied, True
+        except OSError as err:
+            if err.errno not in _FALLBACK_ERRNO:
+                raise
+            logger.debug(f'copy_file_range 不支援 改用 sendfile: {err}')
+
+    if hasattr(os, 'sendfile'):
+        try:
+            while copied < length:
+                n = os.sendfile(dst_fd, src_fd, offset + copied, min(length - copied, 1 << 30))
+                if n == 0:
+                    return copied, True
+                copied += n
+            return copied, True
+        except OSError as err:
+            if err.errno not in _FALLBACK_ERRNO:
+                raise
+            logger.debug(f'sendfile 不支援 改用緩衝複製: {err}')
+
+    return copied, False
+
+
+def _copy_buffered(src_fd: int, dst_fd: int, offset: int, length: int, buffer_size: int, hasher=None) -> int:
+    """以固定大小緩衝 pread 複製 重複使用同一個緩衝 不另外配置記憶體
+
+    Args:
+        src_fd (int): 來源檔 fd
+        dst_fd (int): 目標檔 fd, None 時不寫入
+        offset (int): 來源檔起始位置
+        length (int): 複製長度
+        buffer_size (int): 緩衝大小
+        hasher (_type_, optional): hashlib 摘要物件. Defaults to None.
+
+    Returns:
+        int: 已複製的 bytes
+    """
+    buffer = memoryview(bytearray(min(buffer_size, max(length, 1))))
+    copied = 0
+    while copied < length:
+        size = os.preadv(src_fd, [buffer[:min(length - copied, len(buffer))]], offset + copied)
+        if not size:
+            break
+        data = buffer[:size]
+        if hasher is not None:
+            hasher.update(data)
+        while dst_fd is not None and data:
+            n = os.write(dst_fd, data)
+            data = data[n:]
+        copied += size
+    return copied
+
+
+def get_parts(file_size: int, part_size: int):
+    """依分割大小 產生各分割檔的 (編號, 起始位置, 長度) 編號從 1 開始
+
+    Args:
+        file_size (int): 檔案大小
+        part_size (int): 分割大小
+
+    Yields:
+        tuple: (編號, 起始位置, 長度)
+    """
+    number = 1
+    for offset in range(0, file_size, part_size):
+        yield (number, offset, min(part_size, file_size - offset))
+        number += 1
+
+
+# 壓縮格式: 副檔名, 預設壓縮等級, 壓縮物件, 解壓縮物件
+# 各分割檔獨立壓縮 可多執行緒同時壓縮 (壓縮時會釋放 GIL), 還原時各分割檔獨立解壓縮
+CODECS = {
+    'gzip': ('.gz', 6, lambda level: zlib.compressobj(level, zlib.DEFLATED, 31), lambda: zlib.decompressobj(31)),
+    'bz2': ('.bz2', 9, lambda level: bz2.BZ2Compressor(level), lambda: bz2.BZ2Decompressor()),
+    'xz': ('.xz', 6, lambda level: lzma.LZMACompressor(preset=level), lambda: lzma.LZMADecompressor()),
+}
+
+
+def get_codec_extension(codec: str) -> str:
+    """壓縮格式的副檔名
+
+    Args:
+        codec (str): 壓縮格式 None 為不壓縮
+
+    Returns:
+        str: 副檔名, 不壓縮時為空字串
+    """
+    if not codec:
+        return ''
+    if codec not in CODECS:
+        raise ValueError(f'不支援的壓縮格式 {codec}, 可使用 {", ".join(CODECS)}')
+    return CODECS[codec][0]
+
+
+def get_decompressor(codec: str):
+    """建立解壓縮物件
+
+    Args:
+        codec (str): 壓縮格式
+
+    Returns:
+        _type_: 有 decompress() 的解壓縮物件
+    """
+    get_codec_extension(codec)
+    return CODECS[codec][3]()
+
+
+def compress_range(src_fd: int, dst_fd: int, offset: int, length: int, codec: str, level: int = None, hasher=None, buffer_size: int = COPY_BUFFER_SIZE) -> tuple:
+    """將來源檔 offset 起的 length bytes 串流壓縮後 寫入目標檔目前位置
+
+    以固定大小緩衝讀取 記憶體用量不隨分割大小增加, 摘要以壓縮前的內容計算
+
+    Args:
+        src_fd (int): 來源檔 fd
+        dst_fd (int): 目標檔 fd
+        offset (int): 來源檔起始位置
+        length (int): 讀取長度
+        codec (str): 壓縮格式
+        level (int, optional): 壓縮等級. Defaults to 壓縮格式的預設等級.
+        hasher (_type_, optional): hashlib 摘要物件. Defaults to None.
+        buffer_size (int, optional): 緩衝大小. Defaults to COPY_BUFFER_SIZE.
+
+    Returns:
+        tuple: (已讀取的 bytes, 已寫入的 bytes)
+    """
+    get_codec_extension(codec)
+    _, default_level, new_compressor, _ = CODECS[codec]
+    compressor = new_compressor(default_level if level is None else level)
+
+    def write(data):
+        view = memoryview(data)
+        while view:
+            n = os.write(dst_fd, view)
+            view = view[n:]
+        return len(data)
+
+    buffer = memoryview(bytearray(min(buffer_size, max(length, 1))))
+    read = 0
+    written = 0
+    while read < length:
+        size = os.preadv(src_fd, [buffer[:min(length - read, len(buffer))]], offset + read)
+        if not size:
+            break
+        data = buffer[:size]
+        if hasher is not None:
+            hasher.update(data)
+        written += write(compressor.compress(data))
+        read += size
+    written += write(compressor.flush())
+    return read, written
+
+
+# 分割說明檔的副檔名 內容為 各分割檔與整個檔案的摘要
+MANIFEST_EXTENSION = '.manifest'
+# 摘要演算法
+DIGEST_ALGORITHM = 'sha256'
+
+
+def new_hasher():
+    """建立摘要物件
+
+    Returns:
+        _type_: hashlib 摘要物件
+    """
+    return hashlib.new(DIGEST_ALGORITHM)
+
+
+def write_manifest(path: str, file_size: int, part_size: int, parts: list, codec: str = None) -> str:
+    """寫入分割說明檔 {檔名}.manifest
+
+    整個檔案的摘要 為依序串接各分割檔摘要後 再計算的摘要,
+    各分割檔可同時計算 不需再讀取一次整個檔案, 分割範圍沒有摘要時 整個檔案的摘要為 None
+    摘要 位置 長度 皆以壓縮前的內容計算, 壓縮後的大小記錄於 stored_length
+
+    Args:
+        path (str): 原檔路徑
+        file_size (int): 原檔大小
+        part_size (int): 分割大小
+        parts (list): 依編號排序的 [{'name', 'offset', 'length', 'digest', 'stored_length'(壓縮時)}]
+        codec (str, optional): 壓縮格式. Defaults to 不壓縮.
+
+    Returns:
+        str: 說明檔路徑
+    """
+    digest = new_hasher()
+    for part in parts:
+        if 'digest' not in part:
+            digest = None
+            break
+        digest.update(bytes.fromhex(part['digest']))
+    manifest = {
+        'name': os.path.basename(path),
+        'size': file_size,
+        'part_size': part_size,
+        'algorithm': DIGEST_ALGORITHM,
+        'digest': digest.hexdigest() if digest is not None else None,
+        'codec': codec,
+        'parts': parts
+    }
+    manifest_path = f'{path}{MANIFEST_EXTENSION}'
+    with open(f'{manifest_path}.temp', 'w') as f:
+        f.write(json.dumps(manifest))
+    os.replace(f'{manifest_path}.temp', manifest_path)
+    return manifest_path
+
+
+def read_manifest(path: str) -> dict:
+    """讀取分割說明檔
+
+    Args:
+        path (str): 說明檔路徑
+
+    Returns:
+        dict: {'name', 'size', 'part_size', 'algorithm', 'digest', 'codec', 'parts'}
+    """
+    with open(path, 'r') as f:
+        return json.loads(f.read())
+
+
+# 虛擬分割檔的副檔名 內容為 來源檔 起始位置 長度
+VIRTUAL_PART_EXTENSION = '.vpart'
+# 虛擬分割後 來源檔改名的副檔名 避免再次被分割
+SOURCE_EXTENSION = '.src'
+
+
+def write_virtual_parts(path: str, part_size: int) -> int:
+    """虛擬分割 不複製資料 只寫入各分割檔的說明檔 (來源檔, 起始位置, 長度)
+
+    來源檔改名為 {檔名}.src, 說明檔名為 {檔名}._{編號}.vpart
+    說明檔先寫入 .temp, 來源檔改名後才改為正式檔名
+
+    Args:
+        path (str): 檔案路徑
+        part_size (int): 分割大小
+
+    Returns:
+        int: 分割數
+    """
+    filename = os.path.basename(path)
+    file_dir = os.path.dirname(path)
+    source = f'{filename}{SOURCE_EXTENSION}'
+
+    manifests = []
+    for number, offset, length in get_parts(os.path.getsize(path), part_size):
+        part = {
+            'name': f'{filename}._{number}',
+            'source': source,
+            'offset': offset,
+            'length': length
+        }
+        manifest_path = os.path.join(file_dir, f'{part["name"]}{VIRTUAL_PART_EXTENSION}')
+        with open(f'{manifest_path}.temp', 'w') as f:
+            f.write(json.dumps(part))
+        manifests.append(manifest_path)
+
+    os.rename(path, os.path.join(file_dir, source))
+    for manifest_path in manifests:
+        os.rename(f'{manifest_path}.temp', manifest_path)
+    return len(manifests)
+
+
+def read_virtual_part(path: str) -> dict:
+    """讀取虛擬分割檔的說明檔
+
+    Args:
+        path (str): 說明檔路徑
+
+    Returns:
+        dict: {'name', 'source', 'offset', 'length', 'source_path'}
+    """
+    with open(path, 'r') as f:
+        part = json.loads(f.read())
+    part['source_path'] = os.path.join(os.path.dirname(path), part['source'])
+    return part
+
+
+def remove_virtual_part(path: str, part: dict) -> bool:
+    """刪除已上傳的說明檔 若來源檔已無其他說明檔 一併刪除來源檔
+
+    Args:
+        path (str): 說明檔路徑
+        part (dict): 說明檔內容
+
+    Returns:
+        bool: 是否已刪除來源檔
+    """
+    os.remove(path)
+
+    file_dir = os.path.dirname(path)
+    prefix = f'{part["source"][:-len(SOURCE_EXTENSION)]}._'
+    # 只比對說明檔 略過 .journal .lease 等附屬檔
+    for name in os.listdir(file_dir):
+        if name.startswith(prefix) and name.endswith(VIRTUAL_PART_EXTENSION):
+            return False
+
+    try:
+        os.remove(part['source_path'])
+    except FileNotFoundError:
+        return False
+    return True
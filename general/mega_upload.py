@@ -0,0 +1,401 @@
+from .mega_log import logger, ProgressThrottle
+from .crypto import a32_to_str, aes_cbc_mac, get_chunks
+from .mega_http import MegaHttpSession
+from .mega_metrics import MegaMetrics
+from .mega_bandwidth import BandwidthLimiter, ThrottledBody
+from mega.errors import RequestError
+from Crypto.Cipher import AES
+from Crypto.Util import Counter
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from time import perf_counter
+import threading
+import queue
+import os
+
+
+# mega 上傳網址錯誤碼: 上傳網址已過期
+EEXPIRED = -8
+
+
+class SendSizer:
+    """依量測的 RTT 與每條連線吞吐量 調整每次 POST 的大小
+
+    每次 POST 的時間約為 RTT + 大小 / 吞吐量, 以最近的 (大小, 時間) 線性迴歸估計兩者,
+    調整大小使 RTT 佔 POST 時間的比例不超過 overhead, 高延遲連線以較大的 POST 減少請求次數
+    多個檔案與執行緒共用 延續已量測的結果
+    """
+
+    def __init__(self, min_size: int = 1024 * 1024, max_size: int = 16 * 1024 * 1024, overhead: float = 0.1, window: int = 32) -> None:
+        """_summary_
+
+        Args:
+            min_size (int, optional): 最小 POST 大小. Defaults to 1MB.
+            max_size (int, optional): 最大 POST 大小 也限制每條連線佔用的記憶體. Defaults to 16MB.
+            overhead (float, optional): RTT 佔 POST 時間的比例上限. Defaults to 0.1.
+            window (int, optional): 估計使用的最近量測數. Defaults to 32.
+        """
+        self.min_size = min_size
+        self.max_size = max(min_size, max_size)
+        self.overhead = overhead
+        self.lock = threading.Lock()
+        # [(大小, 秒數)]
+        self.samples = deque(maxlen=window)
+        self.send_size = min_size
+        self.rtt = None
+        self.throughput = None
+
+    def set_max_size(self, size: int):
+        """設置 最大 POST 大小
+
+        Args:
+            size (int): bytes
+        """
+        with self.lock:
+            self.max_size = max(self.min_size, size)
+            self.send_size = min(self.send_size, self.max_size)
+
+    def get_send_size(self) -> int:
+        """目前的 POST 大小
+
+        Returns:
+            int: bytes
+        """
+        return self.send_size
+
+    def observe(self, size: int, elapsed: float):
+        """記錄一次 POST 並重新估計大小
+
+        Args:
+            size (int): POST 大小
+            elapsed (float): 秒數
+        """
+        with self.lock:
+            self.samples.append((size, elapsed))
+            n = len(self.samples)
+            mean_size = sum(x for x, _ in self.samples) / n
+            mean_elapsed = sum(y for _, y in self.samples) / n
+            var_size = sum((x - mean_size) ** 2 for x, _ in self.samples)
+            # 大小都相同時 無法區分 RTT 與傳輸時間 維持目前大小
+            if var_size <= 0:
+                return
+            slope = sum((x - mean_size) * (y - mean_elapsed) for x, y in self.samples) / var_size
+            rtt = mean_elapsed - slope * mean_size
+            if slope <= 0:
+                # 時間與大小無關 請求開銷為主
+                send_size = self.max_size
+            elif rtt <= 0:
+                send_size = self.min_size
+            else:
+                self.rtt = rtt
+                self.throughput = 1 / slope
+                send_size = int(self.throughput * rtt * (1 - self.overhead) / self.overhead)
+            self.send_size = min(max(send_size, self.min_size), self.max_size)
+
+
+class ChunkUploader:
+    """將已加密的分塊 以多條連線同時 POST 至 mega 上傳網址
+
+    mega 接受任意順序與大小的範圍 (ul_url/<offset>), 連續的 MAC 分塊合併為一次 POST,
+    合併大小由 SendSizer 依量測結果調整, MAC 分塊的切分不受影響
+    完成上傳的那一個回應會帶回 completion handle
+    """
+
+    def __init__(self, ul_url: str, file_size: int, connections: int = 1, timeout: int = 160, http: MegaHttpSession = None, uploaded: int = 0, on_uploaded=None, sizer: SendSizer = None, limiter: BandwidthLimiter = None) -> None:
+        """_summary_
+
+        Args:
+            ul_url (str): 'u' API 回傳的上傳網址
+            file_size (int): 檔案大小
+            connections (int, optional): 同時進行的 POST 數. Defaults to 1.
+            timeout (int, optional): 每次 POST 的 timeout 秒數. Defaults to 160.
+            http (MegaHttpSession, optional): 連線池. Defaults to 程序內共用的連線池.
+            uploaded (int, optional): 續傳時已上傳的位元組數. Defaults to 0.
+            on_uploaded (callable, optional): POST 確認後呼叫 參數 ({chunk_start: chunk_mac}, 回應內容). Defaults to None.
+            sizer (SendSizer, optional): POST 大小調整. Defaults to 不共用的 SendSizer.
+            limiter (BandwidthLimiter, optional): 頻寬限制. Defaults to 不限制.
+        """
+        self.http = http or MegaHttpSession.get_instance()
+        self.ul_url = ul_url
+        self.file_size = file_size
+        self.connections = max(1, connections)
+        self.timeout = timeout
+        self.on_uploaded = on_uploaded
+        self.sizer = sizer or SendSizer()
+        self.limiter = limiter
+
+        self.executor = ThreadPoolExecutor(max_workers=self.connections)
+        # 限制同時進行中的 POST 數 也限制佔用的記憶體
+        self.slots = threading.BoundedSemaphore(self.connections)
+        self.lock = threading.Lock()
+        self.futures = []
+        # 等待合併的連續分塊 [(chunk_start, chunk, chunk_mac)]
+        self.pending = []
+        self.pending_size = 0
+
+        self.upload_progress = uploaded
+        self.completion_file_handle = None
+        self.error = None
+
+        self.metrics = MegaMetrics.get_instance()
+        self.in_flight = 0
+        # 合併進度 log 避免每個分塊都寫入
+        self.progress = ProgressThrottle()
+
+    def submit(self, chunk_start: int, chunk: bytes, chunk_mac: bytes = None):
+        """加入一個分塊 累積至 POST 大小時送出, 若進行中的 POST 已達上限 等待其中一個完成
+
+        Args:
+            chunk_start (int): 分塊在檔案中的位置
+            chunk (bytes): 已加密的分塊
+            chunk_mac (bytes, optional): 分塊 MAC. Defaults to None.
+        """
+        # 續傳略過已確認的分塊時 不連續的分塊不能合併
+        if self.pending and chunk_start != self.pending[-1][0] + len(self.pending[-1][1]):
+            self.__flush()
+        self.pending.append((chunk_start, chunk, chunk_mac))
+        self.pending_size += len(chunk)
+        if self.pending_size >= self.sizer.get_send_size():
+            self.__flush()
+
+    def wait(self) -> str:
+        """送出剩餘的分塊 等待所有 POST 完成
+
+        Returns:
+            str: completion handle
+        """
+        try:
+            if self.pending:
+                self.__flush()
+            for future in self.futures:
+                future.result()
+        finally:
+            self.executor.shutdown(wait=True)
+        if self.error is not None:
+            raise self.error
+        return self.completion_file_handle
+
+    def __flush(self):
+        """將等待合併的分塊 送出為一次 POST
+        """
+        chunks = self.pending
+        self.pending = []
+        self.pending_size = 0
+        self.slots.acquire()
+        if self.error is not None:
+            self.slots.release()
+            self.executor.shutdown(wait=False)
+            raise self.error
+        self.futures.append(self.executor.submit(self.__post, chunks))
+
+    def __post(self, chunks: list):
+        """POST 連續的分塊
+
+        Args:
+            chunks (list): [(chunk_start, 已加密分塊, chunk_mac)]
+        """
+        try:
+            with self.lock:
+                self.in_flight += 1
+                self.metrics.set_gauge('mega_upload_in_flight_chunks', self.in_flight)
+            data = chunks[0][1] if len(chunks) == 1 else b''.join(chunk for _, chunk, _ in chunks)
+            # 限制頻寬時 逐段取用 token 送出
+            body = ThrottledBody(data, self.limiter) if self.limiter is not None and self.limiter.is_limited() else data
+            start = perf_counter()
+            output_file = self.http.post(
+                f'{self.ul_url}/{chunks[0][0]}',
+                data=body,
+                timeout=self.timeout
+            )
+            output_file.raise_for_status()
+            text = output_file.text
+            elapsed = perf_counter() - start
+            self.__check_response(text)
+            self.metrics.observe('mega_chunk_post_seconds', elapsed)
+            if data:
+                self.sizer.observe(len(data), elapsed)
+                self.metrics.set_gauge('mega_upload_send_size_bytes', self.sizer.get_send_size())
+
+            if self.on_uploaded:
+                chunk_macs = {chunk_start: chunk_mac for chunk_start, _, chunk_mac in chunks if chunk_mac is not None}
+                self.on_uploaded(chunk_macs, text)
+            self.metrics.inc('mega_upload_bytes_total', len(data))
+
+            with self.lock:
+                self.upload_progress += len(data)
+                # 完成整個檔案的回應才會帶 completion handle
+                if text:
+                    self.completion_file_handle = text
+                upload_progress = self.upload_progress
+
+            if self.progress.should_log(upload_progress, self.file_size):
+                # 計算百分比
+                precent = float(round(100 * upload_progress / self.file_size, 1)) if self.file_size else 100.0
+                logger.info('%s of %s uploaded, %s%%', upload_progress, self.file_size, precent)
+        except Exception as err:
+            self.metrics.inc('mega_chunk_post_errors_total')
+            with self.lock:
+                if self.error is None:
+                    self.error = err
+            raise
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+                self.metrics.set_gauge('mega_upload_in_flight_chunks', self.in_flight)
+            self.slots.release()
+
+    def __check_response(self, text: str):
+        """上傳回應若為負數 表示錯誤碼
+
+        Args:
+            text (str): 回應內容
+        """
+        try:
+            code = int(text)
+        except ValueError:
+            return
+        if code < 0:
+            raise RequestError(code)
+
+
+class ChunkEncryptor:
+    """在背景執行緒 讀取檔案 計算分塊 MAC 並 CTR 加密分塊
+
+    結果放入有上限的佇列, 讀取與加密下一塊 可與上一塊的網路傳送同時進行
+    佇列上限決定預先準備的分塊數 也就是佔用的記憶體
+    每個分塊依位置設定 CTR 計數器, 續傳時可略過已確認的分塊
+    """
+
+    def __init__(self, input_file, file_size: int, ul_key: list, queue_depth: int = 2, skip_chunks=(), offset: int = 0) -> None:
+        """_summary_
+
+        Args:
+            input_file (_type_): 已開啟的檔案
+            file_size (int): 上傳的大小
+            ul_key (list): 檔案金鑰 a32 格式 6 個值
+            queue_depth (int, optional): 預先準備的分塊數上限. Defaults to 2.
+            skip_chunks (tuple, optional): 略過的分塊位置. Defaults to ().
+            offset (int, optional): 上傳範圍在檔案中的起始位置. Defaults to 0.
+        """
+        self.input_file = input_file
+        self.file_size = file_size
+        self.offset = offset
+        self.k_str = a32_to_str(ul_key[:4])
+        self.iv_str = a32_to_str([ul_key[4], ul_key[5], ul_key[4], ul_key[5]])
+        self.ctr_initial_value = ((ul_key[4] << 32) + ul_key[5]) << 64
+        self.skip_chunks = set(skip_chunks)
+
+        self.queue = queue.Queue(maxsize=max(1, queue_depth))
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+
+        self.error = None
+        self.metrics = MegaMetrics.get_instance()
+
+    def __iter__(self):
+        """依序取出 (chunk_start, chunk_mac, 已加密分塊)
+        """
+        self.thread.start()
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                yield item
+        finally:
+            self.stop()
+        if self.error is not None:
+            raise self.error
+
+    def stop(self):
+        """停止背景讀取
+        """
+        self.stop_event.set()
+        if self.thread.ident is not None:
+            self.thread.join()
+
+    def encrypt(self, chunk_start: int, chunk: bytes) -> bytes:
+        """CTR 加密 計數器由分塊位置決定
+
+        Args:
+            chunk_start (int): 分塊位置 (16 的倍數)
+            chunk (bytes): 分塊
+
+        Returns:
+            bytes: 已加密分塊
+        """
+        count = Counter.new(128, initial_value=self.ctr_initial_value + chunk_start // 16)
+        return AES.new(self.k_str, AES.MODE_CTR, counter=count).encrypt(chunk)
+
+    def __run(self):
+        """讀取與加密 完成後放入 None 結束
+        """
+        try:
+            for chunk_start, chunk_size in get_chunks(self.file_size):
+                if chunk_start in self.skip_chunks:
+                    continue
+                with self.metrics.timer('mega_disk_read_seconds'):
+                    chunk = self.__read(chunk_start, chunk_size)
+                self.metrics.inc('mega_disk_read_bytes_total', chunk_size)
+                with self.metrics.timer('mega_chunk_mac_seconds'):
+                    chunk_mac = aes_cbc_mac(chunk, self.k_str, self.iv_str)
+                with self.metrics.timer('mega_chunk_ctr_seconds'):
+                    encrypted = self.encrypt(chunk_start, chunk)
+                if not self.__put((chunk_start, chunk_mac, encrypted)):
+                    return
+                self.metrics.set_gauge('mega_encrypt_queue_depth', self.queue.qsize())
+        except Exception as err:
+            self.error = err
+        self.__put(None)
+
+    def __read(self, chunk_start: int, chunk_size: int) -> bytes:
+        """以 pread 讀取分塊 不移動檔案位置
+
+        Args:
+            chunk_start (int): 分塊位置
+            chunk_size (int): 分塊大小
+
+        Returns:
+            bytes: 分塊
+        """
+        fd = self.input_file.fileno()
+        chunk = os.pread(fd, chunk_size, self.offset + chunk_start)
+        while len(chunk) < chunk_size:
+            data = os.pread(fd, chunk_size - len(chunk), self.offset + chunk_start + len(chunk))
+            if not data:
+                raise IOError(f'讀取位置 {self.offset + chunk_start} 時檔案提早結束')
+            chunk += data
+        return chunk
+
+    def __put(self, item) -> bool:
+        """放入佇列 佇列已滿時等待 若已停止回傳 False
+
+        Args:
+            item (_type_): 佇列內容
+
+        Returns:
+            bool: 是否已放入
+        """
+        while not self.stop_event.is_set():
+            try:
+                self.queue.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+
+def file_mac(ul_key: list, chunk_macs: dict) -> bytes:
+    """依分塊位置順序 串接各分塊 MAC 計算檔案 MAC
+
+    Args:
+        ul_key (list): 檔案金鑰 a32 格式
+        chunk_macs (dict): {分塊位置: 分塊 MAC}
+
+    Returns:
+        bytes: 檔案 MAC
+    """
+    if not chunk_macs:
+        return b'\0' * 16
+    mac_encryptor = AES.new(a32_to_str(ul_key[:4]), AES.MODE_CBC, b'\0' * 16)
+    return mac_encryptor.encrypt(b''.join(chunk_macs[chunk_start] for chunk_start in sorted(chunk_macs)))[-16:]
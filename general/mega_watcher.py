@@ -0,0 +1,149 @@
+from .mega_log import logger
+from time import time
+import ctypes.util
+import ctypes
+import select
+import struct
+import os
+
+
+# inotify 事件
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+class DirectoryWatcher:
+    """監聽資料夾 只回傳新寫入完成 或 移入的檔名
+
+    Linux 使用 inotify (IN_CLOSE_WRITE, IN_MOVED_TO),
+    無法使用時 改用 scandir 比對上次的檔名 只回傳新出現的檔名
+    每隔 rescan_interval 秒 回傳全部檔名 讓處理失敗而留下的檔案可以重試
+    """
+
+    def __init__(self, dir_path: str, rescan_interval: int = 60) -> None:
+        """_summary_
+
+        Args:
+            dir_path (str): 監聽路徑
+            rescan_interval (int, optional): 完整掃描間隔秒數. Defaults to 60.
+        """
+        self.dir_path = dir_path
+        self.rescan_interval = rescan_interval
+
+        self.inotify_fd = None
+        self.seen = set()
+        # 建立時先回傳已存在的檔案
+        self.next_rescan = 0
+
+        try:
+            self.inotify_fd = self.__inotify_init()
+            logger.debug(f'使用 inotify 監聽 {dir_path}')
+        except Exception as err:
+            logger.debug(f'無法使用 inotify 改用 scandir 監聽 {dir_path}: {err}')
+
+    def get_files(self, timeout: float = 1) -> list:
+        """等待新檔案 最多等待 timeout 秒
+
+        Args:
+            timeout (float, optional): 等待秒數. Defaults to 1.
+
+        Returns:
+            list: 新檔名, 完整掃描時為所有檔名
+        """
+        if time() >= self.next_rescan:
+            self.next_rescan = time() + self.rescan_interval
+            if self.inotify_fd is not None:
+                # 清除已累積的事件 由完整掃描涵蓋
+                self.__read_events(0)
+            return self.__scan(only_new=False)
+
+        if self.inotify_fd is not None:
+            timeout = min(timeout, max(0, self.next_rescan - time()))
+            return self.__read_events(timeout)
+
+        files = self.__scan(only_new=True)
+        if not files:
+            select.select([], [], [], timeout)
+        return files
+
+    def close(self):
+        """關閉 inotify
+        """
+        if self.inotify_fd is not None:
+            os.close(self.inotify_fd)
+            self.inotify_fd = None
+
+    def __scan(self, only_new: bool) -> list:
+        """scandir 掃描資料夾
+
+        Args:
+            only_new (bool): 只回傳上次掃描後新出現的檔名
+
+        Returns:
+            list: 檔名
+        """
+        with os.scandir(self.dir_path) as entries:
+            names = {entry.name for entry in entries}
+        new_names = names - self.seen
+        self.seen = names
+        if only_new:
+            return sorted(new_names)
+        return sorted(names)
+
+    def __inotify_init(self) -> int:
+        """建立 inotify 監聽
+
+        Returns:
+            int: inotify fd
+        """
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 失敗')
+        wd = libc.inotify_add_watch(fd, os.fsencode(self.dir_path), IN_CLOSE_WRITE | IN_MOVED_TO)
+        if wd < 0:
+            os.close(fd)
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch 失敗')
+        return fd
+
+    def __read_events(self, timeout: float) -> list:
+        """讀取 inotify 事件
+
+        Args:
+            timeout (float): 等待秒數
+
+        Returns:
+            list: 事件中的檔名, 事件佇列溢位時為所有檔名
+        """
+        readable, _, _ = select.select([self.inotify_fd], [], [], timeout)
+        if not readable:
+            return []
+
+        names = []
+        overflow = False
+        while True:
+            try:
+                data = os.read(self.inotify_fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                elif name:
+                    names.append(os.fsdecode(name))
+
+        if overflow:
+            logger.debug('inotify 事件佇列溢位 改為完整掃描')
+            return self.__scan(only_new=False)
+        # 同一檔名只回傳一次 保持事件順序
+        return list(dict.fromkeys(names))
@@ -0,0 +1,54 @@
+from general.mega_session import MegaSession
+from general.mega_http import MegaHttpSession
+from general.mega_restore import MegaRestore
+from general.mega_metrics import MegaMetrics
+from general.mega_log import logger
+import argparse
+import os
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-d', '--date', type=str, default=None, help='日期子資料夾 YYYYMMDD, 未輸入時使用 MEGA_FOLDER_ID')
+parser.add_argument('-n', '--name', type=str, default=None, help='備份檔名 例如 backup.tar, 未輸入時列出備份')
+parser.add_argument('-o', '--output', type=str, default='.', help='還原檔資料夾')
+parser.add_argument('-c', '--connections', type=int, default=None, help='同時下載的分割檔數')
+argv = parser.parse_args()
+
+MEGA_ACCOUNT = os.environ.get('MEGA_ACCOUNT')
+MEGA_PASSWORD = os.environ.get('MEGA_PASSWORD')
+MEGA_FOLDER_ID = os.environ.get('MEGA_FOLDER_ID', None)
+MEGA_SESSION_CACHE = os.environ.get('MEGA_SESSION_CACHE', '.mega_session.json')
+MEGA_SESSION_TTL = int(os.environ.get('MEGA_SESSION_TTL', 86400))
+MEGA_DOWNLOAD_CONNECTIONS = int(os.environ.get('MEGA_DOWNLOAD_CONNECTIONS', 4))
+MEGA_HTTP_POOL_SIZE = int(os.environ.get('MEGA_HTTP_POOL_SIZE', 10))
+MEGA_API_URL = os.environ.get('MEGA_API_URL', None)
+MEGA_METRICS_PATH = os.environ.get('MEGA_METRICS_PATH', None)
+MEGA_METRICS_INTERVAL = int(os.environ.get('MEGA_METRICS_INTERVAL', 15))
+
+connections = argv.connections or MEGA_DOWNLOAD_CONNECTIONS
+
+setting_info = {
+    'MEGA帳號': MEGA_ACCOUNT,
+    'MEGA目標資料夾ID': MEGA_FOLDER_ID,
+    '日期資料夾': argv.date,
+    '備份檔名': argv.name,
+    '還原資料夾': argv.output,
+    '同時下載數': connections,
+    '效能統計檔': MEGA_METRICS_PATH
+}
+logger.debug(setting_info)
+
+if MEGA_METRICS_PATH:
+    # 程序結束時寫入最後一次 含還原的統計
+    MegaMetrics.get_instance().start_exporter(MEGA_METRICS_PATH, MEGA_METRICS_INTERVAL)
+
+mega_session = MegaSession.get_instance(MEGA_ACCOUNT, MEGA_PASSWORD, MEGA_SESSION_CACHE, MEGA_SESSION_TTL)
+if MEGA_API_URL:
+    mega_session.set_api_url(MEGA_API_URL)
+MegaHttpSession.get_instance().set_pool_size(max(MEGA_HTTP_POOL_SIZE, connections + 1))
+
+mr = MegaRestore(mega_session.get_client(), MEGA_FOLDER_ID, connections)
+if argv.name:
+    print(mr.restore(argv.name, argv.output, argv.date))
+else:
+    for name, count in sorted(mr.list_backups(argv.date).items()):
+        print(f'{name}\t{f"{count} 個分割" if count else "去重複"}')
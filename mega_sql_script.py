@@ -7,12 +7,14 @@ parser = argparse.ArgumentParser()
 parser.add_argument('-u', '--mega_upload_id', type=int, default=0)
 parser.add_argument('-s', '--mega_schedule_quantity', type=int, default=0)
 parser.add_argument('-l', '--listen_type', type=int, default=1)
+parser.add_argument('-w', '--workers', type=int, default=1)
 argv = parser.parse_args()
 
 try:
     mega_upload_id = argv.mega_upload_id
     mega_schedule_quantity = argv.mega_schedule_quantity
     listen_type = argv.listen_type
+    workers = argv.workers
 except Exception as err:
     logger.error(msg=err, exc_info=True)
 
@@ -21,6 +23,48 @@ MEGA_PASSWORD = os.environ.get('MEGA_PASSWORD')
 MEGA_LISTEN_DIR = os.environ.get('MEGA_LISTEN_DIR', None)
 MEGA_FOLDER_ID = os.environ.get('MEGA_FOLDER_ID', None)
 MEGA_EXPIRED_DAYS = os.environ.get('MEGA_EXPIRED_DAYS', None)
+MEGA_SESSION_CACHE = os.environ.get('MEGA_SESSION_CACHE', '.mega_session.json')
+MEGA_SESSION_TTL = int(os.environ.get('MEGA_SESSION_TTL', 86400))
+MEGA_UPLOAD_CONNECTIONS = int(os.environ.get('MEGA_UPLOAD_CONNECTIONS', 1))
+MEGA_UPLOAD_QUEUE_DEPTH = int(os.environ.get('MEGA_UPLOAD_QUEUE_DEPTH', 2))
+MEGA_UPLOAD_MAX_SEND_SIZE = int(os.environ.get('MEGA_UPLOAD_MAX_SEND_SIZE', 16))
+MEGA_UPLOAD_BANDWIDTH = os.environ.get('MEGA_UPLOAD_BANDWIDTH', None)
+MEGA_BANDWIDTH_STATE = os.environ.get('MEGA_BANDWIDTH_STATE', '.mega_bandwidth')
+MEGA_HTTP_POOL_SIZE = int(os.environ.get('MEGA_HTTP_POOL_SIZE', 10))
+MEGA_SPLIT_WORKERS = int(os.environ.get('MEGA_SPLIT_WORKERS', 1))
+MEGA_COMPRESSION = os.environ.get('MEGA_COMPRESSION', None)
+MEGA_COMPRESSION_LEVEL = os.environ.get('MEGA_COMPRESSION_LEVEL', None)
+MEGA_DEDUP_INDEX = os.environ.get('MEGA_DEDUP_INDEX', '.mega_chunks.json')
+MEGA_DEDUP_CHUNK_SIZE = int(os.environ.get('MEGA_DEDUP_CHUNK_SIZE', 1024))
+MEGA_DEDUP_PACK_SIZE = int(os.environ.get('MEGA_DEDUP_PACK_SIZE', 64))
+MEGA_RESCAN_INTERVAL = int(os.environ.get('MEGA_RESCAN_INTERVAL', 60))
+MEGA_EXPIRY_RESCAN_INTERVAL = int(os.environ.get('MEGA_EXPIRY_RESCAN_INTERVAL', 3600))
+MEGA_LEASE_TIMEOUT = int(os.environ.get('MEGA_LEASE_TIMEOUT', 300))
+MEGA_NODE_INDEX = os.environ.get('MEGA_NODE_INDEX', '.mega_nodes.json')
+MEGA_API_URL = os.environ.get('MEGA_API_URL', None)
+MEGA_METRICS_PATH = os.environ.get('MEGA_METRICS_PATH', None)
+MEGA_METRICS_INTERVAL = int(os.environ.get('MEGA_METRICS_INTERVAL', 15))
+
+# 虛擬分割 不寫入分割檔
+MEGA_VIRTUAL_PARTS = os.environ.get('MEGA_VIRTUAL_PARTS', False)
+if MEGA_VIRTUAL_PARTS == 'true' or MEGA_VIRTUAL_PARTS == 'True' or MEGA_VIRTUAL_PARTS == '1':
+    MEGA_VIRTUAL_PARTS = True
+else:
+    MEGA_VIRTUAL_PARTS = False
+
+# 分割時計算各分割檔摘要 寫入分割說明檔
+MEGA_SPLIT_DIGEST = os.environ.get('MEGA_SPLIT_DIGEST', True)
+if MEGA_SPLIT_DIGEST == 'false' or MEGA_SPLIT_DIGEST == 'False' or MEGA_SPLIT_DIGEST == '0':
+    MEGA_SPLIT_DIGEST = False
+else:
+    MEGA_SPLIT_DIGEST = True
+
+# 去重複備份 只上傳新的分塊
+MEGA_DEDUP = os.environ.get('MEGA_DEDUP', False)
+if MEGA_DEDUP == 'true' or MEGA_DEDUP == 'True' or MEGA_DEDUP == '1':
+    MEGA_DEDUP = True
+else:
+    MEGA_DEDUP = False
 
 if not MEGA_LISTEN_DIR:
     try:
@@ -56,22 +100,73 @@ ml = MegaListen(
     mega_account=MEGA_ACCOUNT,
     mega_password=MEGA_PASSWORD,
     folder_id=MEGA_FOLDER_ID,
-    listen_type=listen_type
+    listen_type=listen_type,
+    session_cache_path=MEGA_SESSION_CACHE,
+    session_ttl=MEGA_SESSION_TTL,
+    api_url=MEGA_API_URL
 )
 
 if listen_type == 0:
     # 分割設定
     ml.set_file_extension('tar')
+    ml.set_split_workers(MEGA_SPLIT_WORKERS)
+    setting_info['分割 同時寫入數'] = MEGA_SPLIT_WORKERS
+    ml.set_virtual_parts(MEGA_VIRTUAL_PARTS)
+    setting_info['虛擬分割'] = MEGA_VIRTUAL_PARTS
+    ml.set_split_digest(MEGA_SPLIT_DIGEST)
+    setting_info['分割 計算摘要'] = MEGA_SPLIT_DIGEST
+    if MEGA_COMPRESSION:
+        ml.set_compression(MEGA_COMPRESSION, int(MEGA_COMPRESSION_LEVEL) if MEGA_COMPRESSION_LEVEL else None)
+        setting_info['分割 壓縮格式'] = MEGA_COMPRESSION
+        setting_info['分割 壓縮等級'] = MEGA_COMPRESSION_LEVEL
+    if MEGA_DEDUP:
+        ml.set_dedup(MEGA_DEDUP_INDEX, MEGA_DEDUP_CHUNK_SIZE * 1024, MEGA_DEDUP_PACK_SIZE * 1024 * 1024)
+        setting_info['去重複 分塊索引'] = MEGA_DEDUP_INDEX
+        setting_info['去重複 平均分塊大小(KB)'] = MEGA_DEDUP_CHUNK_SIZE
+        setting_info['去重複 pack大小(MB)'] = MEGA_DEDUP_PACK_SIZE
+        # 超過保留天數未使用的 pack 檔 由分割程序刪除, 寬限時間不小於到期排程的重新整理間隔
+        if MEGA_EXPIRED_DAYS:
+            ml.set_expired_days(MEGA_EXPIRED_DAYS)
+            setting_info['保留天數'] = MEGA_EXPIRED_DAYS
+        ml.set_expiry_rescan_interval(MEGA_EXPIRY_RESCAN_INTERVAL)
 elif listen_type == 1:
     # 上傳設定
-    ml.set_pattern(r'\.tar\._[\d]{1,10}$')
+    ml.set_pattern(r'\.tar(\._[\d]{1,10}(\.vpart|\.gz|\.bz2|\.xz)?|\.manifest|\.recipe)$')
     setting_info['監聽資料夾'] = MEGA_LISTEN_DIR
     setting_info['上傳 ID'] = mega_upload_id
-    setting_info['上傳 執行總數'] = mega_schedule_quantity
+    ml.set_lease_timeout(MEGA_LEASE_TIMEOUT)
+    setting_info['上傳 認領逾時'] = MEGA_LEASE_TIMEOUT
+    ml.set_workers(workers)
+    setting_info['上傳 同時檔案數'] = workers
 elif listen_type == 2:
     # 過期天數設定
     ml.set_expired_days(MEGA_EXPIRED_DAYS)
     setting_info['保留天數'] = MEGA_EXPIRED_DAYS
+    ml.set_node_index_path(MEGA_NODE_INDEX)
+    setting_info['節點索引'] = MEGA_NODE_INDEX
+    ml.set_expiry_rescan_interval(MEGA_EXPIRY_RESCAN_INTERVAL)
+    setting_info['到期排程 重新整理間隔'] = MEGA_EXPIRY_RESCAN_INTERVAL
+
+if listen_type == 1 or (listen_type == 0 and MEGA_DEDUP):
+    # 上傳傳輸設定, 去重複備份時 pack 檔由分割程序上傳 同樣套用頻寬限制
+    ml.set_upload_connections(MEGA_UPLOAD_CONNECTIONS)
+    setting_info['上傳 同時分塊數'] = MEGA_UPLOAD_CONNECTIONS
+    ml.set_upload_queue_depth(MEGA_UPLOAD_QUEUE_DEPTH)
+    setting_info['上傳 預先加密分塊數'] = MEGA_UPLOAD_QUEUE_DEPTH
+    ml.set_upload_max_send_size(MEGA_UPLOAD_MAX_SEND_SIZE * 1024 * 1024)
+    setting_info['上傳 POST大小上限(MB)'] = MEGA_UPLOAD_MAX_SEND_SIZE
+    if MEGA_UPLOAD_BANDWIDTH:
+        ml.set_bandwidth(MEGA_UPLOAD_BANDWIDTH, MEGA_BANDWIDTH_STATE)
+        setting_info['上傳 頻寬限制(MB/s)'] = MEGA_UPLOAD_BANDWIDTH
+    ml.set_http_pool_size(max(MEGA_HTTP_POOL_SIZE, MEGA_UPLOAD_CONNECTIONS * workers))
+    setting_info['連線池大小'] = MEGA_HTTP_POOL_SIZE
+
+ml.set_rescan_interval(MEGA_RESCAN_INTERVAL)
+setting_info['完整掃描間隔'] = MEGA_RESCAN_INTERVAL
+
+if MEGA_METRICS_PATH:
+    ml.set_metrics_path(MEGA_METRICS_PATH, MEGA_METRICS_INTERVAL)
+    setting_info['效能統計檔'] = MEGA_METRICS_PATH
 
 logger.debug(setting_info)
 